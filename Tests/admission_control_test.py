@@ -0,0 +1,111 @@
+import sys
+import os
+import threading
+import time
+
+import pytest
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from admission_control import AdmissionController, AdmissionRejectedError, get_caller_id, request_priority, INTERACTIVE, BULK
+from request_metrics import track_request, DeadlineExceededError
+
+def start_holding(controller, caller, priority, release, admitted_order=None):
+    """Runs a request in a thread that holds its slot until release is set"""
+    def run():
+        with controller.admit(caller, priority):
+            if admitted_order is not None:
+                admitted_order.append(caller)
+            release.wait(5)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+def test_interactive_is_admitted_before_earlier_bulk():
+    """When a slot frees up, a waiting interactive request goes before bulk requests that arrived first"""
+    controller = AdmissionController(max_concurrency=1, bulk_concurrency=1, caller_concurrency=4)
+    release_first, release_rest = threading.Event(), threading.Event()
+    order = []
+    threads = [start_holding(controller, "script", BULK, release_first)]
+    wait_until(lambda: controller.report()[BULK]["running"] == 1)
+
+    threads.append(start_holding(controller, "script", BULK, release_rest, order))
+    wait_until(lambda: controller.report()[BULK]["waiting"] == 1)
+    threads.append(start_holding(controller, "teams", INTERACTIVE, release_rest, order))
+    wait_until(lambda: controller.report()[INTERACTIVE]["waiting"] == 1)
+
+    release_first.set()
+    wait_until(lambda: order)
+    release_rest.set()
+    for thread in threads:
+        thread.join()
+    assert order == ["teams", "script"]
+
+def test_bulk_is_capped_and_shed():
+    """Bulk cannot take the interactive slots, and a full bulk queue is rejected at once with 429"""
+    controller = AdmissionController(max_concurrency=3, bulk_concurrency=1, caller_concurrency=4, max_queue={INTERACTIVE: 4, BULK: 0})
+    release = threading.Event()
+    thread = start_holding(controller, "script", BULK, release)
+    wait_until(lambda: controller.report()[BULK]["running"] == 1)
+
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejectedError) as rejected:
+        with controller.admit("script", BULK):
+            pass
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after >= 1
+    assert time.monotonic() - started < 0.5
+
+    with controller.admit("teams", INTERACTIVE):
+        assert controller.report()[INTERACTIVE]["running"] == 1
+    release.set()
+    thread.join()
+    assert controller.report()[BULK]["shed"] == 1
+
+def test_deadlines():
+    """Waiting past the deadline is rejected with 503; once admitted, later stages stop at the deadline"""
+    controller = AdmissionController(max_concurrency=2, bulk_concurrency=1, caller_concurrency=1)
+    release = threading.Event()
+    thread = start_holding(controller, "teams", INTERACTIVE, release)
+    wait_until(lambda: controller.report()[INTERACTIVE]["running"] == 1)
+    with pytest.raises(AdmissionRejectedError) as rejected:
+        with controller.admit("teams", INTERACTIVE, deadline_seconds=0.05):
+            pass
+    assert rejected.value.status_code == 503
+    release.set()
+    thread.join()
+
+    with track_request("kusto_nl_query") as metrics:
+        with controller.admit("teams", INTERACTIVE, deadline_seconds=0.05):
+            assert metrics.attributes["admission"] == {"priority": INTERACTIVE, "caller": "teams"}
+            assert "queue_wait" in metrics.stages
+            with metrics.stage("generate"):
+                time.sleep(0.1)
+            with pytest.raises(DeadlineExceededError):
+                with metrics.stage("query"):
+                    pass
+
+    assert request_priority("teams") == INTERACTIVE
+    assert request_priority("teams", "Bulk") == BULK
+    with pytest.raises(ValueError):
+        request_priority("teams", "urgent")
+
+def test_anonymous_requests_share_only_the_global_limit():
+    """Requests without a caller id are not held to the per-caller limit"""
+    controller = AdmissionController(max_concurrency=3, bulk_concurrency=1, caller_concurrency=1)
+    release = threading.Event()
+    threads = [start_holding(controller, get_caller_id({}), INTERACTIVE, release) for _ in range(3)]
+    wait_until(lambda: controller.report()[INTERACTIVE]["running"] == 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert get_caller_id({"x-caller-id": " user-1 "}) == "user-1"
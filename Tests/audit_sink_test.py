@@ -0,0 +1,54 @@
+import sys
+import os
+import json
+import tempfile
+import threading
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from audit_sink import AuditSink, FileAuditWriter, audit_record
+from request_metrics import RequestMetrics
+
+def test_records_are_batched_to_file():
+    """Records reach the file stand-in in size-bounded batches and on flush"""
+    path = os.path.join(tempfile.mkdtemp(), "audit.jsonl")
+    metrics = RequestMetrics("kusto_nl_query")
+    with metrics.stage("generate"):
+        pass
+    metrics.attributes["query_source"] = "kusto"
+    sink = AuditSink(FileAuditWriter(path), batch_size=2, flush_seconds=60)
+    for index in range(3):
+        sink.record(audit_record(metrics, f"prompt {index}", "GetTenantVersions | count", [{"Count": 1}]))
+    assert sink.flush()
+    with open(path, "r", encoding="utf-8") as audit_file:
+        records = [json.loads(line) for line in audit_file]
+    assert [r["Prompt"] for r in records] == ["prompt 0", "prompt 1", "prompt 2"]
+    assert records[0]["RowCount"] == 1
+    assert records[0]["QuerySource"] == "kusto"
+    assert "generate" in records[0]["StagesMs"]
+
+def test_record_does_not_share_metrics():
+    """Attributes written after the record is built do not reach it, nor race with its serialization"""
+    metrics = RequestMetrics("kusto_nl_query")
+    metrics.attributes["query_source"] = "kusto"
+    record = audit_record(metrics, "prompt")
+    metrics.attributes["error"] = "late"
+    assert "error" not in record["Attributes"]
+
+def test_full_buffer_drops_instead_of_blocking():
+    """A stalled writer never blocks the request thread"""
+    release = threading.Event()
+    class StalledWriter:
+        def write(self, records):
+            release.wait(5)
+    sink = AuditSink(StalledWriter(), batch_size=1, flush_seconds=60, max_queue=2)
+    for index in range(10):
+        sink.record({"Prompt": index})
+    assert sink.dropped >= 7
+    # flush gives up at its timeout instead of waiting for room in the full buffer
+    assert sink.flush(timeout=0.1) is False
+    release.set()
+    assert sink.flush()
@@ -0,0 +1,80 @@
+import sys
+import os
+import json
+import tempfile
+import time
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from eval_sweep import SweepConfig, FakeCompleter, build_system_prompt, gold_set, load_schema_catalog, mark_pareto, run_sweep, score_query, format_table
+
+def test_normalized_comparison():
+    """Reordered filters and group-by keys, inlined lets, whitespace and comments still count as the same query"""
+    gold = """GetTenantVersions
+| where sdpStage == 2 and releaseChannel == "Preview"
+| summarize count() by version, sku"""
+    same = """let channel = "Preview";
+GetTenantVersions // stage 2 only
+| WHERE releaseChannel == channel and sdpStage == 2
+| summarize count() by sku, version"""
+    assert score_query(same, gold) == {"exact": True, "structure": 1.0}
+
+    different = score_query('GetTenantVersions\n| where sdpStage == 3 and releaseChannel == "Preview"\n| summarize count() by version, sku', gold)
+    assert not different["exact"]
+    assert 0 < different["structure"] < 1
+    assert score_query("GetTenantVersions | where (", gold) == {"exact": False, "structure": 0.0}
+
+def test_sweep_reports_pareto_front_and_guardrail():
+    """Configurations are scored with leave-one-out prompts; a faster but worse configuration fails the guardrail"""
+    gold = dict(gold_set())
+    first_question = next(iter(gold))
+    assert first_question not in build_system_prompt(SweepConfig("gpt-4o-mini", 100, "default", 1000), first_question)
+
+    def responder(config, question):
+        # The short prompt forgets the last operator of the first question's query
+        query = gold[question]
+        if config.prompt_variant == "short" and question == first_question:
+            query = query.rsplit("\n|", 1)[0]
+        return f"Here you go:\n```kql\n{query}\n```"
+
+    configs = [
+        SweepConfig("gpt-4o-mini", 10, "default", 1000),
+        SweepConfig("gpt-4o-mini", 0, "short", 1000),
+        SweepConfig("gpt-4o-mini", 10, "default", 16),
+    ]
+    summaries = {s["config"]: s for s in mark_pareto(run_sweep(configs, FakeCompleter(responder), workers=4))}
+
+    baseline, short, truncated = (summaries[config] for config in configs)
+    assert baseline["accuracy"] == 1.0 and baseline["questions"] == len(gold)
+    assert short["accuracy"] < 1.0 and short["latency_p95_ms"] < baseline["latency_p95_ms"]
+    assert baseline["pareto"] and short["pareto"]
+    assert baseline["guardrail"] and not short["guardrail"]
+    assert truncated["completion_tokens"] <= 16 and not truncated["guardrail"]
+    assert "| gpt-4o-mini | 0 | short | 1000 |" in format_table(list(summaries.values()))
+
+def test_catalog_variant_sends_the_schema_block():
+    """As in production, the catalog prompt is paired with the relevant schema in the user message"""
+    path = os.path.join(tempfile.mkdtemp(), "catalog.json")
+    config = SweepConfig("gpt-4o-mini", 0, "catalog", 1000)
+    assert load_schema_catalog(path) is None
+    try:
+        run_sweep([config], FakeCompleter())
+        assert False, "the catalog variant needs a schema catalog"
+    except ValueError:
+        pass
+
+    with open(path, "w", encoding="utf-8") as catalog_file:
+        json.dump({"fetched_at": time.time(), "sources": {"GetTenantVersions": [["version", "string"], ["sdpStage", "string"]]}}, catalog_file)
+    user_prompts = []
+
+    class Recording(FakeCompleter):
+        def __call__(self, config, system_prompt, question, user_prompt=None):
+            user_prompts.append((question, user_prompt))
+            return super().__call__(config, system_prompt, question, user_prompt)
+
+    [summary] = run_sweep([config], Recording(), workers=2, catalog=load_schema_catalog(path))
+    assert summary["accuracy"] == 1.0 and summary["errors"] == 0
+    assert all(user_prompt.startswith("Schema of the functions") and user_prompt.endswith(question) for question, user_prompt in user_prompts)
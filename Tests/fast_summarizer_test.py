@@ -0,0 +1,65 @@
+import sys
+import os
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from fast_summarizer import summarize_distribution, parse_summary_mode
+
+def release_rows():
+    rows = []
+    for channel in ["Preview", "Default", "Stable"]:
+        for stage in [1, 2, 3]:
+            rows.append({"sdpStage1": stage, "version": "0.48.1200.0", "releaseChannel": channel, "count_": 10})
+    rows += [
+        {"sdpStage1": 1, "version": "0.49.1300.0", "releaseChannel": "Preview", "count_": 90},
+        {"sdpStage1": 3, "version": "0.49.1311.0", "releaseChannel": "Preview", "count_": 30},
+        {"sdpStage1": 1, "version": "0.49.1311.0", "releaseChannel": "Default", "count_": 30},
+    ]
+    return rows
+
+def test_release_progress():
+    """The release front is the furthest channel and stage with the latest minor version"""
+    summary = summarize_distribution(release_rows())
+    assert summary.startswith("- Key Findings: Release 0.49 has reached Default Stage 1, with 75 percent of it upgraded.")
+    assert "Preview Stage 1: 90 percent on 0.49." in summary
+    assert "Preview Stage 2: 100 percent on 0.48." in summary
+    assert "Check Preview Stage 1, Preview Stage 2, Preview Stage 3" in summary
+    assert "- Recommendations:" in summary
+
+def test_distribution_shares():
+    """Single-dimension counts are summarized as shares"""
+    summary = summarize_distribution([
+        {"sku": "Developer", "count_": 60},
+        {"sku": "Premium", "count_": 30},
+        {"sku": "Basic", "count_": 10},
+    ])
+    assert "sku has 3 distinct values; Developer accounts for 60 percent, Premium accounts for 30 percent" in summary
+
+def test_other_version_columns_are_dimensions():
+    """windowsVersion is summarized as shares, not as release progress"""
+    summary = summarize_distribution([
+        {"windowsVersion": "10.0.20348", "count_": 75},
+        {"windowsVersion": "10.0.17763", "count_": 25},
+    ])
+    assert "Release" not in summary
+    assert "windowsVersion has 2 distinct values; 10.0.20348 accounts for 75 percent" in summary
+
+def test_unrecognized_shapes_fall_back():
+    """Anything that is not one measure over a few dimensions is left to the LLM"""
+    assert summarize_distribution([]) is None
+    assert summarize_distribution([{"count_": 5}]) is None
+    assert summarize_distribution([{"Region": "westeurope", "ClusterName": "c1", "Endpoint": "e", "Time": "t"}]) is None
+    assert summarize_distribution([{"sku": "Developer", "count_": 5, "sum_capacity": 2}]) is None
+    # Only version, stage, channel, sku, region and Windows version columns are summarized locally
+    assert summarize_distribution([{"serviceName": "a", "count_": 5}, {"serviceName": "b", "count_": 3}]) is None
+    assert "sku has 1 distinct value;" in summarize_distribution([{"sku": "Premium", "count_": 5}])
+    assert parse_summary_mode(None) == "llm"
+    assert parse_summary_mode("FAST") == "fast"
+    try:
+        parse_summary_mode("slow")
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
@@ -0,0 +1,82 @@
+import sys
+import os
+import json
+import tempfile
+
+# Add the parent and prompts directories to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+sys.path.insert(0, os.path.join(parent_dir, "prompts"))
+
+from fine_tuning_generation import augment_example, build_dataset, NearDuplicateFilter
+from system_prompts import SHORT_KUSTO_SYSTEM_PROMPT
+
+SEED = ("What is the current SKU distribution in West Europe?", """
+```kql
+GetTenantVersions
+| where regions contains "west europe"
+| summarize count() by sku
+```
+""")
+
+def test_region_variants():
+    """Swaps the region consistently in the question and the query"""
+    examples = augment_example(SEED)
+    assert examples[0][0] == SEED[0]
+    assert ("What is the current SKU distribution in UK South?", 'GetTenantVersions\n| where regions contains "uk south"\n| summarize count() by sku') in examples
+
+def test_channel_case_and_stage_anchoring():
+    """Channel variants keep the question's case, and only SDP stage literals are rewritten"""
+    examples = augment_example(("Which Preview tenants are in stage 2?", """```kql
+let sdp_stage = '2';
+GetTenantVersions
+| where sdpStage == sdp_stage and releaseChannel == "Preview"
+| where minorVersion == '2'
+```"""))
+    questions = [question for question, _ in examples]
+    assert "Which Stable tenants are in stage 2?" in questions
+    stage_three = dict(examples)["Which Preview tenants are in stage 3?"]
+    assert "let sdp_stage = '3';" in stage_three and "minorVersion == '2'" in stage_three
+
+def test_sku_case_and_gold_versions():
+    """SKU variants keep the question's case, and full versions are only swapped for ones from the seeds"""
+    seed = ("how many premium tenants are on 0.48.23550.0?", """```kql
+GetTenantVersions
+| where sku == "Premium" and version == "0.48.23550.0"
+| count
+```""")
+    questions = [question for question, _ in augment_example(seed, full_versions=["0.48.23550.0", "0.49.24100.0"])]
+    assert "how many basic tenants are on 0.48.23550.0?" in questions
+    assert "how many premium tenants are on 0.49.24100.0?" in questions
+    assert not any("0.47." in question or "0.50." in question for question in questions)
+    assert all("0.48.23550.0" in question for question, _ in augment_example(seed, full_versions=["0.48.23550.0"]))
+
+def test_near_duplicates():
+    """Same query with a reworded question is dropped, a different query is kept"""
+    duplicates = NearDuplicateFilter()
+    assert not duplicates.is_duplicate("sku distribution in west europe", "T | where a == 1")
+    assert duplicates.is_duplicate("SKU distribution in West Europe?", "T\n| where a == 1")
+    assert not duplicates.is_duplicate("sku distribution in west europe", "T | where a == 2")
+
+def test_build_dataset_writes_short_variant():
+    """Both outputs get the same examples with their own system prompt"""
+    directory = tempfile.mkdtemp()
+    full_path = os.path.join(directory, "full.jsonl")
+    short_path = os.path.join(directory, "short.jsonl")
+    seeds = dict([SEED, ("broken", "```kql\nT | where (a\n```")])
+    stats = build_dataset(full_path, short_path, validate=True, seeds=seeds)
+    assert stats["invalid"] == 1
+    with open(short_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == stats["written"] > 1
+    assert records[0]["messages"][0]["content"] == SHORT_KUSTO_SYSTEM_PROMPT
+    assert records[0]["messages"][2]["content"].startswith("```kql\nGetTenantVersions")
+
+if __name__ == "__main__":
+    test_region_variants()
+    test_channel_case_and_stage_anchoring()
+    test_sku_case_and_gold_versions()
+    test_near_duplicates()
+    test_build_dataset_writes_short_variant()
+    print("All fine-tuning generation tests passed.")
@@ -0,0 +1,76 @@
+import sys
+import os
+import tempfile
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from generation_controller import (
+    GenerationBudgets, complete_fenced_query, has_opening_fence, read_fenced_query, intent_of,
+    DEFAULT_MAX_TOKENS, KQL_STOP_SEQUENCES,
+)
+
+def test_stop_sequence_fence_is_restored():
+    """The closing fence removed by the stop sequence is put back so the query can be extracted"""
+    response = "```kql\nGetTenantVersions\n| where releaseChannel == 'Preview'\n```\nThis query lists..."
+    stopped = response[:response.index(KQL_STOP_SEQUENCES[0])]
+    assert KQL_STOP_SEQUENCES[0] not in "```kql\n"
+
+    content, complete = complete_fenced_query(stopped, "stop")
+    assert complete
+    assert content == "```kql\nGetTenantVersions\n| where releaseChannel == 'Preview'\n```"
+
+    _, complete = complete_fenced_query("```kql\nGetTenantVersions\n| where releaseCh", "length")
+    assert not complete
+    # An untagged fence before the query also matches the stop sequence; that is not a query
+    _, complete = complete_fenced_query("Here is the query:\n```", "stop")
+    assert not complete and not has_opening_fence("Here is the query:\n```")
+
+def test_budgets_are_learned_per_intent():
+    """An intent gets its p95 times the margin once it has enough samples; others keep the default"""
+    path = os.path.join(tempfile.mkdtemp(), "budgets.json")
+    budgets = GenerationBudgets(path=path, min_samples=20)
+    question = "How many tenants are on each version in Preview?"
+    assert intent_of(question) == "distribution"
+    assert budgets.budget_for(question) == DEFAULT_MAX_TOKENS
+
+    for tokens in range(41, 61):
+        budgets.record(question, tokens)
+    # p95 of 41..60 is 59, times 1.5 rounded up to a multiple of 64, raised to the 128 floor
+    assert budgets.budget_for(question) == 128
+    assert budgets.budget_for("Which services are quarantined?") == DEFAULT_MAX_TOKENS
+
+    # Recording does not touch the file; it is written by flush (periodically and at exit)
+    assert not os.path.exists(path)
+    budgets.flush()
+    reloaded = GenerationBudgets(path=path, min_samples=20)
+    assert reloaded.budget_for("Show me the version breakdown") == 128
+
+    learned = GenerationBudgets(path=None, min_samples=1)
+    used = learned.learn_from_capture([
+        {"prompt": "Which services are quarantined?", "status": 200, "token_usage": {"generate": {"completion_tokens": 300}}},
+        {"prompt": "Which services are quarantined?", "status": 500, "token_usage": {"generate": {"completion_tokens": 900}}},
+        {"prompt": "Which services are quarantined?", "status": 200, "token_usage": {"generate": {"completion_tokens": 900, "estimated": True}}},
+    ])
+    assert used == 1
+    assert learned.budget_for("List quarantined services") == 512
+
+def test_stream_stops_after_closing_fence():
+    """Reading stops at the delta that closes the block and leaves the rest of the stream unread"""
+    consumed = []
+
+    def deltas():
+        for delta in ["Here is the query:\n```k", "ql\nGetTenantVersions\n", "| count\n``", "`\nThis counts", " every tenant."]:
+            consumed.append(delta)
+            yield delta
+
+    content, cut_short = read_fenced_query(deltas())
+    assert cut_short
+    assert content.endswith("| count\n```")
+    assert len(consumed) == 4
+
+    content, cut_short = read_fenced_query(iter(["GetTenantVersions", None, " | count"]))
+    assert not cut_short
+    assert content == "GetTenantVersions | count"
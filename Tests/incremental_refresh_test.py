@@ -0,0 +1,99 @@
+import sys
+import os
+import re
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from kql_parser import parse_query
+from kql_evaluator import evaluate_operators
+from incremental_refresh import IncrementalSnapshots, delta_query, split_incremental_query
+
+STATUS_QUERY = """GetTenantVersions
+| where sku != "Developer"
+| summarize count() by sdpStage, version
+| order by sdpStage asc"""
+
+def tenant(name, stage, version, sku="Premium", updated="2025-06-24T10:00:00.0000000Z"):
+    return {
+        "resourceId": f"/subscriptions/1/providers/Microsoft.ApiManagement/service/{name}",
+        "serviceName": name, "sdpStage": stage, "version": version, "sku": sku,
+        "LastStateUpdatedTimestamp": updated,
+    }
+
+class FakeKusto:
+    """Runs the per-tenant queries the snapshot sends, with the watermark filter applied by hand"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def __call__(self, query):
+        self.queries.append(query)
+        rows = self.rows
+        watermark = re.search(r"\| where LastStateUpdatedTimestamp >= datetime\(([^)]+)\)", query)
+        if watermark:
+            since = watermark.group(1).rstrip("Z")
+            rows = [row for row in rows if row["LastStateUpdatedTimestamp"].rstrip("Z")[:26] >= since]
+            query = query.replace(watermark.group(0), "")
+        return evaluate_operators(parse_query(query).operators, [dict(row) for row in rows])
+
+def test_delta_refresh_fetches_only_changed_tenants():
+    """After the first full fetch, only tenants updated since the watermark are read and merged"""
+    kusto = FakeKusto([
+        tenant("a", 1, "0.48.1", updated="2025-06-24T09:00:00.0000000Z"),
+        tenant("b", 1, "0.48.1", updated="2025-06-24T09:30:00.0000000Z"),
+        tenant("c", 2, "0.47.9"),
+        tenant("d", 2, "0.47.9", sku="Developer"),
+    ])
+    snapshots = IncrementalSnapshots(overlap_seconds=0)
+
+    first = snapshots.answer(STATUS_QUERY, kusto)
+    assert first.delta is None
+    assert first.rows == [
+        {"sdpStage": 1, "version": "0.48.1", "count_": 2},
+        {"sdpStage": 2, "version": "0.47.9", "count_": 1},
+    ]
+    assert "summarize" not in kusto.queries[0]
+
+    # Tenant c upgrades; tenant b becomes a Developer tenant and drops out of the filter
+    kusto.rows[2] = tenant("c", 2, "0.48.1", updated="2025-06-24T11:00:00.0000000Z")
+    kusto.rows[1] = tenant("b", 1, "0.48.1", sku="Developer", updated="2025-06-24T11:00:00.0000000Z")
+    kusto.queries.clear()
+
+    second = snapshots.answer(STATUS_QUERY, kusto)
+    # One read of the changed tenants; the watermark is the newest timestamp of the snapshot
+    assert len(kusto.queries) == 1
+    assert "LastStateUpdatedTimestamp >= datetime(2025-06-24T10:00:00.000000Z)" in kusto.queries[0]
+    assert second.rows == [
+        {"sdpStage": 1, "version": "0.48.1", "count_": 1},
+        {"sdpStage": 2, "version": "0.48.1", "count_": 1},
+    ]
+    delta = second.delta
+    # b and c changed; d is re-read because it was updated exactly at the watermark
+    assert delta["changed_tenants"] == 3
+    assert delta["fetched_rows"] == 1
+    changes = {(change["group"]["sdpStage"], change["group"]["version"]): change for change in delta["groups"]}
+    assert changes[(1, "0.48.1")]["before"] == {"count_": 2} and changes[(1, "0.48.1")]["after"] == {"count_": 1}
+    assert changes[(2, "0.48.1")]["change"] == "added"
+    assert changes[(2, "0.47.9")]["change"] == "removed"
+
+def test_unsupported_queries_are_not_refreshed():
+    """Other sources, time-relative filters and aggregates the local evaluator cannot compute go to the cluster as before"""
+    kusto = FakeKusto([tenant("a", 1, "0.48.1")])
+    snapshots = IncrementalSnapshots()
+    assert snapshots.answer("GetQuarantinedServicesList\n| count", kusto) is None
+    assert snapshots.answer("GetTenantVersions\n| where LastStateUpdatedTimestamp > ago(1d)\n| count", kusto) is None
+    assert snapshots.answer("GetTenantVersions\n| extend age = now() - LastStateUpdatedTimestamp\n| count", kusto) is None
+    assert snapshots.answer("let cutoff = ago(1d);\nGetTenantVersions\n| where LastStateUpdatedTimestamp > cutoff\n| summarize count() by version", kusto) is None
+    assert snapshots.answer("GetTenantVersions\n| summarize percentile(sdpStage, 50) by version", kusto) is None
+
+def test_delta_keeps_tenants_dropped_by_joins():
+    """With an inner join the changed tenants' keys are unioned in, still in a single query"""
+    query = "GetTenantVersions\n| join kind=inner (Regions) on region\n| where sku != \"Developer\"\n| count"
+    prefix, source, row_operators, _, _ = split_incremental_query(query)
+    text = delta_query(query, prefix, source, row_operators, "2025-06-24T10:00:00.000000Z")
+    assert text.count("where LastStateUpdatedTimestamp") == 1
+    assert "materialize(" in text and "| union (_incremental_changed | project resourceId, _incremental_match = false)" in text
+    assert '| extend _incremental_match = _incremental_match and (sku != "Developer")' in text
@@ -0,0 +1,62 @@
+import sys
+import os
+import tempfile
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from job_queue import JobStore, LocalJobQueue, process_job, _job_backend, JOB_QUEUED, JOB_SUCCEEDED, JOB_FAILED
+
+def handler(request):
+    if request["prompt"] == "fail":
+        raise RuntimeError("boom")
+    return {"echo": request["prompt"]}
+
+def test_local_queue_processes_jobs():
+    """Jobs move from queued to succeeded or failed and keep their result"""
+    store = JobStore(tempfile.mkdtemp())
+    jobs = LocalJobQueue(store, handler, workers=2)
+    ok = store.create({"prompt": "hello"})
+    bad = store.create({"prompt": "fail"})
+    assert ok["status"] == JOB_QUEUED
+    jobs.submit(ok["job_id"])
+    jobs.submit(bad["job_id"])
+    jobs.join()
+    assert store.get(ok["job_id"])["status"] == JOB_SUCCEEDED
+    assert store.get(ok["job_id"])["result"] == {"echo": "hello"}
+    assert store.get(bad["job_id"])["status"] == JOB_FAILED
+    assert store.get(bad["job_id"])["error"] == "boom"
+
+def test_finished_jobs_are_not_rerun():
+    """A redelivered queue message for a finished job does nothing"""
+    store = JobStore(tempfile.mkdtemp())
+    job = store.create({"prompt": "hello"})
+    process_job(store, job["job_id"], handler)
+    assert process_job(store, job["job_id"], lambda request: 1 / 0)["status"] == JOB_SUCCEEDED
+
+def test_unknown_and_unsafe_ids():
+    """Unknown, expired or path-like job ids are not found"""
+    store = JobStore(tempfile.mkdtemp())
+    assert store.get("missing") is None
+    assert store.get("../etc/passwd") is None
+    expired = JobStore(store.directory, ttl_seconds=-1)
+    job = store.create({"prompt": "hello"})
+    assert expired.get(job["job_id"]) is None
+
+def test_missing_jobs_fail_and_functions_backend_needs_shared_store():
+    """A queue message whose job record is missing fails the job instead of leaving it queued"""
+    store = JobStore(tempfile.mkdtemp())
+    assert process_job(store, "missing", handler)["status"] == JOB_FAILED
+    assert store.get("missing")["status"] == JOB_FAILED
+    assert process_job(store, "../etc/passwd", handler) is None
+    assert _job_backend("functions", None) == "local"
+    assert _job_backend("functions", "/mnt/jobs") == "functions"
+
+if __name__ == "__main__":
+    test_local_queue_processes_jobs()
+    test_finished_jobs_are_not_rerun()
+    test_unknown_and_unsafe_ids()
+    test_missing_jobs_fail_and_functions_backend_needs_shared_store()
+    print("All job queue tests passed.")
@@ -0,0 +1,97 @@
+import sys
+import os
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from kql_parser import parse_query
+from kql_evaluator import evaluate_operators, UnsupportedQueryError
+from session_state import SessionStore, answer_from_session
+
+ROWS = [
+    {"serviceName": "a", "sku": "Developer", "version": "0.49.24027.0", "sdpStage": "1", "releaseChannel": "Preview", "regions": "West Europe"},
+    {"serviceName": "b", "sku": "Premium", "version": "0.49.24027.0", "sdpStage": "1", "releaseChannel": "Default", "regions": "East US"},
+    {"serviceName": "c", "sku": "StandardV2", "version": "0.48.23550.0", "sdpStage": "2", "releaseChannel": "Default", "regions": "West Europe"},
+    {"serviceName": "d", "sku": "Premium", "version": "0.48.23550.0", "sdpStage": "2", "releaseChannel": "Preview", "regions": "UK South"},
+]
+
+def run(query: str) -> list:
+    parsed = parse_query(query)
+    return evaluate_operators(parsed.operators, ROWS)
+
+def test_where_summarize_order():
+    """Filters, groups and sorts like the generated distribution queries"""
+    rows = run('T | where sku !contains "v2" | summarize count() by version | order by version desc')
+    assert rows == [
+        {"version": "0.49.24027.0", "count_": 2},
+        {"version": "0.48.23550.0", "count_": 1},
+    ]
+
+def test_string_operators():
+    """contains is a substring match while has needs whole terms"""
+    assert len(run('T | where regions contains "europe"')) == 2
+    assert len(run('T | where sku has "V2"')) == 0
+    assert len(run('T | where releaseChannel in ("Preview", "Stable")')) == 2
+    assert len(run('T | where regions =~ "uk south"')) == 1
+
+def test_extend_project_take():
+    """Extends with simple expressions, projects and limits rows"""
+    rows = run('T | extend Region = tolower(replace_string(regions, " ", "")) | project serviceName, Region | take 1')
+    assert rows == [{"serviceName": "a", "Region": "westeurope"}]
+
+def test_dcount_with_alias():
+    """Named aggregates and dcount over a column"""
+    rows = run('T | summarize tenants = count(), versions = dcount(version) by releaseChannel | order by releaseChannel asc')
+    assert rows == [
+        {"releaseChannel": "Default", "tenants": 2, "versions": 2},
+        {"releaseChannel": "Preview", "tenants": 2, "versions": 2},
+    ]
+
+def test_unsupported_operator():
+    """Operators outside the subset are rejected rather than guessed"""
+    try:
+        run('T | join kind=inner (Other) on serviceName')
+    except UnsupportedQueryError:
+        return
+    assert False, "Expected UnsupportedQueryError"
+
+def test_follow_up_from_session():
+    """A follow-up that appends operators to the previous query is answered locally"""
+    store = SessionStore()
+    previous = "let sdp_stage = '2';\nGetTenantVersions\n| where sdpStage == sdp_stage"
+    store.put("conversation-1", previous, [r for r in ROWS if r["sdpStage"] == "2"])
+    follow_up = "let sdp_stage = '2';\nlet rc = 'Preview';\nGetTenantVersions\n| where sdpStage == sdp_stage\n| where releaseChannel == rc"
+    rows = answer_from_session(store.get("conversation-1"), follow_up)
+    assert [r["serviceName"] for r in rows] == ["d"]
+
+def test_follow_up_needs_cluster():
+    """A follow-up that changes earlier operators cannot be answered from the cache"""
+    store = SessionStore()
+    store.put("conversation-1", "GetTenantVersions | summarize count() by sku", [{"sku": "Premium", "count_": 2}])
+    follow_up = 'GetTenantVersions | where regions contains "west europe" | summarize count() by sku'
+    assert answer_from_session(store.get("conversation-1"), follow_up) is None
+    column_missing = 'GetTenantVersions | summarize count() by sku | where regions contains "west europe"'
+    assert answer_from_session(store.get("conversation-1"), column_missing) is None
+
+def test_mixed_type_follow_up_needs_cluster():
+    """String and mixed-type aggregates or negation fall back to the cluster instead of failing"""
+    store = SessionStore()
+    rows = [{"serviceName": "a", "version": "0.49.24027.0", "sdpStage": 1}, {"serviceName": "b", "version": "0.48.23550.0", "sdpStage": "2"}]
+    store.put("conversation-1", "GetTenantVersions", rows)
+    session = store.get("conversation-1")
+    assert answer_from_session(session, "GetTenantVersions | summarize sum(version)") is None
+    assert answer_from_session(session, "GetTenantVersions | extend x = -version") is None
+    assert answer_from_session(session, "GetTenantVersions | summarize max(sdpStage)") is None
+
+if __name__ == "__main__":
+    test_where_summarize_order()
+    test_string_operators()
+    test_extend_project_take()
+    test_dcount_with_alias()
+    test_unsupported_operator()
+    test_follow_up_from_session()
+    test_follow_up_needs_cluster()
+    test_mixed_type_follow_up_needs_cluster()
+    print("All KQL evaluator tests passed.")
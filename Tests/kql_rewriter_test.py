@@ -0,0 +1,101 @@
+import sys
+import os
+import logging
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+import kql_rewriter
+import request_logging
+from kql_rewriter import rewrite_query, check_equivalence, materialize_repeated_sources
+
+RELEASE_QUERY = '''GetTenantVersions
+| extend Region = tolower(replace_string(regions, " ", ""))
+| join kind = inner (GetRegionalAppsVersion | where component == "RegionalResourceProvider" | distinct Region, ClusterName, sdpStage) on Region
+| where sku !contains "V2"
+| summarize count() by sdpStage1, version, releaseChannel'''
+
+VOCABULARY = {"GetTenantVersions": {
+    "regions": ["West Europe", "North Europe", "East US"],
+    "sku": ["Developer", "Premium", "PremiumV2"],
+}}
+
+SAMPLE_ROWS = {"GetTenantVersions": [
+    {"regions": region, "sku": sku} for region in VOCABULARY["GetTenantVersions"]["regions"] for sku in VOCABULARY["GetTenantVersions"]["sku"]
+]}
+
+def test_predicates_move_before_extend_and_join():
+    """A filter on left-side columns runs before the extend and the inner join"""
+    result = rewrite_query(RELEASE_QUERY)
+    assert result.applied == ["push_predicates_down"]
+    assert result.query.splitlines()[1] == '| where sku !contains "V2"'
+    # Filters on right-side or renamed duplicate columns stay after the join
+    assert rewrite_query(RELEASE_QUERY.replace('sku !contains "V2"', 'ClusterName != "x"')).applied == []
+    assert rewrite_query(RELEASE_QUERY.replace('sku !contains "V2"', 'sdpStage1 == 1')).applied == []
+    # innerunique, the default kind, deduplicates the left side first
+    assert rewrite_query(RELEASE_QUERY.replace("kind = inner ", "")).applied == []
+
+def test_contains_becomes_has_only_when_equivalent():
+    """contains is switched to has only if every known value gives the same answer"""
+    query = 'GetTenantVersions\n| where regions contains "Europe" and sku contains "Premium"\n| summarize count() by sku'
+    result = rewrite_query(query, vocabulary=VOCABULARY, sample_rows=SAMPLE_ROWS)
+    assert result.applied == ["use_term_operators"]
+    assert 'regions has "Europe" and sku contains "Premium"' in result.query
+    assert rewrite_query(query).applied == []
+    assert check_equivalence(query, result.query, SAMPLE_ROWS) is True
+    assert check_equivalence(query, query.replace('sku contains', 'sku has'), SAMPLE_ROWS) is False
+
+def test_join_keys_are_looked_up_and_unchecked_rewrites_reported():
+    """A join key computed from a known column becomes a lookup; rewrites the check cannot run are reported"""
+    result = rewrite_query(RELEASE_QUERY, vocabulary=VOCABULARY, sample_rows=SAMPLE_ROWS)
+    assert result.applied == ["push_predicates_down", "map_join_keys"]
+    assert result.unchecked == ["push_predicates_down", "map_join_keys"]
+    assert result.query.splitlines()[2] == (
+        '| lookup kind=leftouter (datatable(regions:string, Region:string)'
+        '["West Europe", "westeurope", "North Europe", "northeurope", "East US", "eastus"]) on regions'
+    )
+    # Keys over columns without a known vocabulary are left as written
+    assert "map_join_keys" not in rewrite_query(RELEASE_QUERY.replace("regions", "location"), vocabulary=VOCABULARY).applied
+    # Rewrites the evaluator can run on the sample rows are checked
+    query = 'GetTenantVersions\n| where regions contains "Europe"\n| summarize count() by sku'
+    assert rewrite_query(query, vocabulary=VOCABULARY, sample_rows=SAMPLE_ROWS).unchecked == []
+
+def test_materialize_and_join_hints():
+    """Repeated small functions are materialized once; small left sides get a broadcast hint"""
+    query = '''GetQuarantinedServicesList
+| distinct serviceName
+| union (GetQuarantinedServicesList | distinct serviceName)
+| join kind=inner (GetTenantVersions | project serviceName = resourceId, sku) on serviceName'''
+    result = rewrite_query(query)
+    assert result.applied == ["materialize_repeated_sources", "add_join_hints"]
+    assert result.query.startswith("let _materialized_GetQuarantinedServicesList = materialize(GetQuarantinedServicesList());\n")
+    assert result.query.count("_materialized_GetQuarantinedServicesList") == 3
+    assert "join kind=inner hint.strategy=broadcast (GetTenantVersions" in result.query
+    assert rewrite_query("GetTenantVersions | where sku contains ").query == "GetTenantVersions | where sku contains "
+
+def test_functions_called_with_arguments_are_not_materialized():
+    """Calls with arguments are left as written instead of being split mid-call"""
+    query = '''GetSDPRegions("Stage_1")
+| union (GetSDPRegions("Stage_2"))
+| union (GetSDPRegions("Stage_1"))'''
+    assert materialize_repeated_sources(query) is None
+
+def test_rewrite_diff_is_logged_only_for_sampled_requests(caplog, monkeypatch):
+    """Unsampled requests never build the diff; sampled ones log it"""
+    def unified_diff(*args, **kwargs):
+        raise AssertionError("the diff was built for an unsampled request")
+
+    monkeypatch.setattr(request_logging, "LOG_SAMPLE_RATE", 0.0)
+    with caplog.at_level(logging.INFO), monkeypatch.context() as patch:
+        patch.setattr(kql_rewriter.difflib, "unified_diff", unified_diff)
+        with request_logging.request_logging("kusto_nl_query"):
+            assert rewrite_query(RELEASE_QUERY).applied == ["push_predicates_down"]
+        assert not [record for record in caplog.records if "Applied KQL rewrite" in record.getMessage()]
+
+        with request_logging.request_logging("kusto_nl_query", debug=True):
+            patch.undo()
+            rewrite_query(RELEASE_QUERY)
+    [message] = [record.getMessage() for record in caplog.records if "Applied KQL rewrite" in record.getMessage()]
+    assert message.startswith("Applied KQL rewrite push_predicates_down (unchecked):\n--- generated")
@@ -0,0 +1,65 @@
+import sys
+import os
+import tempfile
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from llm_cache import SqliteCacheBackend, CompletionCache, completion_cache_key
+
+MESSAGES = [{"role": "system", "content": "You are a Kusto expert"}, {"role": "user", "content": "How many tenants?"}]
+
+def test_cache_key_covers_request():
+    """The key changes with any part of the request and nothing else"""
+    key = completion_cache_key("gpt-4o-mini", MESSAGES, 0.1, 1000)
+    assert key == completion_cache_key("gpt-4o-mini", [dict(m) for m in MESSAGES], 0.1, 1000)
+    assert key != completion_cache_key("gpt-4o", MESSAGES, 0.1, 1000)
+    assert key != completion_cache_key("gpt-4o-mini", MESSAGES[1:], 0.1, 1000)
+    assert key != completion_cache_key("gpt-4o-mini", MESSAGES, 0.2, 1000)
+    assert key != completion_cache_key("gpt-4o-mini", MESSAGES, 0.1, 500)
+
+def test_sqlite_cache_survives_restart_and_expires():
+    """A second backend on the same file sees the entry until its time-to-live passes"""
+    path = os.path.join(tempfile.mkdtemp(), "cache.sqlite")
+    SqliteCacheBackend(path, ttl_seconds=60).set("a", '{"id": "a"}')
+    assert SqliteCacheBackend(path, ttl_seconds=60).get("a") == '{"id": "a"}'
+    assert SqliteCacheBackend(path, ttl_seconds=0).get("a") is None
+
+def test_sqlite_cache_evicts_least_recently_used():
+    """Entries are evicted oldest-access first once the size bound is exceeded"""
+    backend = SqliteCacheBackend(os.path.join(tempfile.mkdtemp(), "cache.sqlite"), ttl_seconds=60, max_bytes=25)
+    backend.set("a", "x" * 10)
+    backend.set("b", "y" * 10)
+    assert backend.get("a") == "x" * 10
+    backend.set("c", "z" * 10)
+    assert backend.get("b") is None
+    assert backend.get("a") == "x" * 10
+    assert backend.get("c") == "z" * 10
+
+def test_sqlite_cache_keeps_a_running_size_total():
+    """Replacing and expiring entries adjusts the stored total, which other processes read"""
+    path = os.path.join(tempfile.mkdtemp(), "cache.sqlite")
+    backend = SqliteCacheBackend(path, ttl_seconds=60)
+    backend.set("a", "x" * 10)
+    backend.set("a", "x" * 4)
+    backend.set("b", "y" * 6)
+    total = lambda cache: cache._connection.execute("SELECT total FROM cache_size").fetchone()[0]
+    assert total(backend) == 10
+    assert total(SqliteCacheBackend(path, ttl_seconds=60)) == 10
+    expiring = SqliteCacheBackend(path, ttl_seconds=0)
+    expiring.set("c", "z" * 3)
+    assert total(expiring) == 0
+    assert expiring._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0] == 0
+
+def test_cache_errors_are_misses():
+    """A failing backend never fails the LLM call"""
+    class Broken:
+        def get(self, key):
+            raise ConnectionError("down")
+        def set(self, key, value):
+            raise ConnectionError("down")
+    cache = CompletionCache(Broken())
+    assert cache.get("a") is None
+    cache.set("a", "b")
@@ -0,0 +1,49 @@
+import sys
+import os
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from prompts.prompt_compiler import compiled_prompts, compile_prompt, GENERATION_PROMPT, CATALOG_GENERATION_PROMPT, SUMMARY_PROMPT, PromptRegistry
+from prompts.system_prompts import DEFAULT_KUSTO_SYSTEM_PROMPT, KUSTO_RESULTS_SUMMARY_SYSTEM_PROMPT
+from prompts.prompts_dict import prompts_dict
+
+def test_generation_prompt_matches_request_time_build():
+    """The compiled prompt is byte-identical to the one previously built on every request"""
+    expected = DEFAULT_KUSTO_SYSTEM_PROMPT
+    for i, (k, v) in enumerate(prompts_dict.items()):
+        expected += f"\nQuestion {i}: {k}\nKqlQuery: {v}"
+    assert compiled_prompts.get(GENERATION_PROMPT).text == expected
+
+def test_summary_prompt_is_static_prefix():
+    """The summary system prompt starts with the existing static prompt and has no placeholders"""
+    text = compiled_prompts.get(SUMMARY_PROMPT).text
+    assert text.startswith(KUSTO_RESULTS_SUMMARY_SYSTEM_PROMPT)
+    assert "{" not in text[len(KUSTO_RESULTS_SUMMARY_SYSTEM_PROMPT):]
+
+def test_catalog_prompt_keeps_schema_hints():
+    """The catalog prompt drops the column list but keeps how to query the sources and what their columns mean"""
+    text = compiled_prompts.get(CATALOG_GENERATION_PROMPT).text
+    assert 'All("table_name")' in text
+    assert "releaseChannel column" in text
+    assert "GetQuarantinedServicesList" in text
+    assert "has columns like" not in text
+
+def test_report():
+    """Reports hash and tokens, and returns the compiled prompt object itself"""
+    report = {entry["name"]: entry for entry in compiled_prompts.report()}
+    assert report[GENERATION_PROMPT]["token_count"] > 0
+    assert len(report[GENERATION_PROMPT]["sha256"]) == 64
+
+    registry = PromptRegistry()
+    prompt = registry.register(compile_prompt("static", "static text"))
+    assert registry.get("static") is prompt
+
+if __name__ == "__main__":
+    test_generation_prompt_matches_request_time_build()
+    test_summary_prompt_is_static_prefix()
+    test_catalog_prompt_keeps_schema_hints()
+    test_report()
+    print("All prompt compiler tests passed.")
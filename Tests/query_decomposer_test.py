@@ -0,0 +1,79 @@
+import sys
+import os
+import time
+from types import SimpleNamespace
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from query_decomposer import plan_sub_questions, run_sub_questions, combine_results, combined_query_text
+from request_metrics import track_request, current_metrics
+from session_state import is_follow_up
+
+def test_compound_question_is_split():
+    """Enumerated channels and stages become one sub-question per combination"""
+    sub_questions = plan_sub_questions("compare the Preview and Default channel version distributions in stage 2 and 3")
+    assert [s.text for s in sub_questions] == [
+        "Show the Preview channel version distributions in stage 2",
+        "Show the Preview channel version distributions in stage 3",
+        "Show the Default channel version distributions in stage 2",
+        "Show the Default channel version distributions in stage 3",
+    ]
+    assert sub_questions[1].labels == {"releaseChannel": "Preview", "sdpStage": "3"}
+    assert plan_sub_questions("What is the current Tenant Release Status?") == []
+    assert plan_sub_questions("What is the version in stage 3 of Default?") == []
+    # A later number is only a stage when it is a single digit or says so
+    assert plan_sub_questions("Which tenants are in stage 2 and 30 days old?") == []
+    assert [s.labels["sdpStage"] for s in plan_sub_questions("Versions in stage 2 and stage 10")] == ["2", "10"]
+    # Too many combinations stay a single query
+    assert plan_sub_questions("Compare preview, default and stable in stages 1, 2, 3") == []
+
+def test_sub_questions_run_in_parallel_and_combine():
+    """Wall-clock time tracks the slowest sub-query and rows are labelled"""
+    sub_questions = plan_sub_questions("How many tenants are in stages 1, 2 and 3?")
+
+    def generate(question):
+        current_metrics().attributes.setdefault("generated", []).append(question)
+        return f"GetTenantVersions | where sdpStage == {question[-2]} | count"
+
+    def execute(query):
+        time.sleep(0.2)
+        return [{"Count": int(query.split("==")[1].split()[0]) * 10}], "kusto"
+
+    with track_request("kusto_nl_query") as metrics:
+        started = time.monotonic()
+        sub_results = run_sub_questions(sub_questions, generate, execute)
+        elapsed = time.monotonic() - started
+    assert elapsed < 0.5
+    assert len(metrics.attributes["generated"]) == 3
+    assert combine_results(sub_results) == [
+        {"sdpStage": "1", "Count": 10},
+        {"sdpStage": "2", "Count": 20},
+        {"sdpStage": "3", "Count": 30},
+    ]
+    assert combined_query_text(sub_results).startswith("// How many tenants are in stage 1?\nGetTenantVersions")
+
+def test_only_follow_ups_skip_decomposition():
+    """Mid-conversation, a self-contained compound question is still decomposed"""
+    assert not is_follow_up("Compare the Preview and Default version distributions in stage 2 and 3")
+    assert is_follow_up("What about stages 2 and 3?")
+    assert is_follow_up("Break those down by Preview and Default")
+
+def test_sub_questions_record_into_their_own_metrics():
+    """Each sub-question gets child metrics; token usage and list attributes all reach the request"""
+    sub_questions = plan_sub_questions("How many tenants are in stages 1, 2 and 3?")
+
+    def generate(question):
+        metrics = current_metrics()
+        for _ in range(200):
+            metrics.add_token_usage(SimpleNamespace(prompt_tokens=1, completion_tokens=1))
+        metrics.attributes.setdefault("rewrites", []).append(question[-2])
+        return f"GetTenantVersions | where sdpStage == {question[-2]} | count"
+
+    with track_request("kusto_nl_query") as metrics:
+        with metrics.stage("decompose"):
+            run_sub_questions(sub_questions, generate, lambda query: ([], "kusto"))
+    assert metrics.token_usage["decompose"]["prompt_tokens"] == 600
+    assert sorted(metrics.attributes["rewrites"]) == ["1", "2", "3"]
@@ -0,0 +1,71 @@
+import sys
+import os
+import logging
+import re
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+import request_logging
+from request_logging import request_logging as logging_for_request, log_detail, truncated, row_summary, debug_requested
+
+class CountingPayload:
+    """Counts how often it is rendered"""
+    def __init__(self):
+        self.renders = 0
+
+    def __str__(self):
+        self.renders += 1
+        return "payload"
+
+def test_payloads_are_rendered_lazily_and_capped(caplog):
+    """Nothing is formatted for filtered records, and large results are cut without rendering every row"""
+    payload = CountingPayload()
+    with caplog.at_level(logging.INFO):
+        logging.debug("Query response: %s", truncated(payload))
+        assert payload.renders == 0
+
+        rows = [{"version": f"0.48.{i}", "count_": i} for i in range(100000)]
+        logging.info("Query results: %s", truncated(rows, 200))
+        logging.info("Query results: %s", row_summary(rows))
+        logging.info("Summary: %s", truncated("x" * 1000, 50))
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages[0].endswith("more]") and len(messages[0]) < 400
+    assert messages[1] == "Query results: 100000 rows x 2 columns (version, count_)"
+    assert messages[2] == "Summary: " + "x" * 50 + "... (950 more characters)"
+    # A first item over the limit leaves nothing before the marker
+    assert str(truncated([{"message": "x" * 100}, {}], 50)) == "[... 2 more]"
+
+def test_sampling_and_debug_override(caplog, monkeypatch):
+    """Detail logs follow the per-route sample rate; the debug header keeps them, with row contents"""
+    monkeypatch.setattr(request_logging, "LOG_SAMPLE_RATES", {"kusto_nl_query": 0.0})
+    with caplog.at_level(logging.INFO):
+        with logging_for_request("kusto_nl_query"):
+            log_detail(logging.INFO, "Generated Kusto query: %s", truncated("GetTenantVersions | count"))
+            logging.info("Query results: %s", row_summary([{"Count": 3}]))
+        assert [record.getMessage() for record in caplog.records] == ["Query results: 1 rows x 1 columns (Count)"]
+        caplog.clear()
+
+        assert debug_requested({"x-debug-log": "true"})
+        with logging_for_request("kusto_nl_query", debug=True):
+            log_detail(logging.DEBUG, "Generated Kusto query: %s", truncated("GetTenantVersions | count"))
+            logging.info("Query results: %s", row_summary([{"Count": 3}]))
+    assert [record.getMessage() for record in caplog.records] == [
+        "Generated Kusto query: GetTenantVersions | count",
+        'Query results: 1 rows x 1 columns (Count): [{"Count": 3}]',
+    ]
+
+def test_modules_log_lazily():
+    """Log calls in the request path pass %-style arguments instead of building f-strings"""
+    eager = re.compile(r"logging\.(?:debug|info|warning|error|exception|log)\(\s*(?:logging\.\w+,\s*)?f[\"']")
+    modules = [
+        "llm_cache.py", "job_queue.py", "traffic_capture.py", "query_decomposer.py", "tenant_cube.py",
+        "audit_sink.py", "eval_sweep.py", "kql_rewriter.py", "session_state.py", "incremental_refresh.py",
+        os.path.join("prompts", "prompt_compiler.py"),
+    ]
+    for module in modules:
+        with open(os.path.join(parent_dir, module), "r", encoding="utf-8") as source:
+            assert not eager.search(source.read()), module
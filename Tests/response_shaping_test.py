@@ -0,0 +1,57 @@
+import sys
+import os
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from response_shaping import parse_shaping_options, shape_results
+
+RESULTS = [
+    {"version": "0.49.24027.0", "count_": 9},
+    {"version": "0.49.24026.0", "count_": 19},
+    {"version": "0.49.24025.0", "count_": 23},
+    {"version": "0.49.24012.0", "count_": 87},
+    {"version": "0.48.23550.0", "count_": 1},
+]
+
+def test_top_n_with_others():
+    """Keeps the largest rows and folds the rest into an others row that preserves the total"""
+    rows, info = shape_results(RESULTS, max_rows=3, top_n_by="count_", others_bucket=True)
+    assert rows == [
+        {"version": "0.49.24012.0", "count_": 87},
+        {"version": "0.49.24025.0", "count_": 23},
+        {"version": "others", "count_": 29},
+    ]
+    assert info == {"total_row_count": 5, "returned_row_count": 3, "others_row_count": 3, "truncated": True}
+    assert sum(r["count_"] for r in rows) == sum(r["count_"] for r in RESULTS)
+
+def test_truncate_keeps_query_order():
+    """Without top_n_by rows are cut in query order"""
+    rows, info = shape_results(RESULTS, max_rows=2)
+    assert [r["version"] for r in rows] == ["0.49.24027.0", "0.49.24026.0"]
+    assert info["truncated"] and info["others_row_count"] == 0
+
+def test_columns_and_no_truncation():
+    """Projects requested columns and leaves small results alone"""
+    rows, info = shape_results(RESULTS, max_rows=10, columns=["count_", "missing"])
+    assert rows[0] == {"count_": 9}
+    assert not info["truncated"] and info["returned_row_count"] == 5
+
+def test_parse_options():
+    """Parses query string values and rejects bad row limits"""
+    options = parse_shaping_options({"max_rows": "25", "columns": "version, count_", "top_n_by": None, "others_bucket": "true"})
+    assert options == {"max_rows": 25, "columns": ["version", "count_"], "others_bucket": True}
+    try:
+        parse_shaping_options({"max_rows": "many"})
+    except ValueError:
+        return
+    assert False, "Expected ValueError for a non-integer max_rows"
+
+if __name__ == "__main__":
+    test_top_n_with_others()
+    test_truncate_keeps_query_order()
+    test_columns_and_no_truncation()
+    test_parse_options()
+    print("All response shaping tests passed.")
@@ -0,0 +1,90 @@
+import sys
+import os
+import tempfile
+import threading
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from schema_catalog import SchemaCatalog, kusto_schema_fetcher
+
+SCHEMAS = {
+    "GetTenantVersions": [
+        ("serviceName", "string"), ("State", "string"), ("sku", "string"), ("version", "string"),
+        ("regions", "string"), ("sdpStage", "string"), ("vpn", "string"), ("windowsVersion", "dynamic"),
+        ("releaseChannel", "string"), ("message", "dynamic"),
+    ],
+    "GetQuarantinedServicesList": [
+        ("serviceName", "string"), ("sdpStage", "string"), ("datetimeRanges", "string"), ("minorVersionNumbers", "string"),
+    ],
+}
+
+class FakeKusto:
+    """Stands in for the database: answers `<source> | getschema` from SCHEMAS"""
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, query):
+        self.queries.append(query)
+        source = query.split("\n")[0]
+        if source not in SCHEMAS:
+            raise RuntimeError(f"Failed to resolve '{source}'")
+        return [{"ColumnName": name, "ColumnOrdinal": i, "DataType": "System.String", "ColumnType": kind} for i, (name, kind) in enumerate(SCHEMAS[source])]
+
+def loaded(catalog: SchemaCatalog) -> dict:
+    """Load the catalog and wait for the background refresh it started"""
+    catalog.load()
+    if catalog._refresh_thread is not None:
+        catalog._refresh_thread.join(5)
+    return catalog.load()
+
+def test_catalog_is_cached_to_disk():
+    """Schemas are fetched once and later catalogs start from the file"""
+    path = os.path.join(tempfile.mkdtemp(), "catalog.json")
+    kusto = FakeKusto()
+    catalog = SchemaCatalog(kusto_schema_fetcher(kusto), path=path, sources=("GetTenantVersions", "GetQuarantinedServicesList", "GetSDPRegions"))
+    assert sorted(loaded(catalog)["sources"]) == ["GetQuarantinedServicesList", "GetTenantVersions"]
+    assert len(kusto.queries) == 3
+    catalog.load()
+    restarted = SchemaCatalog(kusto_schema_fetcher(kusto), path=path)
+    assert restarted.load()["sources"]["GetTenantVersions"][2] == ["sku", "string"]
+    assert len(kusto.queries) == 3
+    # Stale catalogs are served at once and re-fetched in the background
+    stale = SchemaCatalog(kusto_schema_fetcher(kusto), path=path, refresh_seconds=0, sources=("GetTenantVersions",))
+    assert stale.load() is not None
+    stale._refresh_thread.join(5)
+    assert len(kusto.queries) == 4
+
+def test_requests_never_wait_and_refresh_once():
+    """A cold catalog returns at once; concurrent loads start a single refresh, and write errors keep the fetched catalog"""
+    release = threading.Event()
+    kusto = FakeKusto()
+
+    def slow_fetch(source):
+        release.wait(5)
+        return kusto_schema_fetcher(kusto)(source)
+
+    catalog = SchemaCatalog(slow_fetch, path=os.path.join(tempfile.mkdtemp(), "missing", "catalog.json"), sources=("GetTenantVersions",))
+    assert [catalog.load() for _ in range(5)] == [None] * 5
+    release.set()
+    catalog._refresh_thread.join(5)
+    assert len(kusto.queries) == 1
+    assert "GetTenantVersions" in catalog.load()["sources"]
+
+def test_relevant_schema_is_pruned():
+    """Only the sources and columns a question needs are described"""
+    catalog = SchemaCatalog(kusto_schema_fetcher(FakeKusto()), path=os.path.join(tempfile.mkdtemp(), "catalog.json"), sources=tuple(SCHEMAS))
+    catalog.refresh()
+    schema = catalog.relevant_schema("Which windows versions are on vpn services?")
+    assert "GetTenantVersions: version: string, sku: string, sdpStage: string, releaseChannel: string, regions: string" in schema
+    assert "windowsVersion: dynamic" in schema and "vpn: string" in schema
+    assert "message" not in schema and "datetimeRanges" not in schema
+    assert "GetQuarantinedServicesList: " in catalog.relevant_schema("How many services are quarantined?")
+    assert "GetTenantVersions" in catalog.relevant_schema("hello")
+
+def test_unavailable_database_gives_no_schema():
+    """Without any schema the caller falls back to the full prompt"""
+    catalog = SchemaCatalog(kusto_schema_fetcher(FakeKusto()), path=os.path.join(tempfile.mkdtemp(), "catalog.json"), sources=("Missing",))
+    assert catalog.relevant_schema("Which versions are in stage 1?") is None
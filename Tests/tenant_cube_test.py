@@ -0,0 +1,89 @@
+import sys
+import os
+import tempfile
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from tenant_cube import TenantCube, write_tenant_cube
+
+CELLS = [
+    {"sdpStage": "1", "releaseChannel": "Preview", "regions": "West Europe", "sku": "Developer", "version": "0.49.24027.0", "count_": 5},
+    {"sdpStage": "1", "releaseChannel": "Default", "regions": "West Europe", "sku": "Premium", "version": "0.49.24027.0", "count_": 3},
+    {"sdpStage": "1", "releaseChannel": "Default", "regions": "East US", "sku": "StandardV2", "version": "0.48.23550.0", "count_": 7},
+    {"sdpStage": "2", "releaseChannel": "Preview", "regions": "East US", "sku": "Premium", "version": "0.48.23550.0", "count_": 2},
+]
+
+def open_cube() -> TenantCube:
+    path = os.path.join(tempfile.mkdtemp(), "cube.bin")
+    write_tenant_cube(CELLS, path)
+    return TenantCube(path, max_age_seconds=60)
+
+def test_roll_up_with_filters():
+    """Answers the sku v1 version distribution example from the system prompt"""
+    cube = open_cube()
+    rows = cube.answer("let sdp_stage = '1';\nGetTenantVersions\n| where sku !contains \"v2\"\n| where sdpStage == sdp_stage\n| summarize count() by version\n| order by version desc")
+    assert rows == [{"version": "0.49.24027.0", "count_": 8}]
+
+def test_dead_extend_and_dcount():
+    """Ignores unused extends and supports dcount over a dimension"""
+    cube = open_cube()
+    rows = cube.answer("GetTenantVersions\n| extend release_channel = parse_json(message)['ReleaseChannel']\n| summarize versions = dcount(version) by regions\n| order by regions asc")
+    assert rows == [{"regions": "East US", "versions": 1}, {"regions": "West Europe", "versions": 1}]
+
+def test_total_count():
+    """A summarize without keys returns a single total row"""
+    cube = open_cube()
+    assert cube.answer("GetTenantVersions | where regions contains \"europe\" | summarize count()") == [{"count_": 8}]
+
+def test_unsupported_shapes():
+    """Queries outside the cube dimensions go to the cluster"""
+    cube = open_cube()
+    assert cube.answer("GetTenantVersions | summarize count() by serviceName") is None
+    assert cube.answer("GetTenantVersions | where State == \"Active\" | summarize count() by sku") is None
+    assert cube.answer("GetQuarantinedServicesList | summarize count() by sdpStage") is None
+    assert cube.answer("GetTenantVersions | extend Region = tolower(regions) | summarize count() by Region") is None
+    # Extended columns used by a later filter, or replacing a dimension, are not cube dimensions
+    assert cube.answer("GetTenantVersions | extend stage = toint(sdpStage) | where stage > 1 | summarize count()") is None
+    assert cube.answer("GetTenantVersions | extend sdpStage = \"2\" | where sdpStage == \"2\" | summarize count()") is None
+
+def test_stale_cube():
+    """A cube older than its maximum age is not used"""
+    cube = open_cube()
+    cube.max_age_seconds = -1
+    assert cube.answer("GetTenantVersions | summarize count() by sku") is None
+
+def test_sample_rows_are_decoded_once_per_cube_file():
+    """Repeated calls share the decoded rows until a new cube is written"""
+    cube = open_cube()
+    rows = cube.sample_rows()
+    assert len(rows) == len(CELLS) and cube.sample_rows() is rows
+    assert cube.vocabulary() is cube.vocabulary()
+    write_tenant_cube(CELLS[:2], cube.path)
+    assert len(cube.sample_rows()) == 2
+
+if __name__ == "__main__":
+    test_roll_up_with_filters()
+    test_dead_extend_and_dcount()
+    test_total_count()
+    test_unsupported_shapes()
+    test_stale_cube()
+    test_sample_rows_are_decoded_once_per_cube_file()
+    print("All tenant cube tests passed.")
+
+def test_missing_cube_is_built_in_the_background():
+    """An instance without the timer's cube builds its own and answers once it is ready"""
+    path = os.path.join(tempfile.mkdtemp(), "cube.bin")
+    queries = []
+
+    def kusto(query):
+        queries.append(query)
+        return CELLS
+
+    cube = TenantCube(path, max_age_seconds=60, kusto_executor=kusto)
+    assert cube.answer("GetTenantVersions | summarize count() by sku") is None
+    cube._refresh_thread.join(5)
+    assert len(queries) == 1
+    assert cube.answer("GetTenantVersions | where sdpStage == \"2\" | summarize count()") == [{"count_": 2}]
@@ -0,0 +1,77 @@
+import sys
+import os
+import json
+
+# Add the parent directory to the Python path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+
+from traffic_capture import ReplayStandIns, result_shape
+from load_replay import percentile, replay, send_request
+
+ROWS = [{"version": "0.49.24027.0", "count_": 9}, {"version": "0.49.24026.0", "count_": 19}]
+RECORD = {
+    "route": "kusto_nl_query",
+    "status": 200,
+    "prompt": "what is the version distribution in sdp stage 1?",
+    "generated_query": "GetTenantVersions | summarize count() by version",
+    "result_shape": result_shape(ROWS * 50),
+    "summary_chars": 120,
+    "stages_ms": {"generate": 1, "query": 1, "summarize": 1},
+}
+
+def test_standins_reproduce_payload_size():
+    """Stand-in results have the recorded row count, columns and roughly the recorded size"""
+    standins = ReplayStandIns([RECORD])
+    query = standins.generate_query(RECORD["prompt"])
+    rows = standins.execute_query(query)
+    shape = result_shape(rows)
+    assert shape["row_count"] == 100
+    assert shape["columns"] == ["version", "count_"]
+    assert abs(shape["bytes"] - RECORD["result_shape"]["bytes"]) < 0.05 * RECORD["result_shape"]["bytes"]
+    assert len(standins.summarize(query)) == 120
+
+def test_replay_report():
+    """Reports throughput, error rate and latency percentiles"""
+    outcomes = iter([(200, 10.0, 5), (200, 20.0, 5), (500, 1.0, 5), (200, 30.0, 5)])
+    report = replay([RECORD], lambda record: next(outcomes), rate=1000, concurrency=1, total_requests=4)
+    assert report["requests"] == 4
+    assert report["error_rate"] == 0.25
+    assert report["latency_ms"]["p50"] == 20.0
+    assert report["latency_ms"]["max"] == 30.0
+
+def test_async_jobs_replay_on_the_public_route_with_their_options(monkeypatch):
+    """Captured jobs are sent to kusto_nl_query with async and the other captured options"""
+    sent = {}
+
+    class Response:
+        status = 202
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            return False
+        def read(self):
+            return b"{}"
+
+    def urlopen(request, timeout):
+        sent["url"], sent["body"] = request.full_url, json.loads(request.data)
+        return Response()
+
+    monkeypatch.setattr("urllib.request.urlopen", urlopen)
+    job = dict(RECORD, route="kusto_nl_job", request_options={"async": True, "conversation_id": "c-1", "max_rows": "20", "summary": "fast"})
+    status, _, _ = send_request("http://localhost:7071/api", job)
+    assert status == 202
+    assert sent["url"] == "http://localhost:7071/api/kusto_nl_query"
+    assert sent["body"] == {"async": True, "conversation_id": "c-1", "max_rows": "20", "summary": "fast", "prompt": RECORD["prompt"]}
+
+def test_percentile():
+    """Nearest-rank percentiles"""
+    assert percentile(list(range(1, 101)), 0.95) == 95
+    assert percentile([], 0.5) == 0.0
+
+if __name__ == "__main__":
+    test_standins_reproduce_payload_size()
+    test_replay_report()
+    test_percentile()
+    print("All traffic replay tests passed.")
@@ -0,0 +1,221 @@
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+from request_metrics import current_metrics
+
+ADMISSION_CONTROL_ENABLED = os.environ.get("ADMISSION_CONTROL_ENABLED", "true").lower() not in ("0", "false", "no", "off")
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get("ADMISSION_MAX_CONCURRENCY", 8))
+ADMISSION_BULK_CONCURRENCY = int(os.environ.get("ADMISSION_BULK_CONCURRENCY", 2))
+ADMISSION_CALLER_CONCURRENCY = int(os.environ.get("ADMISSION_CALLER_CONCURRENCY", 4))
+ADMISSION_INTERACTIVE_QUEUE = int(os.environ.get("ADMISSION_INTERACTIVE_QUEUE", 16))
+ADMISSION_BULK_QUEUE = int(os.environ.get("ADMISSION_BULK_QUEUE", 32))
+ADMISSION_INTERACTIVE_DEADLINE_SECONDS = float(os.environ.get("ADMISSION_INTERACTIVE_DEADLINE_SECONDS", 30))
+ADMISSION_BULK_DEADLINE_SECONDS = float(os.environ.get("ADMISSION_BULK_DEADLINE_SECONDS", 300))
+ADMISSION_BULK_CALLERS = {caller.strip() for caller in os.environ.get("ADMISSION_BULK_CALLERS", "").split(",") if caller.strip()}
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+# Headers that identify the caller, most specific first
+CALLER_HEADERS = ("x-caller-id", "x-ms-client-principal-name", "x-ms-client-principal-id")
+# Requests that name no caller share this id; they are not held to the per-caller limit
+ANONYMOUS_CALLER = "anonymous"
+
+
+class AdmissionRejectedError(Exception):
+    """
+    Raised when a request is shed or cannot start before its deadline.
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def get_caller_id(headers) -> str:
+    """
+    Identify the caller from the request headers, or ANONYMOUS_CALLER.
+    """
+    for header in CALLER_HEADERS:
+        value = headers.get(header)
+        if value:
+            return value.strip()
+    return ANONYMOUS_CALLER
+
+
+def request_priority(caller: str, requested: str = None) -> str:
+    """
+    Pick the priority class of a request.
+
+    Callers listed in ADMISSION_BULK_CALLERS are always bulk; others are interactive
+    unless they ask for bulk with priority=bulk.
+
+    Raises:
+        ValueError: If requested is not a known priority class
+    """
+    if requested:
+        requested = str(requested).strip().lower()
+        if requested not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+    if caller in ADMISSION_BULK_CALLERS:
+        return BULK
+    return requested or INTERACTIVE
+
+
+class _Waiter:
+    __slots__ = ("priority", "caller", "sequence")
+
+    def __init__(self, priority: str, caller: str, sequence: int):
+        self.priority = priority
+        self.caller = caller
+        self.sequence = sequence
+
+
+class AdmissionController:
+    """
+    Limits how many requests run at once in this worker, per priority class and per caller.
+
+    Bulk requests may only use bulk_concurrency of the max_concurrency slots, so the rest
+    are always free for interactive requests. Waiting requests are admitted interactive
+    first, then in arrival order. A request is rejected with 429 when its class already
+    has max_queue requests waiting, and with 503 when it cannot start before its deadline.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+        bulk_concurrency: int = ADMISSION_BULK_CONCURRENCY,
+        caller_concurrency: int = ADMISSION_CALLER_CONCURRENCY,
+        max_queue: dict = None,
+        deadlines: dict = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.bulk_concurrency = min(bulk_concurrency, max_concurrency)
+        self.caller_concurrency = caller_concurrency
+        self.max_queue = max_queue or {INTERACTIVE: ADMISSION_INTERACTIVE_QUEUE, BULK: ADMISSION_BULK_QUEUE}
+        self.deadlines = deadlines or {INTERACTIVE: ADMISSION_INTERACTIVE_DEADLINE_SECONDS, BULK: ADMISSION_BULK_DEADLINE_SECONDS}
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._waiting = []
+        self._active = {priority: 0 for priority in PRIORITIES}
+        self._active_by_caller = {}
+        self._service_seconds = 1.0
+        self._counters = {priority: {"admitted": 0, "shed": 0, "expired": 0} for priority in PRIORITIES}
+        self._queue_waits = {priority: deque(maxlen=1000) for priority in PRIORITIES}
+
+    def _can_run(self, waiter: _Waiter) -> bool:
+        if sum(self._active.values()) >= self.max_concurrency:
+            return False
+        if waiter.priority == BULK and self._active[BULK] >= self.bulk_concurrency:
+            return False
+        if waiter.caller == ANONYMOUS_CALLER:
+            return True
+        return self._active_by_caller.get(waiter.caller, 0) < self.caller_concurrency
+
+    def _next_waiter(self) -> _Waiter:
+        runnable = [waiter for waiter in self._waiting if self._can_run(waiter)]
+        return min(runnable, key=lambda waiter: (PRIORITIES.index(waiter.priority), waiter.sequence), default=None)
+
+    def _retry_after(self, priority: str) -> int:
+        slots = self.bulk_concurrency if priority == BULK else self.max_concurrency
+        waiting = sum(1 for waiter in self._waiting if waiter.priority == priority)
+        return max(1, math.ceil(self._service_seconds * (waiting + 1) / max(1, slots)))
+
+    @contextmanager
+    def admit(self, caller: str, priority: str = INTERACTIVE, deadline_seconds: float = None, shed: bool = True):
+        """
+        Wait for a slot, run the block, then free the slot.
+
+        The deadline covers the whole request: it bounds the wait for a slot and is set on
+        the current RequestMetrics, so later pipeline stages stop once it has passed.
+
+        Args:
+            caller (str): Caller id used for the per-caller limit
+            priority (str, optional): "interactive" or "bulk"
+            deadline_seconds (float, optional): Seconds from now; None uses the class default, 0 means no deadline
+            shed (bool, optional): If False, never reject because the queue is full (used by queued jobs)
+
+        Raises:
+            AdmissionRejectedError: If the request is shed or its deadline passes while waiting
+        """
+        started = time.monotonic()
+        if deadline_seconds is None:
+            deadline_seconds = self.deadlines[priority]
+        deadline = started + deadline_seconds if deadline_seconds else None
+
+        with self._condition:
+            waiting = sum(1 for waiter in self._waiting if waiter.priority == priority)
+            waiter = _Waiter(priority, caller, next(self._sequence))
+            self._waiting.append(waiter)
+            # Only requests that would have to wait are shed
+            if shed and waiting >= self.max_queue[priority] and self._next_waiter() is not waiter:
+                self._waiting.remove(waiter)
+                self._counters[priority]["shed"] += 1
+                raise AdmissionRejectedError(f"Too many {priority} requests are waiting", 429, self._retry_after(priority))
+            try:
+                while self._next_waiter() is not waiter:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._counters[priority]["expired"] += 1
+                        raise AdmissionRejectedError(f"No capacity for the {priority} request before its deadline", 503, self._retry_after(priority))
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting.remove(waiter)
+                self._condition.notify_all()
+            self._active[priority] += 1
+            self._active_by_caller[caller] = self._active_by_caller.get(caller, 0) + 1
+            self._counters[priority]["admitted"] += 1
+            admitted = time.monotonic()
+            self._queue_waits[priority].append(admitted - started)
+
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.stages["queue_wait"] = (admitted - started) * 1000
+            metrics.attributes["admission"] = {"priority": priority, "caller": caller}
+            metrics.deadline = deadline
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active[priority] -= 1
+                self._active_by_caller[caller] -= 1
+                if not self._active_by_caller[caller]:
+                    del self._active_by_caller[caller]
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * (time.monotonic() - admitted)
+                self._condition.notify_all()
+
+    def report(self) -> dict:
+        """
+        Running and waiting requests, counters and queue wait percentiles per priority class.
+        """
+        with self._condition:
+            report = {}
+            for priority in PRIORITIES:
+                waits = sorted(self._queue_waits[priority])
+                report[priority] = {
+                    "running": self._active[priority],
+                    "waiting": sum(1 for waiter in self._waiting if waiter.priority == priority),
+                    **self._counters[priority],
+                    "queue_wait_p50_ms": round(waits[len(waits) // 2] * 1000, 2) if waits else None,
+                    "queue_wait_p95_ms": round(waits[max(0, math.ceil(0.95 * len(waits)) - 1)] * 1000, 2) if waits else None,
+                }
+            return report
+
+
+def admit(caller: str, priority: str = INTERACTIVE, deadline_seconds: float = None, shed: bool = True):
+    """
+    Admit a request through the worker's admission controller, or do nothing when it is disabled.
+    """
+    if admission_controller is None:
+        return nullcontext()
+    return admission_controller.admit(caller, priority, deadline_seconds, shed)
+
+
+admission_controller = AdmissionController() if ADMISSION_CONTROL_ENABLED else None
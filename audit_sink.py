@@ -0,0 +1,187 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+AUDIT_INGEST_URI = os.environ.get("AUDIT_INGEST_URI")
+AUDIT_DATABASE = os.environ.get("AUDIT_DATABASE")
+AUDIT_TABLE = os.environ.get("AUDIT_TABLE", "NlQueryAudit")
+AUDIT_MAPPING = os.environ.get("AUDIT_MAPPING")
+AUDIT_FILE_PATH = os.environ.get("AUDIT_FILE_PATH")
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", 500))
+AUDIT_FLUSH_SECONDS = float(os.environ.get("AUDIT_FLUSH_SECONDS", 30))
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", 10000))
+
+_FLUSH = object()
+
+
+def audit_record(metrics, prompt: str, generated_query: str = None, results: list = None, status: int = 200) -> dict:
+    """
+    Build one audit row for a request. Result values are never included, only their count.
+
+    The row is serialized later on the writer thread, so metrics are copied rather than referenced.
+    """
+    return {
+        "Timestamp": datetime.now(timezone.utc).isoformat(),
+        "RequestId": uuid.uuid4().hex,
+        "Route": metrics.route,
+        "Status": status,
+        "Prompt": prompt,
+        "GeneratedQuery": generated_query,
+        "RowCount": len(results) if results is not None else None,
+        "TotalMs": round(metrics.elapsed_ms(), 2),
+        "StagesMs": {name: round(ms, 2) for name, ms in metrics.stages.items()},
+        "TokenUsage": {name: dict(usage) for name, usage in metrics.token_usage.items()},
+        "QuerySource": metrics.attributes.get("query_source"),
+        "LlmCache": metrics.attributes.get("llm_cache"),
+        "Attributes": dict(metrics.attributes),
+    }
+
+
+class FileAuditWriter:
+    """
+    Local stand-in for Kusto ingestion: appends each batch to a JSONL file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, records: list) -> None:
+        with open(self.path, "a", encoding="utf-8") as audit_file:
+            for record in records:
+                audit_file.write(json.dumps(record, default=str, ensure_ascii=False) + "\n")
+
+
+class KustoAuditWriter:
+    """
+    Queues each batch for ingestion into a Kusto table as one multi-JSON blob.
+    """
+
+    def __init__(self, ingest_uri: str, database: str, table: str, authentication_mode: str, mapping: str = None):
+        from utils import Utils
+        self._utils = Utils
+        self.client = Utils.Ingestion.create_queued_ingest_client(ingest_uri, authentication_mode)
+        self.database = database
+        self.table = table
+        self.mapping = mapping
+
+    def write(self, records: list) -> None:
+        self._utils.Ingestion.ingest_json_records(self.client, self.database, self.table, records, self.mapping)
+
+
+class AuditSink:
+    """
+    Buffers audit records in memory and writes them from a background thread.
+
+    A batch is written once batch_size records are waiting or flush_seconds after its
+    first record arrived. record() never blocks: when the buffer is full the record is
+    dropped and counted.
+    """
+
+    def __init__(self, writer, batch_size: int = AUDIT_BATCH_SIZE, flush_seconds: float = AUDIT_FLUSH_SECONDS, max_queue: int = AUDIT_QUEUE_SIZE):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name="audit-sink", daemon=True)
+                self._thread.start()
+
+    def record(self, record: dict) -> None:
+        self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self, timeout: float = 10) -> bool:
+        """
+        Write everything recorded so far. Returns False if it did not finish within timeout.
+        """
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put((_FLUSH, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(max(0.0, deadline - time.monotonic()))
+
+    def _write(self, batch: list) -> None:
+        if not batch:
+            return
+        try:
+            self.writer.write(batch)
+        except Exception as e:
+            logging.warning("Failed to write %d audit records: %s", len(batch), e)
+
+    def _work(self) -> None:
+        batch, deadline = [], None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, tuple) and item and item[0] is _FLUSH:
+                self._write(batch)
+                batch, deadline = [], None
+                item[1].set()
+                continue
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+            if len(batch) >= self.batch_size or (deadline is not None and time.monotonic() >= deadline):
+                self._write(batch)
+                batch, deadline = [], None
+
+
+def _create_audit_sink():
+    if AUDIT_FILE_PATH:
+        return AuditSink(FileAuditWriter(AUDIT_FILE_PATH))
+    if AUDIT_INGEST_URI:
+        try:
+            from utils import Utils
+            config = Utils.load_configs("config.json")
+            writer = KustoAuditWriter(
+                AUDIT_INGEST_URI,
+                AUDIT_DATABASE or config["databaseName"],
+                AUDIT_TABLE,
+                config["authenticationMode"],
+                AUDIT_MAPPING,
+            )
+            return AuditSink(writer)
+        except Exception as e:
+            logging.warning("Audit ingestion is unavailable: %s", e)
+    return None
+
+
+def audit_request(metrics, prompt: str, generated_query: str = None, results: list = None, status: int = 200) -> None:
+    """
+    Hand one request to the audit sink when auditing is configured. Never blocks.
+    """
+    if audit_sink is None:
+        return
+    try:
+        audit_sink.record(audit_record(metrics, prompt, generated_query, results, status))
+    except Exception as e:
+        logging.warning("Failed to audit request: %s", e)
+
+
+audit_sink = _create_audit_sink()
+if audit_sink is not None:
+    atexit.register(audit_sink.flush)
@@ -0,0 +1,353 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from kql_parser import KqlSyntaxError, parse_query, parse_assignment, parse_expression, scalar_lets, split_by_clause, split_top_level, substitute_lets, token_signature
+from load_replay import percentile
+from generation_controller import KQL_STOP_SEQUENCES, complete_fenced_query
+from prompts.prompt_compiler import count_tokens, format_generation_examples
+from prompts.prompts_dict import prompts_dict
+from prompts.system_prompts import DEFAULT_KUSTO_SYSTEM_PROMPT, CATALOG_KUSTO_SYSTEM_PROMPT, SHORT_KUSTO_SYSTEM_PROMPT
+from schema_catalog import SCHEMA_CATALOG_PATH, SchemaCatalog
+
+SweepConfig = namedtuple("SweepConfig", ["deployment", "examples", "prompt_variant", "max_tokens"])
+Completion = namedtuple("Completion", ["content", "prompt_tokens", "completion_tokens", "latency_ms"])
+
+PROMPT_VARIANTS = {
+    "default": DEFAULT_KUSTO_SYSTEM_PROMPT,
+    "catalog": CATALOG_KUSTO_SYSTEM_PROMPT,
+    "short": SHORT_KUSTO_SYSTEM_PROMPT,
+}
+
+# Operators whose comma-separated arguments are compared as sets
+_UNORDERED_LISTS = {"extend", "project", "project-away", "distinct"}
+
+_FENCED_QUERY = re.compile(r"```kql\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+
+
+def gold_set() -> list:
+    """
+    (question, gold KQL) pairs from prompts_dict.
+    """
+    pairs = []
+    for question, content in prompts_dict.items():
+        match = _FENCED_QUERY.search(content)
+        if match:
+            pairs.append((question, match.group(1).strip()))
+    return pairs
+
+
+def _conjuncts(node) -> list:
+    if node[0] == "binop" and node[1] == "and":
+        return _conjuncts(node[2]) + _conjuncts(node[3])
+    return [node]
+
+
+def _expression_list(tokens: list) -> tuple:
+    items = []
+    for segment in split_top_level(tokens, ","):
+        if segment:
+            items.append(parse_assignment(segment))
+    return tuple(sorted(items, key=repr))
+
+
+def _normalize_operator(operator) -> tuple:
+    tokens = operator.tokens
+    try:
+        if operator.name == "where":
+            return ("where",) + tuple(sorted(_conjuncts(parse_expression(tokens)), key=repr))
+        if operator.name == "summarize":
+            aggregates, by = split_by_clause(tokens)
+            return ("summarize", _expression_list(aggregates), _expression_list(by or []))
+        if operator.name in _UNORDERED_LISTS:
+            return (operator.name, _expression_list(tokens))
+    except KqlSyntaxError:
+        pass
+    return (operator.name,) + token_signature(tokens)
+
+
+def normalize_query(query: str) -> list:
+    """
+    Normalize a KQL query into comparable pipeline stages.
+
+    Literal lets are inlined, `where` conjuncts and `summarize`/`extend`/`project` lists are
+    compared regardless of order, and whitespace, comments and keyword case are ignored.
+
+    Raises:
+        KqlSyntaxError: If the query cannot be parsed
+    """
+    parsed = parse_query(query)
+    scalars = scalar_lets(parsed)
+    stages = [("lets",) + tuple(sorted(repr(token_signature(value)) for name, value in parsed.lets if name not in scalars))]
+    stages.append(("source",) + token_signature(substitute_lets(parsed.source, scalars)))
+    for operator in parsed.operators:
+        stages.append(_normalize_operator(operator._replace(tokens=substitute_lets(operator.tokens, scalars))))
+    return stages
+
+
+def _common_subsequence(left: list, right: list) -> int:
+    lengths = [[0] * (len(right) + 1) for _ in range(len(left) + 1)]
+    for i, a in enumerate(left):
+        for j, b in enumerate(right):
+            lengths[i + 1][j + 1] = lengths[i][j] + 1 if a == b else max(lengths[i][j + 1], lengths[i + 1][j])
+    return lengths[-1][-1]
+
+
+def score_query(generated: str, gold: str) -> dict:
+    """
+    Compare a generated query with the gold query.
+
+    Returns:
+        dict: exact (normalized pipelines are equal) and structure (share of matching
+            stages, in order, out of the longer pipeline; 0 when the query does not parse)
+    """
+    try:
+        expected = normalize_query(gold)
+        actual = normalize_query(generated)
+    except KqlSyntaxError:
+        return {"exact": False, "structure": 0.0}
+    matched = _common_subsequence(actual, expected)
+    return {"exact": actual == expected, "structure": round(matched / max(len(actual), len(expected)), 4)}
+
+
+def build_system_prompt(config: SweepConfig, question: str) -> str:
+    """
+    System prompt for a configuration, with its first `examples` gold examples other than the question itself.
+    """
+    examples = [(q, content) for q, content in prompts_dict.items() if q != question][:config.examples]
+    return PROMPT_VARIANTS[config.prompt_variant] + format_generation_examples(examples)
+
+
+def build_user_prompt(config: SweepConfig, question: str, catalog: SchemaCatalog = None) -> str:
+    """
+    User message for a configuration. The catalog variant gets the relevant schema block
+    in front of the question, as in production.
+
+    Raises:
+        ValueError: If the catalog variant is used without a schema catalog
+    """
+    if config.prompt_variant != "catalog":
+        return question
+    user_prompt = catalog.schema_prompt(question) if catalog is not None else None
+    if user_prompt is None:
+        raise ValueError("The catalog prompt variant needs a schema catalog")
+    return user_prompt
+
+
+def load_schema_catalog(path: str = SCHEMA_CATALOG_PATH) -> SchemaCatalog:
+    """
+    Schema catalog stored by the app, used as is. Returns None when the file is missing.
+    """
+    if not os.path.exists(path):
+        return None
+    return SchemaCatalog(None, path=path, refresh_seconds=float("inf"))
+
+
+class AzureOpenAICompleter:
+    """
+    Calls the Azure OpenAI deployment of each configuration. Optionally records every
+    completion so the same sweep can be re-run offline with RecordedCompleter.
+    """
+
+    def __init__(self, record_path: str = None):
+        from openai import AzureOpenAI
+        self.client = AzureOpenAI(
+            azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
+            api_version="2025-01-01-preview",
+            api_key=os.environ.get("AI_FOUNDRY_API_KEY")
+        )
+        self.record_path = record_path
+        self._lock = threading.Lock()
+
+    def __call__(self, config: SweepConfig, system_prompt: str, question: str, user_prompt: str = None) -> Completion:
+        started = time.monotonic()
+        response = self.client.chat.completions.create(
+            model=config.deployment,
+            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt or question}],
+            temperature=0.1,
+            max_tokens=config.max_tokens,
+            stop=KQL_STOP_SEQUENCES
+        )
+        latency_ms = (time.monotonic() - started) * 1000
+        content, _ = complete_fenced_query(response.choices[0].message.content, response.choices[0].finish_reason)
+        completion = Completion(content, response.usage.prompt_tokens, response.usage.completion_tokens, latency_ms)
+        if self.record_path:
+            with self._lock, open(self.record_path, "a", encoding="utf-8") as record_file:
+                record_file.write(json.dumps({"config": config._asdict(), "question": question, **completion._asdict()}) + "\n")
+        return completion
+
+
+class RecordedCompleter:
+    """
+    Replays completions recorded by AzureOpenAICompleter.
+    """
+
+    def __init__(self, paths: list):
+        self.completions = {}
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as record_file:
+                for line in record_file:
+                    if line.strip():
+                        record = json.loads(line)
+                        key = (SweepConfig(**record["config"]), record["question"])
+                        self.completions[key] = Completion(record["content"], record["prompt_tokens"], record["completion_tokens"], record["latency_ms"])
+
+    def __call__(self, config: SweepConfig, system_prompt: str, question: str, user_prompt: str = None) -> Completion:
+        try:
+            return self.completions[(config, question)]
+        except KeyError:
+            raise KeyError(f"No recorded completion for {config} and '{question}'")
+
+
+class FakeCompleter:
+    """
+    Offline stand-in for the model: answers with responder(config, question) and a latency
+    modelled from token counts, so harness and guardrail changes can be checked without a deployment.
+    """
+
+    def __init__(self, responder=None, base_ms: float = 300.0, prompt_token_ms: float = 0.05, completion_token_ms: float = 15.0):
+        gold = dict(gold_set())
+        self.responder = responder or (lambda config, question: f"```kql\n{gold[question]}\n```")
+        self.base_ms = base_ms
+        self.prompt_token_ms = prompt_token_ms
+        self.completion_token_ms = completion_token_ms
+
+    def __call__(self, config: SweepConfig, system_prompt: str, question: str, user_prompt: str = None) -> Completion:
+        content = self.responder(config, question)
+        prompt_tokens = count_tokens(system_prompt)[0] + count_tokens(user_prompt or question)[0]
+        completion_tokens = count_tokens(content)[0]
+        if completion_tokens > config.max_tokens:
+            # Truncated like a completion that hit max_tokens
+            content = content[:len(content) * config.max_tokens // completion_tokens]
+            completion_tokens = config.max_tokens
+        latency_ms = self.base_ms + self.prompt_token_ms * prompt_tokens + self.completion_token_ms * completion_tokens
+        return Completion(content, prompt_tokens, completion_tokens, latency_ms)
+
+
+def _evaluate(complete, config: SweepConfig, question: str, gold: str, catalog: SchemaCatalog = None) -> dict:
+    try:
+        completion = complete(config, build_system_prompt(config, question), question, build_user_prompt(config, question, catalog))
+    except Exception as e:
+        logging.warning("Completion failed for %s: %s", config, e)
+        return {"config": config, "error": str(e)}
+    match = _FENCED_QUERY.search(completion.content or "")
+    generated = match.group(1).strip() if match else (completion.content or "").strip()
+    return {"config": config, **score_query(generated, gold), **completion._asdict()}
+
+
+def run_sweep(configs: list, complete, workers: int = 8, gold: list = None, catalog: SchemaCatalog = None) -> list:
+    """
+    Generate every gold question under every configuration in parallel and score the results.
+
+    Each question is asked with a prompt that leaves its own gold example out. The catalog
+    variant sends the schema block from catalog in the user message.
+
+    Returns:
+        list: One summary dict per configuration, in the order of configs
+
+    Raises:
+        ValueError: If a configuration uses the catalog variant without a schema catalog
+    """
+    if catalog is None and any(config.prompt_variant == "catalog" for config in configs):
+        raise ValueError("The catalog prompt variant needs a schema catalog")
+    gold = gold if gold is not None else gold_set()
+    tasks = [(config, question, query, catalog) for config in configs for question, query in gold]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        outcomes = list(pool.map(lambda task: _evaluate(complete, *task), tasks))
+
+    summaries = []
+    for config in configs:
+        results = [outcome for outcome in outcomes if outcome["config"] == config]
+        scored = [outcome for outcome in results if "error" not in outcome]
+        latencies = [outcome["latency_ms"] for outcome in scored]
+        summaries.append({
+            "config": config,
+            "questions": len(results),
+            "errors": len(results) - len(scored),
+            "accuracy": round(sum(outcome["exact"] for outcome in scored) / len(results), 4) if results else 0.0,
+            "structure": round(sum(outcome["structure"] for outcome in scored) / len(results), 4) if results else 0.0,
+            "latency_p50_ms": round(percentile(latencies, 0.50), 1),
+            "latency_p95_ms": round(percentile(latencies, 0.95), 1),
+            "prompt_tokens": round(sum(outcome["prompt_tokens"] for outcome in scored) / len(scored)) if scored else 0,
+            "completion_tokens": round(sum(outcome["completion_tokens"] for outcome in scored) / len(scored)) if scored else 0,
+        })
+    return summaries
+
+
+def mark_pareto(summaries: list, baseline: SweepConfig = None, tolerance: float = 0.0) -> list:
+    """
+    Flag configurations on the accuracy / p95 latency Pareto frontier, and whether each
+    keeps accuracy within tolerance of the baseline configuration (the first one by default).
+    """
+    baseline_summary = next((s for s in summaries if s["config"] == baseline), summaries[0]) if summaries else None
+    for summary in summaries:
+        summary["pareto"] = not any(
+            other["accuracy"] >= summary["accuracy"] and other["latency_p95_ms"] <= summary["latency_p95_ms"]
+            and (other["accuracy"] > summary["accuracy"] or other["latency_p95_ms"] < summary["latency_p95_ms"])
+            for other in summaries
+        )
+        summary["guardrail"] = summary["accuracy"] >= baseline_summary["accuracy"] - tolerance
+    return summaries
+
+
+def format_table(summaries: list) -> str:
+    """
+    Markdown table of the sweep, fastest p95 first.
+    """
+    header = ["deployment", "examples", "prompt", "max_tokens", "accuracy", "structure", "p50 ms", "p95 ms", "prompt tok", "completion tok", "errors", "pareto", "guardrail"]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for summary in sorted(summaries, key=lambda s: (s["latency_p95_ms"], -s["accuracy"])):
+        config = summary["config"]
+        cells = [
+            config.deployment, config.examples, config.prompt_variant, config.max_tokens,
+            f"{summary['accuracy']:.2f}", f"{summary['structure']:.2f}", summary["latency_p50_ms"], summary["latency_p95_ms"],
+            summary["prompt_tokens"], summary["completion_tokens"], summary["errors"],
+            "*" if summary["pareto"] else "", "pass" if summary["guardrail"] else "FAIL",
+        ]
+        lines.append("| " + " | ".join(str(cell) for cell in cells) + " |")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    gold_size = len(gold_set())
+    parser = argparse.ArgumentParser(description="Sweep generation configurations over the prompts_dict gold set and report accuracy against latency.")
+    parser.add_argument("--deployments", nargs="+", default=["gpt-4o-mini"], help="Azure OpenAI deployments")
+    parser.add_argument("--examples", nargs="+", type=int, default=[gold_size - 1, 5, 0], help="number of examples in the system prompt")
+    parser.add_argument("--prompts", nargs="+", default=None, choices=list(PROMPT_VARIANTS), help="system prompt variants (catalog only by default when a schema catalog is stored)")
+    parser.add_argument("--schema-catalog", default=SCHEMA_CATALOG_PATH, help="schema catalog file written by the app, used by the catalog variant")
+    parser.add_argument("--max-tokens", nargs="+", type=int, default=[1000, 256], help="completion token limits")
+    parser.add_argument("--mode", choices=("live", "recorded", "fake"), default="fake", help="where completions come from")
+    parser.add_argument("--record", default=None, help="in live mode, append completions to this file")
+    parser.add_argument("--recorded", nargs="*", default=[], help="in recorded mode, files written with --record")
+    parser.add_argument("--workers", type=int, default=8, help="completions in flight")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="accuracy a configuration may lose against the first one")
+    parser.add_argument("--json", default=None, help="also write the summaries to this file")
+    args = parser.parse_args()
+
+    catalog = load_schema_catalog(args.schema_catalog)
+    if args.prompts is None:
+        args.prompts = [variant for variant in PROMPT_VARIANTS if variant != "catalog" or catalog is not None]
+    elif "catalog" in args.prompts and catalog is None:
+        parser.error(f"the catalog prompt variant needs a schema catalog, but {args.schema_catalog} does not exist")
+
+    if args.mode == "live":
+        completer = AzureOpenAICompleter(args.record)
+    elif args.mode == "recorded":
+        completer = RecordedCompleter(args.recorded)
+    else:
+        completer = FakeCompleter()
+
+    grid = [SweepConfig(*values) for values in itertools.product(args.deployments, args.examples, args.prompts, args.max_tokens)]
+    report = mark_pareto(run_sweep(grid, completer, workers=args.workers, catalog=catalog), tolerance=args.tolerance)
+    print(format_table(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump([{**summary, "config": summary["config"]._asdict()} for summary in report], json_file, indent=2)
+    sys.exit(0 if all(summary["guardrail"] for summary in report if summary["pareto"]) else 1)
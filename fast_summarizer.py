@@ -0,0 +1,261 @@
+import re
+
+SUMMARY_MODES = ("llm", "fast")
+
+# Release channels in the order a version moves through them
+CHANNEL_ORDER = ("preview", "default", "stable")
+
+MAX_PATTERN_GROUPS = 8
+
+_VERSION_PATTERN = re.compile(r"(\d+)\.(\d+)")
+_STAGE_PATTERN = re.compile(r"\d+")
+# Columns holding the APIM release version; windowsVersion and similar are plain dimensions
+_RELEASE_VERSION_COLUMNS = {"version", "minorversion"}
+# Other columns summarized as shares; results grouped by anything else, e.g. serviceName, go to the LLM
+_SHARE_COLUMNS = {"sku", "windowsversion"}
+
+
+def parse_summary_mode(value) -> str:
+    """
+    Validate the summary request option.
+
+    Raises:
+        ValueError: If the mode is not one of SUMMARY_MODES
+    """
+    if value in (None, ""):
+        return "llm"
+    mode = str(value).strip().lower()
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f"summary must be one of {', '.join(SUMMARY_MODES)}, got {value!r}")
+    return mode
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _role(column: str) -> str:
+    name = column.lower()
+    if name in _RELEASE_VERSION_COLUMNS:
+        return "version"
+    if name.startswith("sdpstage"):
+        return "stage"
+    if name in ("releasechannel", "channel"):
+        return "channel"
+    if name in _SHARE_COLUMNS or name.startswith("region"):
+        return "share"
+    return "dimension"
+
+
+def _minor_version(value) -> str:
+    # 0.49.1234.0 and 0.49.1300.0 are both release 0.49
+    match = _VERSION_PATTERN.match(str(value))
+    return f"{match.group(1)}.{match.group(2)}" if match else str(value)
+
+
+def _version_key(minor: str) -> tuple:
+    match = _VERSION_PATTERN.match(minor)
+    return (int(match.group(1)), int(match.group(2))) if match else (-1, -1)
+
+
+def _stage_key(value) -> tuple:
+    match = _STAGE_PATTERN.search(str(value))
+    return (int(match.group()), "") if match else (float("inf"), str(value))
+
+
+def _channel_key(value) -> tuple:
+    name = str(value).lower()
+    return (CHANNEL_ORDER.index(name), "") if name in CHANNEL_ORDER else (len(CHANNEL_ORDER), name)
+
+
+def _percent(share: float) -> str:
+    if 0 < share < 0.01:
+        return "under 1 percent"
+    return f"{round(share * 100)} percent"
+
+
+def _describe_shape(results: list) -> tuple:
+    """
+    Split the columns of a count-by-dimension result into (measure, subject, group columns).
+
+    Returns None when the results are not a single measure over at most three dimensions.
+    """
+    if not results or not isinstance(results[0], dict):
+        return None
+    columns = list(results[0].keys())
+    # Stages are often numeric but are always dimensions
+    measures = [c for c in columns if _role(c) == "dimension" and any(_is_number(row.get(c)) for row in results)]
+    dimensions = [c for c in columns if c not in measures]
+    if len(measures) != 1 or not 1 <= len(dimensions) <= 3:
+        return None
+    if any(_role(c) == "dimension" for c in dimensions):
+        return None
+    if any(not (_is_number(row.get(measures[0])) or row.get(measures[0]) is None) for row in results):
+        return None
+
+    roles = {c: _role(c) for c in dimensions}
+    versions = [c for c in dimensions if roles[c] == "version"]
+    others = [c for c in dimensions if roles[c] == "share"]
+    if len(versions) > 1:
+        return None
+    if versions:
+        subject = versions[0]
+    elif len(others) == 1:
+        subject = others[0]
+    elif not others:
+        # Counts by stage and/or channel only: describe how the last one is distributed
+        subject = dimensions[-1]
+    else:
+        return None
+    return measures[0], subject, [c for c in dimensions if c != subject]
+
+
+def _group_sort_key(group: tuple, group_columns: list) -> tuple:
+    key = []
+    for column, value in zip(group_columns, group):
+        role = _role(column)
+        if role == "channel":
+            key.append((0,) + _channel_key(value))
+        elif role == "stage":
+            key.append((1,) + _stage_key(value))
+        else:
+            key.append((2, 0, str(value)))
+    return tuple(sorted(key, key=lambda part: part[0]))
+
+
+def _group_label(group: tuple, group_columns: list) -> str:
+    # Channel first, then stage: "Default Stage 3"
+    rank = {"channel": 0, "stage": 1}
+    parts = []
+    for column, value in sorted(zip(group_columns, group), key=lambda item: rank.get(_role(item[0]), 2)):
+        if _role(column) == "stage" and _STAGE_PATTERN.fullmatch(str(value)):
+            parts.append(f"Stage {value}")
+        else:
+            parts.append(str(value))
+    return " ".join(parts) if parts else "All results"
+
+
+def _distributions(results: list, measure: str, subject: str, group_columns: list, is_version: bool) -> dict:
+    groups = {}
+    for row in results:
+        group = tuple(row.get(column) for column in group_columns)
+        value = _minor_version(row.get(subject)) if is_version else row.get(subject)
+        counts = groups.setdefault(group, {})
+        counts[value] = counts.get(value, 0) + (row.get(measure) or 0)
+    return groups
+
+
+def _format(findings: list, patterns: list, recommendations: list) -> str:
+    return "\n".join([
+        f"- Key Findings: {' '.join(findings)}",
+        f"- Notable Patterns: {' '.join(patterns) if patterns else 'None.'}",
+        f"- Recommendations: {' '.join(recommendations) if recommendations else 'None.'}",
+    ])
+
+
+def _summarize_release(groups: dict, group_columns: list) -> str:
+    totals = {group: sum(counts.values()) for group, counts in groups.items()}
+    latest = max((value for counts in groups.values() for value, count in counts.items() if count), key=_version_key)
+    shares = {group: (counts.get(latest, 0) / totals[group]) if totals[group] else 0.0 for group, counts in groups.items()}
+    ordered = sorted(groups, key=lambda group: _group_sort_key(group, group_columns))
+
+    findings, patterns, recommendations = [], [], []
+    release_groups = [group for group in ordered if shares[group] > 0]
+    front = release_groups[-1]
+
+    if group_columns:
+        findings.append(
+            f"Release {latest} has reached {_group_label(front, group_columns)}, "
+            f"with {_percent(shares[front])} of it upgraded."
+        )
+        complete = [group for group in ordered if shares[group] >= 1]
+        if complete:
+            findings.append(f"{len(complete)} of {len(ordered)} groups are fully on {latest}.")
+    else:
+        overall = sum(groups[front].values())
+        findings.append(f"{_percent(groups[front][latest] / overall)} of tenants are on release {latest}, the latest in the results.")
+
+    for group in ordered[:MAX_PATTERN_GROUPS]:
+        counts = groups[group]
+        leading = max(counts, key=lambda value: (counts[value], _version_key(value)))
+        patterns.append(
+            f"{_group_label(group, group_columns)}: {_percent(counts[leading] / totals[group])} on {leading}"
+            + (f", {_percent(shares[group])} on {latest}." if leading != latest and shares[group] > 0 else ".")
+        )
+    if len(ordered) > MAX_PATTERN_GROUPS:
+        patterns.append(f"{len(ordered) - MAX_PATTERN_GROUPS} more groups not listed.")
+
+    stragglers = [group for group in ordered[:ordered.index(front)] if shares[group] < 1]
+    if stragglers:
+        labels = ", ".join(_group_label(group, group_columns) for group in stragglers[:3])
+        recommendations.append(f"Check {labels}, which are ahead of the release front but not fully on {latest}; blocked or quarantined services are likely.")
+    if group_columns and shares[front] < 1:
+        recommendations.append(f"Monitor the remaining {_percent(1 - shares[front])} of {_group_label(front, group_columns)} before the release moves on.")
+    elif group_columns and front == ordered[-1]:
+        recommendations.append(f"Release {latest} has reached every group in the results.")
+
+    return _format(findings, patterns, recommendations)
+
+
+def _summarize_distribution(groups: dict, group_columns: list, subject: str) -> str:
+    overall = {}
+    for counts in groups.values():
+        for value, count in counts.items():
+            overall[value] = overall.get(value, 0) + count
+    total = sum(overall.values())
+    ranked = sorted(overall, key=lambda value: overall[value], reverse=True)
+
+    findings = [
+        f"{subject} has {len(ranked)} distinct {'value' if len(ranked) == 1 else 'values'}; "
+        + ", ".join(f"{value} accounts for {_percent(overall[value] / total)}" for value in ranked[:3])
+        + "."
+    ]
+    patterns = []
+    if group_columns:
+        ordered = sorted(groups, key=lambda group: _group_sort_key(group, group_columns))
+        for group in ordered[:MAX_PATTERN_GROUPS]:
+            counts = groups[group]
+            group_total = sum(counts.values())
+            if not group_total:
+                continue
+            leading = max(counts, key=lambda value: counts[value])
+            patterns.append(f"{_group_label(group, group_columns)}: {leading} is {_percent(counts[leading] / group_total)}.")
+        if len(ordered) > MAX_PATTERN_GROUPS:
+            patterns.append(f"{len(ordered) - MAX_PATTERN_GROUPS} more groups not listed.")
+    elif len(ranked) > 3:
+        tail = sum(overall[value] for value in ranked[3:])
+        patterns.append(f"The remaining {len(ranked) - 3} values together account for {_percent(tail / total)}.")
+
+    recommendations = []
+    if len(ranked) > 1 and overall[ranked[-1]] / total < 0.01:
+        recommendations.append(f"{ranked[-1]} is a very small share and may be an outlier worth confirming.")
+    return _format(findings, patterns, recommendations)
+
+
+def summarize_distribution(results: list) -> str:
+    """
+    Summarize count-by-dimension results locally, following the release summary rules.
+
+    Recognizes a single numeric measure (e.g. count_) over at most three dimensions such as
+    version, sdpStage, releaseChannel, sku or regions. Version columns are reported as release
+    progress: the latest minor version, how far it has moved through channels and stages and
+    the share of each group upgraded. Other shapes are reported as shares.
+
+    Args:
+        results (list): Query result rows
+
+    Returns:
+        str: Summary in the Key Findings / Notable Patterns / Recommendations structure,
+            or None when the shape is not recognized and the LLM should summarize instead
+    """
+    shape = _describe_shape(results)
+    if shape is None:
+        return None
+    measure, subject, group_columns = shape
+    is_version = _role(subject) == "version"
+    groups = _distributions(results, measure, subject, group_columns, is_version)
+    if not any(count for counts in groups.values() for count in counts.values()):
+        return None
+    if is_version:
+        return _summarize_release(groups, group_columns)
+    return _summarize_distribution(groups, group_columns, subject)
@@ -2,9 +2,40 @@ import azure.functions as func
 import logging
 import json
 from helper_functions import *
+from tenant_cube import refresh_tenant_cube
+from prompts.prompt_compiler import compiled_prompts
+from request_metrics import track_request, DeadlineExceededError
+from response_shaping import parse_shaping_options
+from fast_summarizer import parse_summary_mode
+from nl_pipeline import run_nl_query
+from job_queue import JobStore, LocalJobQueue, process_job, NL_KUSTO_JOB_BACKEND, NL_KUSTO_JOB_QUEUE_NAME
+from request_logging import request_logging, debug_requested, log_detail, truncated, row_summary
+from admission_control import admit, admission_controller, get_caller_id, request_priority, AdmissionRejectedError, ANONYMOUS_CALLER, BULK
+from traffic_capture import CAPTURED_OPTIONS
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
+def admission_rejected_response(error: AdmissionRejectedError) -> func.HttpResponse:
+    """
+    Fast rejection for a request the admission controller shed or could not start in time.
+    """
+    return func.HttpResponse(
+        json.dumps({"error": str(error), "status": "error"}),
+        status_code=error.status_code,
+        headers={"Retry-After": str(error.retry_after)},
+        mimetype="application/json"
+    )
+
+def deadline_exceeded_response(error: DeadlineExceededError) -> func.HttpResponse:
+    """
+    Response for an admitted request whose deadline passed before the pipeline finished.
+    """
+    return func.HttpResponse(
+        json.dumps({"error": str(error), "status": "error"}),
+        status_code=504,
+        mimetype="application/json"
+    )
+
 @app.function_name(name="HttpTrigger1")
 @app.route(route="req", methods=["POST"])
 def HttpTrigger1(req: func.HttpRequest) -> func.HttpResponse :
@@ -14,13 +45,13 @@ def HttpTrigger1(req: func.HttpRequest) -> func.HttpResponse :
         result = execute_kusto_query(command)
 
         # Return trigger
-        logging.info(f"Query executed successfully: {result}")
+        logging.info("Query executed successfully: %s", row_summary(result))
         # for i, row in enumerate(result["primary_result"]):
         #     logging.info(f"Row {i + 1}: {row}")
 
         return func.HttpResponse("Executed Correctly.")
     except Exception as e:
-        logging.error(f"Error executing query: {str(e)}")
+        logging.error("Error executing query: %s", e)
         return func.HttpResponse(
             json.dumps({"error": f"Internal server error: {str(e)}"}),
             status_code=500,
@@ -39,9 +70,9 @@ def basic_llm_call(req: func.HttpRequest) -> func.HttpResponse:
     try:
         # Extract the natural language prompt from the request
         prompt = get_prompt_from_request(req)
-        response_message = execute_llm_call(prompt)
-
-        logging.info(f"LLM response: {response_message}")
+        with request_logging("basic_llm_call", debug=debug_requested(req.headers)), admit(get_caller_id(req.headers)):
+            response_message = execute_llm_call(prompt)
+            log_detail(logging.INFO, "LLM response: %s", truncated(response_message))
 
         return func.HttpResponse(
             json.dumps({"response": response_message}),
@@ -49,60 +80,220 @@ def basic_llm_call(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json"
         )
 
+    except AdmissionRejectedError as e:
+        return admission_rejected_response(e)
     except Exception as e:
-        logging.error(f"Error processing request: {str(e)}")
+        logging.error("Error processing request: %s", e)
         return func.HttpResponse(
             json.dumps({"error": f"Internal server error: {str(e)}"}),
             status_code=500,
             mimetype="application/json"
         )
 
+@app.function_name(name="PromptVersions")
+@app.route(route="prompt_versions", methods=["GET"])
+def prompt_versions(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Azure Function that reports the version, content hash and token count of each compiled system prompt.
+    """
+    return func.HttpResponse(
+        json.dumps({"prompts": compiled_prompts.report()}, indent=2),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+@app.function_name(name="AdmissionStats")
+@app.route(route="admission_stats", methods=["GET"])
+def admission_stats(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Azure Function that reports running and waiting requests, rejections and queue wait
+    percentiles per priority class for this worker.
+    """
+    report = admission_controller.report() if admission_controller is not None else {}
+    return func.HttpResponse(
+        json.dumps({"admission": report}, indent=2),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+def run_nl_job(request: dict) -> dict:
+    """
+    Runs a queued asynchronous NL query request through the pipeline.
+    Jobs are bulk work: they wait for a bulk slot instead of being shed.
+    """
+    with track_request("kusto_nl_job") as metrics, request_logging("kusto_nl_job", debug=request.get("debug_log", False)), admit(request.get("caller", ANONYMOUS_CALLER), BULK, deadline_seconds=0, shed=False):
+        return run_nl_query(
+            request["prompt"],
+            metrics,
+            conversation_id=request.get("conversation_id"),
+            shaping_options=request.get("shaping_options"),
+            summary_mode=request.get("summary_mode", "llm"),
+            incremental=request.get("incremental", False),
+            request_options=request.get("request_options")
+        )
+
+job_store = JobStore()
+local_job_queue = LocalJobQueue(job_store, run_nl_job)
+
 @app.function_name(name="kustoNlQuery")
 @app.route(route="kusto_nl_query", methods=["POST"])
-def kusto_nl_query(req: func.HttpRequest) -> func.HttpResponse:
+@app.queue_output(arg_name="jobs", queue_name=NL_KUSTO_JOB_QUEUE_NAME, connection="AzureWebJobsStorage")
+def kusto_nl_query(req: func.HttpRequest, jobs: func.Out[str]) -> func.HttpResponse:
     """
     Azure Function to convert natural language prompts to Kusto queries and execute them.
     Accepts POST requests with a natural language prompt and returns query results.
+    With async=true the request is queued and 202 Accepted is returned with a job id to poll.
     """
     logging.info('Kusto NL query function processed a request.')
 
-    try:
-        # Extract the natural language prompt from the request
-        prompt = get_prompt_from_request(req)
+    with track_request("kusto_nl_query") as metrics, request_logging("kusto_nl_query", debug=debug_requested(req.headers)):
+        try:
+            # Extract the natural language prompt from the request
+            prompt = get_prompt_from_request(req)
+
+            conversation_id = get_request_param(req, 'conversation_id')
+            caller = get_caller_id(req.headers)
+
+            try:
+                shaping_options = parse_shaping_options({
+                    name: get_request_param(req, name)
+                    for name in ('max_rows', 'columns', 'top_n_by', 'others_bucket')
+                })
+                summary_mode = parse_summary_mode(get_request_param(req, 'summary'))
+                priority = request_priority(caller, get_request_param(req, 'priority'))
+            except ValueError as e:
+                return func.HttpResponse(
+                    json.dumps({"error": str(e), "status": "error"}),
+                    status_code=400,
+                    mimetype="application/json"
+                )
+
+            incremental = get_request_flag(req, 'incremental')
+            request_options = {name: get_request_param(req, name) for name in CAPTURED_OPTIONS}
+            request_options = {name: value for name, value in request_options.items() if value is not None}
+
+            if get_request_flag(req, 'async'):
+                job = job_store.create({
+                    "prompt": prompt,
+                    "conversation_id": conversation_id,
+                    "shaping_options": shaping_options,
+                    "summary_mode": summary_mode,
+                    "incremental": incremental,
+                    "debug_log": debug_requested(req.headers),
+                    "caller": caller,
+                    "request_options": request_options
+                })
+                if NL_KUSTO_JOB_BACKEND == "functions":
+                    jobs.set(json.dumps({"job_id": job["job_id"]}))
+                else:
+                    local_job_queue.submit(job["job_id"])
+
+                status_url = f"/kusto_nl_jobs/{job['job_id']}"
+                logging.info("Queued asynchronous job %s", job["job_id"])
+                return func.HttpResponse(
+                    json.dumps({"job_id": job["job_id"], "status": job["status"], "status_url": status_url}),
+                    status_code=202,
+                    headers={"Location": status_url},
+                    mimetype="application/json"
+                )
 
-        logging.info(f"Processing natural language prompt: {prompt}")
-
-        kusto_query = generate_kusto_query_from_nl(prompt)
-        
-        results = execute_kusto_query(kusto_query)
-
-        nl_summarized_results = summarize_kusto_results(kusto_query, results)
-
-        logging.info(f"Generated Kusto query: {kusto_query}")
-        logging.info(f"Query results: {results}")
-        logging.info(f"Summarized results: {nl_summarized_results}")
-        
-        response_data = {
-            "prompt": prompt,
-            "generated_query": kusto_query,
-            "results": results,
-            "summarized_results": nl_summarized_results,
-            "status": "success"
-        }
-        
+            # Interactive requests keep reserved capacity; bulk requests are limited and shed first
+            with admit(caller, priority):
+                response_data = run_nl_query(
+                    prompt,
+                    metrics,
+                    conversation_id=conversation_id,
+                    shaping_options=shaping_options,
+                    summary_mode=summary_mode,
+                    incremental=incremental,
+                    request_options=request_options
+                )
+            
+            return func.HttpResponse(
+                json.dumps(response_data, indent=2),
+                status_code=200,
+                mimetype="application/json"
+            )
+
+        except AdmissionRejectedError as e:
+            logging.warning("Rejected %s request from %s: %s", priority, caller, e)
+            return admission_rejected_response(e)
+        except DeadlineExceededError as e:
+            return deadline_exceeded_response(e)
+        except Exception as e:
+            logging.error("Error processing request: %s", e)
+            return func.HttpResponse(
+                json.dumps({
+                    "error": f"Internal server error: {str(e)}",
+                    "status": "error"
+                }),
+                status_code=500,
+                mimetype="application/json"
+            )
+
+@app.function_name(name="kustoNlJobStatus")
+@app.route(route="kusto_nl_jobs/{job_id}", methods=["GET"])
+def kusto_nl_job_status(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Azure Function that returns the status of an asynchronous NL query job, and its result once finished.
+    """
+    job = job_store.get(req.route_params.get('job_id'))
+    if job is None:
         return func.HttpResponse(
-            json.dumps(response_data, indent=2),
-            status_code=200,
+            json.dumps({"error": "Job not found", "status": "error"}),
+            status_code=404,
             mimetype="application/json"
         )
 
+    job.pop("request", None)
+    return func.HttpResponse(
+        json.dumps(job, indent=2),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+@app.function_name(name="kustoNlJobWorker")
+@app.queue_trigger(arg_name="msg", queue_name=NL_KUSTO_JOB_QUEUE_NAME, connection="AzureWebJobsStorage")
+def kusto_nl_job_worker(msg: func.QueueMessage) -> None:
+    """
+    Processes asynchronous NL query jobs queued by kusto_nl_query when NL_KUSTO_JOB_BACKEND is 'functions'.
+    """
+    job_id = json.loads(msg.get_body().decode('utf-8'))["job_id"]
+    logging.info("Processing asynchronous job %s", job_id)
+    process_job(job_store, job_id, run_nl_job)
+
+@app.function_name(name="RefreshTenantCube")
+@app.timer_trigger(schedule="0 */5 * * * *", arg_name="timer", run_on_startup=False)
+def refresh_tenant_cube_timer(timer: func.TimerRequest) -> None:
+    """
+    Rebuilds the shared GetTenantVersions aggregate cube used for distribution questions.
+    """
+    logging.info('Tenant cube refresh timer fired.')
+
+    try:
+        refresh_tenant_cube(execute_kusto_query)
+    except Exception as e:
+        logging.error("Error refreshing tenant cube: %s", e)
+
+@app.function_name(name="PurgeExpiredJobs")
+@app.timer_trigger(schedule="0 0 * * * *", arg_name="timer", run_on_startup=False)
+def purge_expired_jobs_timer(timer: func.TimerRequest) -> None:
+    """
+    Deletes asynchronous job records older than NL_KUSTO_JOB_TTL_SECONDS.
+    """
+    removed = job_store.purge_expired()
+    logging.info("Purged %d expired asynchronous jobs.", removed)
+
+@app.function_name(name="RefreshSchemaCatalog")
+@app.timer_trigger(schedule="0 */30 * * * *", arg_name="timer", run_on_startup=False)
+def refresh_schema_catalog_timer(timer: func.TimerRequest) -> None:
+    """
+    Re-fetches function and table schemas once they are older than SCHEMA_CATALOG_REFRESH_SECONDS,
+    so generation requests rarely see a stale schema.
+    """
+    logging.info('Schema catalog refresh timer fired.')
+
+    try:
+        schema_catalog.refresh_if_stale()
     except Exception as e:
-        logging.error(f"Error processing request: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({
-                "error": f"Internal server error: {str(e)}",
-                "status": "error"
-            }),
-            status_code=500,
-            mimetype="application/json"
-        )
+        logging.error("Error refreshing schema catalog: %s", e)
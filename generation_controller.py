@@ -0,0 +1,219 @@
+import atexit
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+
+GENERATION_BUDGETS_PATH = os.environ.get("GENERATION_BUDGETS_PATH", os.path.join(tempfile.gettempdir(), "apim_nl_kusto_generation_budgets.json"))
+GENERATION_STREAMING = os.environ.get("GENERATION_STREAMING", "false").lower() in ("1", "true", "yes", "on")
+GENERATION_BUDGETS_SAVE_SECONDS = float(os.environ.get("GENERATION_BUDGETS_SAVE_SECONDS", 60))
+
+DEFAULT_MAX_TOKENS = 1000
+MIN_MAX_TOKENS = 128
+BUDGET_MARGIN = 1.5
+BUDGET_PERCENTILE = 0.95
+BUDGET_GRANULARITY = 64
+MIN_SAMPLES = 20
+SAMPLE_WINDOW = 200
+
+# Stops right after the closing fence of the ```kql block. An untagged opening fence before
+# the query also matches; complete_fenced_query reports that as incomplete so the caller
+# retries without the stop sequence.
+KQL_STOP_SEQUENCES = ["\n```\n"]
+
+# First matching intent wins; questions that match none are "general"
+INTENT_KEYWORDS = (
+    ("quarantine", ("quarantin",)),
+    ("resource_provider", ("resourceprovider", "resource provider", "runtime", "cluster")),
+    ("orchestration", ("orchestration", "instance")),
+    ("windows", ("windows",)),
+    ("release_status", ("release status", "status", "where is")),
+    ("distribution", ("distribution", "how many", "count", "breakdown")),
+)
+
+_FENCED_QUERY = re.compile(r"```kql\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+_OPENING_FENCE = re.compile(r"```kql", re.IGNORECASE)
+
+
+def intent_of(question: str) -> str:
+    """
+    Classify a question into a coarse intent whose queries have similar length.
+    """
+    text = question.lower()
+    for intent, keywords in INTENT_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return intent
+    return "general"
+
+
+def complete_fenced_query(content: str, finish_reason: str) -> tuple:
+    """
+    Restore the closing fence removed by the stop sequence and report whether the query is complete.
+
+    Returns:
+        tuple: (content, True if the completion holds a whole ```kql block)
+    """
+    content = content or ""
+    if _FENCED_QUERY.search(content):
+        return content, True
+    if finish_reason == "length" or not has_opening_fence(content):
+        # Cut by the budget, or stopped at a fence that does not start a kql block
+        return content, False
+    # The stop sequence ate the closing fence
+    return content.rstrip() + "\n```", True
+
+
+def has_opening_fence(content: str) -> bool:
+    """
+    Whether a completion has started its ```kql block.
+    """
+    return bool(_OPENING_FENCE.search(content or ""))
+
+
+def read_fenced_query(deltas) -> tuple:
+    """
+    Consume streamed text deltas until the ```kql block is closed.
+
+    Args:
+        deltas (iterable): Text fragments in arrival order
+
+    Returns:
+        tuple: (text received up to the closing fence, True if the stream was cut short)
+    """
+    received = []
+    text = ""
+    for delta in deltas:
+        if not delta:
+            continue
+        received.append(delta)
+        text = "".join(received)
+        match = _FENCED_QUERY.search(text)
+        if match:
+            return text[:match.end()], True
+    return text, False
+
+
+class GenerationBudgets:
+    """
+    Per-intent max_tokens budgets learned from recorded completions.
+
+    The budget is the p95 completion length of the intent times a safety margin, rounded
+    up to BUDGET_GRANULARITY so completion cache keys stay stable. Until an intent has
+    MIN_SAMPLES completions, DEFAULT_MAX_TOKENS is used.
+
+    Samples are recorded in memory; a background thread writes them to path at most
+    every save_seconds, so generations never wait on the file.
+    """
+
+    def __init__(self, path: str = GENERATION_BUDGETS_PATH, margin: float = BUDGET_MARGIN, min_samples: int = MIN_SAMPLES, window: int = SAMPLE_WINDOW, save_seconds: float = GENERATION_BUDGETS_SAVE_SECONDS):
+        self.path = path
+        self.margin = margin
+        self.min_samples = min_samples
+        self.window = window
+        self.save_seconds = save_seconds
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._dirty = False
+        self._saver = None
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as budgets_file:
+                    for intent, values in json.load(budgets_file).items():
+                        self._samples[intent] = deque(values, maxlen=window)
+            except (OSError, ValueError) as e:
+                logging.warning("Could not read generation budgets from %s: %s", path, e)
+
+    def budget_for(self, question: str) -> int:
+        return self.intent_budget(intent_of(question))
+
+    def intent_budget(self, intent: str) -> int:
+        with self._lock:
+            samples = sorted(self._samples.get(intent, ()))
+        if len(samples) < self.min_samples:
+            return DEFAULT_MAX_TOKENS
+        p95 = samples[max(0, math.ceil(BUDGET_PERCENTILE * len(samples)) - 1)]
+        budget = math.ceil(p95 * self.margin / BUDGET_GRANULARITY) * BUDGET_GRANULARITY
+        return max(MIN_MAX_TOKENS, min(DEFAULT_MAX_TOKENS, budget))
+
+    def record(self, question: str, completion_tokens: int) -> None:
+        """
+        Add the completion length of a finished (not truncated) generation, as reported by the service.
+        """
+        if not completion_tokens:
+            return
+        with self._lock:
+            self._samples.setdefault(intent_of(question), deque(maxlen=self.window)).append(int(completion_tokens))
+            self._dirty = True
+            if self._saver is None and self.path:
+                self._saver = threading.Thread(target=self._save_periodically, name="generation-budgets", daemon=True)
+                self._saver.start()
+
+    def learn_from_capture(self, records: list) -> int:
+        """
+        Learn from traffic capture records (see traffic_capture.py). Returns the number used.
+
+        Streamed generations only have estimated token counts and are skipped.
+        """
+        used = 0
+        for record in records:
+            usage = (record.get("token_usage") or {}).get("generate", {})
+            tokens = usage.get("completion_tokens")
+            if record.get("prompt") and tokens and not usage.get("estimated") and record.get("status", 200) < 400:
+                with self._lock:
+                    self._samples.setdefault(intent_of(record["prompt"]), deque(maxlen=self.window)).append(int(tokens))
+                    self._dirty = True
+                used += 1
+        self.flush()
+        return used
+
+    def _save_periodically(self) -> None:
+        while True:
+            time.sleep(self.save_seconds)
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the samples to path if any were recorded since the last write.
+        """
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            snapshot = {intent: list(values) for intent, values in self._samples.items()}
+            self._dirty = False
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(descriptor, "w", encoding="utf-8") as budgets_file:
+                json.dump(snapshot, budgets_file)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.warning("Could not save generation budgets: %s", e)
+
+    def report(self) -> dict:
+        """
+        Current budget and sample count per intent.
+        """
+        with self._lock:
+            intents = {intent: len(values) for intent, values in self._samples.items()}
+        return {intent: {"samples": count, "max_tokens": self.intent_budget(intent)} for intent, count in intents.items()}
+
+
+generation_budgets = GenerationBudgets()
+atexit.register(generation_budgets.flush)
+
+
+if __name__ == "__main__":
+    import argparse
+    from traffic_capture import load_capture
+
+    parser = argparse.ArgumentParser(description="Learn per-intent generation budgets from traffic capture files.")
+    parser.add_argument("capture", nargs="+", help="capture files written with TRAFFIC_CAPTURE_PATH")
+    args = parser.parse_args()
+
+    used = generation_budgets.learn_from_capture(load_capture(args.capture))
+    print(json.dumps({"records_used": used, "budgets": generation_budgets.report()}, indent=2))
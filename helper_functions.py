@@ -4,37 +4,120 @@ from azure.kusto.data import KustoClient
 from utils import Utils
 import os
 from openai import AzureOpenAI
-from prompts.system_prompts import DEFAULT_KUSTO_SYSTEM_PROMPT, KUSTO_RESULTS_SUMMARY_SYSTEM_PROMPT
-from prompts.prompts_dict import prompts_dict
+from openai.types.chat import ChatCompletion
+import json
+from prompts.prompt_compiler import compiled_prompts, GENERATION_PROMPT, CATALOG_GENERATION_PROMPT, SUMMARY_PROMPT
+from request_metrics import current_metrics
+from traffic_capture import replay_standins
+from llm_cache import completion_cache, completion_cache_key
+from fast_summarizer import summarize_distribution
+from schema_catalog import SchemaCatalog, kusto_schema_fetcher
+from generation_controller import (
+    generation_budgets, complete_fenced_query, has_opening_fence, read_fenced_query,
+    KQL_STOP_SEQUENCES, DEFAULT_MAX_TOKENS, GENERATION_STREAMING,
+)
+from prompts.prompt_compiler import count_tokens
+from request_logging import log_detail, truncated, row_summary
+from types import SimpleNamespace
 
 CONFIG_FILE_NAME = "config.json"
 
-def generate_kusto_query_from_nl(prompt: str) -> str:
+FOLLOW_UP_PROMPT_TEMPLATE = """Previous query in this conversation:
+```kql
+{previous_query}
+```
+
+Follow-up question: {prompt}
+
+If the follow-up only narrows, reorders, limits or regroups the previous results, repeat the previous query unchanged and append the new operators at the end. Otherwise write a new query."""
+
+def generate_kusto_query_from_nl(prompt: str, previous_query: str = None) -> str:
     """
     Placeholder function to generate Kusto query from natural language prompt.
     
     Args:
         prompt (str): Natural language description of the query
+        previous_query (str, optional): Last query of the conversation, used to phrase follow-ups as refinements
         
     Returns:
         str: Generated Kusto query
     """    
-    logging.info(f"Generating Kusto query for prompt: {prompt}")
-
-    # Build system prompt by appending prompt_dict entries
-    system_prompt = DEFAULT_KUSTO_SYSTEM_PROMPT
-    if prompts_dict:
-        for i, (k, v) in enumerate(prompts_dict.items()):
-            system_prompt += f"\nQuestion {i}: {k}\nKqlQuery: {v}"
-
-    kql_query = execute_llm_call(
-        user_prompt=prompt,
-        system_prompt=system_prompt,
-        return_query_only=True
-    )
+    logging.info("Generating Kusto query for prompt: %s", truncated(prompt))
+
+    if replay_standins:
+        return replay_standins.generate_query(prompt)
+
+    # System prompt and examples are compiled once at startup so the prefix stays cacheable
+    system_prompt = compiled_prompts.get(GENERATION_PROMPT).text
+
+    user_prompt = prompt
+    if previous_query:
+        user_prompt = FOLLOW_UP_PROMPT_TEMPLATE.format(previous_query=previous_query, prompt=prompt)
+
+    # With a schema catalog, only the relevant columns are sent, after the stable system prompt
+    schema_prompt = schema_catalog.schema_prompt(prompt, user_prompt)
+    if schema_prompt:
+        system_prompt = compiled_prompts.get(CATALOG_GENERATION_PROMPT).text
+        user_prompt = schema_prompt
+
+    # Generation stops at the closing fence and is capped by the budget learned for this kind of question
+    max_tokens = generation_budgets.budget_for(prompt)
+    content, complete, completion_tokens = generate_fenced_query(user_prompt, system_prompt, max_tokens)
+    if not complete and not has_opening_fence(content):
+        # Stopped at a fence without a kql tag, or before any fence: let the model finish.
+        # Such a completion also holds the text after the query, so it is not learned from
+        logging.info("Query generation ended without a ```kql block, retrying with %d tokens and no stop sequence", DEFAULT_MAX_TOKENS)
+        content, _, _ = generate_fenced_query(user_prompt, system_prompt, DEFAULT_MAX_TOKENS, stop=None)
+    else:
+        if not complete and max_tokens < DEFAULT_MAX_TOKENS:
+            logging.info("Query generation exceeded its budget of %d tokens, retrying with %d", max_tokens, DEFAULT_MAX_TOKENS)
+            content, complete, completion_tokens = generate_fenced_query(user_prompt, system_prompt, DEFAULT_MAX_TOKENS)
+        if complete:
+            generation_budgets.record(prompt, completion_tokens)
+
+    log_detail(logging.INFO, "LLM response for query generation: %s", truncated(content))
+    kql_query = extract_kql_query(content)
 
     return kql_query.strip()
 
+def generate_fenced_query(user_prompt: str, system_prompt: str, max_tokens: int, stop: list = KQL_STOP_SEQUENCES) -> tuple:
+    """
+    Run one query generation call that ends at the closing fence of the ```kql block.
+
+    Args:
+        user_prompt (str): User message for the generation call
+        system_prompt (str): System prompt for the generation call
+        max_tokens (int): Completion token budget
+        stop (list, optional): Stop sequences, or None to let the model finish
+
+    Returns:
+        tuple: (response content with its closing fence, True if the query is complete,
+            completion tokens reported by the service, or None for streamed calls)
+    """
+    if GENERATION_STREAMING:
+        content, finish_reason = execute_llm_call(
+            user_prompt=user_prompt,
+            system_prompt=system_prompt,
+            return_query_only=False,
+            max_tokens=max_tokens,
+            stop=stop,
+            stream=True
+        )
+        # Streams are closed before the usage chunk, and estimates would skew the learned budgets
+        completion_tokens = None
+    else:
+        response = execute_llm_call(
+            user_prompt=user_prompt,
+            system_prompt=system_prompt,
+            return_full_response=True,
+            max_tokens=max_tokens,
+            stop=stop
+        )
+        content, finish_reason = response.choices[0].message.content, response.choices[0].finish_reason
+        completion_tokens = getattr(getattr(response, "usage", None), "completion_tokens", None)
+    content, complete = complete_fenced_query(content, finish_reason)
+    return content, complete, completion_tokens
+
 def get_prompt_from_request(req: func.HttpRequest) -> str:
     """
     Extracts the 'prompt' parameter from the HTTP request.
@@ -45,23 +128,56 @@ def get_prompt_from_request(req: func.HttpRequest) -> str:
     Returns:
         str: The prompt string if found, otherwise None
     """
-    prompt = req.params.get('prompt')
-    if not prompt:
+    return get_request_param(req, 'prompt')
+
+def get_request_param(req: func.HttpRequest, name: str, default=None):
+    """
+    Extracts a named parameter from the query string, falling back to the JSON body.
+    
+    Args:
+        req (func.HttpRequest): The HTTP request object
+        name (str): Name of the parameter
+        default (optional): Value returned when the parameter is missing
+        
+    Returns:
+        The parameter value if found, otherwise default
+    """
+    value = req.params.get(name)
+    if not value:
         try:
             req_body = req.get_json()
             if req_body:
-                prompt = req_body.get('prompt')
+                value = req_body.get(name)
         except ValueError as e:
-            logging.error(f"Failed to parse JSON body: {e}")
-            return None
-    return prompt
+            logging.error("Failed to parse JSON body: %s", e)
+            return default
+    return value if value is not None else default
+
+def get_request_flag(req: func.HttpRequest, name: str) -> bool:
+    """
+    Reads a boolean parameter such as async=true from the query string or JSON body.
+    
+    Args:
+        req (func.HttpRequest): The HTTP request object
+        name (str): Name of the parameter
+        
+    Returns:
+        bool: True for true/1/yes/on (case-insensitive) or a JSON true, otherwise False
+    """
+    value = get_request_param(req, name)
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "on") if value is not None else False
 
 def execute_llm_call(
     user_prompt: str, 
     system_prompt: str = None, 
     return_query_only: bool = True,
     return_full_response: bool = False,
-    deployment_model: str = "gpt-4o-mini"
+    deployment_model: str = "gpt-4o-mini",
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    stop: list = None,
+    stream: bool = False
 ) -> str:
     """
     Execute LLM call to generate Kusto queries from natural language.
@@ -72,6 +188,10 @@ def execute_llm_call(
         return_query_only (bool, optional): If True, extracts only the KQL query from response. Default True
         return_full_response (bool, optional): If True, returns the full API response object. Default False
         deployment_model (str, optional): The model to use for the LLM call. Default is "gpt-4o-mini"
+        max_tokens (int, optional): Maximum completion tokens. Default 1000
+        stop (list, optional): Stop sequences for the completion
+        stream (bool, optional): If True, streams the completion, stops reading once a fenced KQL block
+            is complete and returns (content, finish_reason). Streamed calls bypass the completion cache
     Returns:
         str or dict: Generated Kusto query string, or full response object if return_full_response=True
     """
@@ -83,18 +203,37 @@ def execute_llm_call(
     if system_prompt:
         messages.insert(0, {"role": "system", "content": system_prompt})
 
-    client = AzureOpenAI(
-        azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
-        api_version="2025-01-01-preview",
-        api_key=os.environ.get("AI_FOUNDRY_API_KEY")
-    )
+    temperature = 0.1  # Lower temperature for more consistent query generation
+    metrics = current_metrics()
+    request_options = {"stop": stop} if stop else {}
 
-    response = client.chat.completions.create(
-        model=deployment_model,
-        messages=messages,
-        temperature=0.1,  # Lower temperature for more consistent query generation
-        max_tokens=1000
-    )
+    if stream:
+        if return_full_response:
+            raise ValueError("Streamed calls return text, not a full response")
+        return _stream_llm_call(messages, deployment_model, temperature, max_tokens, request_options)
+
+    # Identical requests from any worker or instance are served from the shared completion cache
+    cache_key = completion_cache_key(deployment_model, messages, temperature, max_tokens, stop)
+    cached_response = completion_cache.get(cache_key)
+    if cached_response is not None:
+        response = ChatCompletion.model_validate_json(cached_response)
+        if metrics is not None:
+            metrics.attributes.setdefault("llm_cache", {})[metrics.active_stage or "llm"] = "hit"
+    else:
+        client = _create_openai_client()
+
+        response = client.chat.completions.create(
+            model=deployment_model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **request_options
+        )
+        completion_cache.set(cache_key, response.model_dump_json())
+
+        if metrics is not None:
+            metrics.attributes.setdefault("llm_cache", {})[metrics.active_stage or "llm"] = "miss"
+            metrics.add_token_usage(getattr(response, "usage", None))
 
     if return_full_response:
         return response
@@ -102,11 +241,57 @@ def execute_llm_call(
     response_content = response.choices[0].message.content
 
     if return_query_only:
-        logging.info(f"LLM response for query generation: {response_content}")
+        log_detail(logging.INFO, "LLM response for query generation: %s", truncated(response_content))
         return extract_kql_query(response_content)
     
     return response_content
 
+def _create_openai_client() -> AzureOpenAI:
+    return AzureOpenAI(
+        azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
+        api_version="2025-01-01-preview",
+        api_key=os.environ.get("AI_FOUNDRY_API_KEY")
+    )
+
+def _stream_llm_call(messages: list, deployment_model: str, temperature: float, max_tokens: int, request_options: dict) -> tuple:
+    """
+    Stream a completion and close the connection as soon as the fenced KQL block is complete.
+
+    Returns:
+        tuple: (content received, finish_reason, or "stop" when the stream was cut short)
+    """
+    client = _create_openai_client()
+    completion = client.chat.completions.create(
+        model=deployment_model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        **request_options
+    )
+    finish = {"reason": None}
+
+    def deltas():
+        for chunk in completion:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                finish["reason"] = choice.finish_reason
+            yield choice.delta.content
+
+    try:
+        content, cut_short = read_fenced_query(deltas())
+    finally:
+        completion.close()
+
+    metrics = current_metrics()
+    if metrics is not None:
+        # Streams that are cut short never receive a usage chunk, so the counts are estimated
+        prompt_tokens = sum(count_tokens(message["content"])[0] for message in messages)
+        metrics.add_token_usage(SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=count_tokens(content)[0], estimated=True))
+    return content, "stop" if cut_short else finish["reason"]
+
 def extract_kql_query(response_content: str) -> str:
     """
     Extract KQL query from LLM response content.
@@ -147,25 +332,28 @@ def extract_kql_query(response_content: str) -> str:
     logging.warning("Could not extract KQL query from response, returning full content")
     return response_content.strip()
 
-def execute_kusto_query(query: str) -> dict:
+def execute_kusto_query(query: str, generated_query: str = None) -> dict:
     """
     Placeholder function to execute Kusto query against Azure Data Explorer.
     
     Args:
         query (str): Kusto query to execute
+        generated_query (str, optional): Query as generated, before kql_rewriter changed it.
+            Replay stand-ins are looked up by this text, which is what traffic capture records
         
     Returns:
         dict: Query results and metadata
     """
 
+    if replay_standins:
+        return replay_standins.execute_query(generated_query or query)
+
     config_dict = Utils.load_configs(CONFIG_FILE_NAME)
     kusto_uri = config_dict["kustoUri"]
     database_name = config_dict["databaseName"]
     authentication_mode = config_dict["authenticationMode"]
 
-    logging.info(f"kustoUri: {kusto_uri}")
-    logging.info(f"databaseName: {database_name}")
-    logging.info(f"authenticationMode: {authentication_mode}")
+    logging.debug("kustoUri: %s, databaseName: %s, authenticationMode: %s", kusto_uri, database_name, authentication_mode)
 
     kusto_connection_string = Utils.Authentication.generate_connection_string(kusto_uri, authentication_mode)
     
@@ -174,30 +362,36 @@ def execute_kusto_query(query: str) -> dict:
         Utils.error_handler("Connection String error. Please validate your configuration file.")
     else:
         with KustoClient(kusto_connection_string) as kusto_client:
-            logging.info(f"Executing Kusto query: {query[:100]}...")
+            logging.info("Executing Kusto query: %s", truncated(query, 100))
             response = kusto_client.execute(database_name, query)
-            logging.info("Query executed successfully.")
-            logging.debug(f"Query response: {response}")
             # Convert KustoResultTable to list of dicts for JSON serialization
             result_table = response.primary_results[0]
             columns = [col.column_name for col in result_table.columns]
             rows = [dict(zip(columns, row)) for row in result_table.rows]
+            logging.info("Query executed successfully: %s", row_summary(rows))
             return rows
 
-def summarize_kusto_results(query: str, results: list) -> str:
-    user_prompt = f"""Please analyze the following KQL query and its results:
+schema_catalog = SchemaCatalog(kusto_schema_fetcher(execute_kusto_query))
 
-Query:
-{query}
+def summarize_kusto_results(query: str, results: list, mode: str = "llm") -> str:
+    if replay_standins:
+        return replay_standins.summarize(query)
 
-Results:
-{results}
+    metrics = current_metrics()
+    if mode == "fast":
+        # Count-by-dimension results are summarized locally; anything else still goes to the LLM
+        summary = summarize_distribution(results)
+        if metrics is not None:
+            metrics.attributes["summary_source"] = "local" if summary is not None else "llm"
+        if summary is not None:
+            return summary
 
-Provide a clear summary of the key findings."""
+    # Only the variable query and results go in the user message; the instructions live in the compiled system prompt
+    user_prompt = f"Query:\n{query}\n\nResults:\n{json.dumps(results, default=str, ensure_ascii=False)}"
 
     response = execute_llm_call(
         user_prompt=user_prompt,
-        system_prompt=KUSTO_RESULTS_SUMMARY_SYSTEM_PROMPT,
+        system_prompt=compiled_prompts.get(SUMMARY_PROMPT).text,
         return_query_only=False,
         return_full_response=True
     )
@@ -0,0 +1,279 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta, timezone
+from kql_parser import KqlSyntaxError, parse_query, scalar_lets, split_by_clause, split_top_level, tokenize, token_signature
+from kql_evaluator import UnsupportedQueryError, evaluate_operators
+from tenant_cube import CUBE_SOURCE
+
+INCREMENTAL_MAX_SNAPSHOTS = int(os.environ.get("INCREMENTAL_MAX_SNAPSHOTS", 16))
+INCREMENTAL_MAX_ROWS = int(os.environ.get("INCREMENTAL_MAX_ROWS", 200000))
+INCREMENTAL_FULL_REFRESH_SECONDS = float(os.environ.get("INCREMENTAL_FULL_REFRESH_SECONDS", 60 * 60))
+# Tenant states can land in the table a little after their timestamp, so each delta re-reads this much
+INCREMENTAL_OVERLAP_SECONDS = float(os.environ.get("INCREMENTAL_OVERLAP_SECONDS", 5 * 60))
+MAX_DELTA_GROUPS = 50
+
+KEY_COLUMN = "resourceId"
+WATERMARK_COLUMN = "LastStateUpdatedTimestamp"
+# Set on delta rows that pass the query's where filters; the others only mark their tenant as changed
+MATCH_COLUMN = "_incremental_match"
+CHANGED_SOURCE = "_incremental_changed"
+
+# The per-tenant rows of unchanged tenants are kept, so their filters must not depend on the time of the check
+TIME_RELATIVE_FUNCTIONS = {"ago", "now"}
+
+# Operators that keep every output row tied to one GetTenantVersions row and keep its columns
+ROW_OPERATORS = {"where", "extend", "join", "lookup", "mv-expand", "parse"}
+
+IncrementalAnswer = namedtuple("IncrementalAnswer", ["rows", "delta"])
+
+_FRACTION = re.compile(r"(\.\d{6})\d+")
+
+
+def _parse_timestamp(value) -> datetime:
+    parsed = value if isinstance(value, datetime) else datetime.fromisoformat(_FRACTION.sub(r"\1", str(value).strip()).replace("Z", "+00:00"))
+    return parsed.astimezone(timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _is_time_relative(tokens: list) -> bool:
+    return any(token.kind == "ident" and token.value.lower() in TIME_RELATIVE_FUNCTIONS for token in tokens)
+
+
+def split_incremental_query(query: str) -> tuple:
+    """
+    Split a GetTenantVersions query into the per-tenant part run on the cluster and the
+    aggregation part evaluated locally over the snapshot.
+
+    Returns:
+        tuple: (prefix with let statements, source text, row operators, local operators, scalars)
+
+    Raises:
+        UnsupportedQueryError: If the query does not read GetTenantVersions row by row first,
+            or its per-tenant part depends on the time of the check
+    """
+    try:
+        parsed = parse_query(query)
+    except KqlSyntaxError as e:
+        raise UnsupportedQueryError(str(e))
+    source_start, source_end = parsed.source[0].start, parsed.source[-1].end
+    source = query[source_start:source_end]
+    if source.replace(" ", "") not in (CUBE_SOURCE, f"{CUBE_SOURCE}()"):
+        raise UnsupportedQueryError(f"Only {CUBE_SOURCE} queries can be refreshed incrementally")
+    split = 0
+    while split < len(parsed.operators) and parsed.operators[split].name in ROW_OPERATORS:
+        split += 1
+    # Let statements are checked whole, since per-tenant operators can reference them by name
+    for name, tokens in parsed.lets:
+        if _is_time_relative(tokens):
+            raise UnsupportedQueryError(f"Let statement '{name}' depends on the current time")
+    for operator in parsed.operators[:split]:
+        if _is_time_relative(operator.tokens):
+            raise UnsupportedQueryError(f"Per-tenant operator '{operator.name}' depends on the current time")
+    return query[:source_start], source, parsed.operators[:split], parsed.operators[split:], scalar_lets(parsed)
+
+
+def _drops_rows(operator) -> bool:
+    """
+    Whether a row operator other than where can drop a tenant's rows: inner joins and lookups, and mv-expand.
+    """
+    if operator.name == "mv-expand":
+        return True
+    if operator.name not in ("join", "lookup"):
+        return False
+    kind = "leftouter" if operator.name == "lookup" else "innerunique"
+    tokens = operator.tokens
+    for i in range(len(tokens) - 2):
+        if tokens[i].kind == "ident" and tokens[i].value.lower() == "kind" and tokens[i + 1].value == "=":
+            kind = tokens[i + 2].value.lower()
+            break
+    return kind != "leftouter"
+
+
+def delta_query(query: str, prefix: str, source: str, row_operators: list, since: str) -> str:
+    """
+    Build the single query that reads the tenants changed since a watermark.
+
+    where filters become a MATCH_COLUMN flag so that tenants which stopped passing them
+    are still returned. When another operator can drop rows, the changed tenants' keys
+    are added with the flag unset.
+    """
+    pipeline = []
+    for operator in row_operators:
+        if operator.name == "where":
+            condition = query[operator.tokens[0].start:operator.tokens[-1].end]
+            pipeline.append(f"\n| extend {MATCH_COLUMN} = {MATCH_COLUMN} and ({condition})")
+        else:
+            pipeline.append(f"\n| {operator.text}")
+    changed = f"{source}\n| where {WATERMARK_COLUMN} >= datetime({since})"
+    if not any(_drops_rows(operator) for operator in row_operators):
+        return f"{prefix}{changed}\n| extend {MATCH_COLUMN} = true{''.join(pipeline)}"
+    return (
+        f"{prefix}let {CHANGED_SOURCE} = materialize({changed});\n"
+        f"{CHANGED_SOURCE}\n| extend {MATCH_COLUMN} = true{''.join(pipeline)}\n"
+        f"| union ({CHANGED_SOURCE} | project {KEY_COLUMN}, {MATCH_COLUMN} = false)"
+    )
+
+
+def _group_columns(operators: list) -> list:
+    """
+    Output names of the group-by keys of the last summarize, used to match groups between checks.
+    """
+    summarizes = [operator for operator in operators if operator.name == "summarize"]
+    if not summarizes:
+        return [KEY_COLUMN]
+    _, by_tokens = split_by_clause(summarizes[-1].tokens)
+    names = []
+    for segment in split_top_level(by_tokens or [], ","):
+        if len(segment) > 2 and segment[1].value == "=":
+            names.append(segment[0].value)
+        elif len(segment) == 1 and segment[0].kind == "ident":
+            names.append(segment[0].value)
+    return names
+
+
+def diff_results(previous: list, current: list, group_columns: list, limit: int = MAX_DELTA_GROUPS) -> dict:
+    """
+    Describe how an aggregated answer changed: groups added, removed or with different values.
+    """
+    def index(rows):
+        return {tuple(row.get(column) for column in group_columns): row for row in rows}
+
+    def values(row):
+        return {column: value for column, value in row.items() if column not in group_columns} if row else None
+
+    before, after = index(previous), index(current)
+    changes = []
+    for key in list(after) + [key for key in before if key not in after]:
+        old, new = before.get(key), after.get(key)
+        if old == new:
+            continue
+        changes.append({
+            "group": dict(zip(group_columns, key)),
+            "change": "added" if old is None else "removed" if new is None else "changed",
+            "before": values(old),
+            "after": values(new),
+        })
+    return {"changed_groups": len(changes), "groups": changes[:limit], "truncated": len(changes) > limit}
+
+
+class IncrementalSnapshots:
+    """
+    Per-tenant snapshots of GetTenantVersions queries, refreshed from a watermark.
+
+    The first run of a query fetches its per-tenant rows (everything before the first
+    aggregating operator) keyed by resourceId. Later runs fetch only tenants whose
+    LastStateUpdatedTimestamp is newer than the watermark, replace their rows and
+    re-aggregate locally. A full fetch is repeated every full_refresh_seconds, which
+    also picks up deleted tenants and changes on the right side of joins.
+    """
+
+    def __init__(self, max_snapshots: int = INCREMENTAL_MAX_SNAPSHOTS, max_rows: int = INCREMENTAL_MAX_ROWS, full_refresh_seconds: float = INCREMENTAL_FULL_REFRESH_SECONDS, overlap_seconds: float = INCREMENTAL_OVERLAP_SECONDS):
+        self.max_snapshots = max_snapshots
+        self.max_rows = max_rows
+        self.full_refresh_seconds = full_refresh_seconds
+        self.overlap_seconds = overlap_seconds
+        self._snapshots = OrderedDict()
+        # Queries whose aggregation turned out not to be evaluable locally; they are not fetched per tenant again
+        self._unsupported = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _group_rows(self, rows: list) -> dict:
+        tenants = {}
+        for row in rows:
+            if KEY_COLUMN not in row or WATERMARK_COLUMN not in row:
+                raise UnsupportedQueryError(f"Per-tenant rows must keep {KEY_COLUMN} and {WATERMARK_COLUMN}")
+            tenants.setdefault(row[KEY_COLUMN], []).append(row)
+        return tenants
+
+    def answer(self, query: str, kusto_executor) -> IncrementalAnswer:
+        """
+        Answer a query from its snapshot, fetching only tenants changed since the last check.
+
+        Args:
+            query (str): Generated KQL query
+            kusto_executor (callable): Function that runs a query on the cluster and returns rows
+
+        Returns:
+            IncrementalAnswer: (rows, delta), where delta is None on the first check, or None
+                when the query cannot be refreshed incrementally
+        """
+        try:
+            prefix, source, row_operators, local_operators, scalars = split_incremental_query(query)
+        except UnsupportedQueryError as e:
+            logging.info("Query cannot be refreshed incrementally: %s", e)
+            return None
+        key = token_signature(tokenize(query))
+        row_pipeline = "".join(f"\n| {operator.text}" for operator in row_operators)
+
+        with self._lock:
+            if key in self._unsupported:
+                return None
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None:
+                self._snapshots.move_to_end(key)
+
+        try:
+            if snapshot is None or time.monotonic() - snapshot["full_at"] > self.full_refresh_seconds:
+                tenants = self._group_rows(kusto_executor(f"{prefix}{source}{row_pipeline}"))
+                full_at, fetched = time.monotonic(), sum(len(rows) for rows in tenants.values())
+                changed = len(tenants)
+            else:
+                since = (snapshot["watermark"] - timedelta(seconds=self.overlap_seconds)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+                delta_rows = kusto_executor(delta_query(query, prefix, source, row_operators, since))
+                changed_ids = {row[KEY_COLUMN] for row in delta_rows}
+                changed_rows = self._group_rows(
+                    {column: value for column, value in row.items() if column != MATCH_COLUMN}
+                    for row in delta_rows if row.get(MATCH_COLUMN)
+                )
+                tenants = dict(snapshot["tenants"])
+                for resource_id in changed_ids:
+                    # Tenants that no longer pass the query's filters drop out of the answer
+                    if resource_id in changed_rows:
+                        tenants[resource_id] = changed_rows[resource_id]
+                    else:
+                        tenants.pop(resource_id, None)
+                full_at, fetched = snapshot["full_at"], sum(len(rows) for rows in changed_rows.values())
+                changed = len(changed_ids)
+
+            rows = [row for tenant_rows in tenants.values() for row in tenant_rows]
+            if len(rows) > self.max_rows:
+                raise UnsupportedQueryError(f"{len(rows)} per-tenant rows exceed the snapshot limit")
+            columns = list(rows[0].keys()) if rows else []
+            result = evaluate_operators(local_operators, rows, columns, scalars)
+        except UnsupportedQueryError as e:
+            logging.info("Query cannot be refreshed incrementally: %s", e)
+            with self._lock:
+                self._snapshots.pop(key, None)
+                self._unsupported[key] = True
+                while len(self._unsupported) > self.max_snapshots:
+                    self._unsupported.popitem(last=False)
+            return None
+
+        watermarks = [_parse_timestamp(row[WATERMARK_COLUMN]) for row in rows if row.get(WATERMARK_COLUMN)]
+        watermark = max(watermarks) if watermarks else datetime.now(timezone.utc)
+        if snapshot is not None:
+            watermark = max(watermark, snapshot["watermark"])
+
+        delta = None
+        if snapshot is not None:
+            delta = diff_results(snapshot["result"], result, _group_columns(local_operators))
+            delta.update(changed_tenants=changed, fetched_rows=fetched, since=snapshot["checked_at"])
+        with self._lock:
+            self._snapshots[key] = {
+                "tenants": tenants,
+                "result": result,
+                "watermark": watermark,
+                "full_at": full_at,
+                "checked_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self._snapshots.move_to_end(key)
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        logging.info("Incremental refresh fetched %d rows for %d tenants", fetched, changed)
+        return IncrementalAnswer(result, delta)
+
+
+incremental_snapshots = IncrementalSnapshots()
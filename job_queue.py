@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+
+# Unset means a per-instance temp directory, which only the local backend can use
+NL_KUSTO_JOB_SHARED_DIR = os.environ.get("NL_KUSTO_JOB_DIR")
+NL_KUSTO_JOB_DIR = NL_KUSTO_JOB_SHARED_DIR or os.path.join(tempfile.gettempdir(), "apim_nl_kusto_jobs")
+NL_KUSTO_JOB_WORKERS = int(os.environ.get("NL_KUSTO_JOB_WORKERS", 4))
+NL_KUSTO_JOB_TTL_SECONDS = float(os.environ.get("NL_KUSTO_JOB_TTL_SECONDS", 24 * 60 * 60))
+NL_KUSTO_JOB_QUEUE_NAME = "kusto-nl-jobs"
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+def _job_backend(backend: str, shared_dir: str) -> str:
+    """
+    The queue backend to use. The functions backend can run a job on another instance,
+    so it is refused unless job status is stored in a shared NL_KUSTO_JOB_DIR.
+    """
+    if backend == "functions" and not shared_dir:
+        logging.error("NL_KUSTO_JOB_BACKEND=functions needs NL_KUSTO_JOB_DIR on storage shared by all instances; using the local backend")
+        return "local"
+    return backend
+
+
+NL_KUSTO_JOB_BACKEND = _job_backend(os.environ.get("NL_KUSTO_JOB_BACKEND", "local"), NL_KUSTO_JOB_SHARED_DIR)
+
+
+class JobStore:
+    """
+    File-backed job status store, one JSON document per job.
+
+    Writes are atomic renames so a status poll never reads a half-written job.
+    Point the directory at shared storage when the HTTP route and the queue
+    worker can run on different instances.
+    """
+
+    def __init__(self, directory: str = NL_KUSTO_JOB_DIR, ttl_seconds: float = NL_KUSTO_JOB_TTL_SECONDS):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        # Job ids are generated here, but they come back in URLs; never let one escape the directory
+        if not job_id or os.path.basename(job_id) != job_id or job_id.startswith("."):
+            raise KeyError(job_id)
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _write(self, job: dict) -> None:
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w", encoding="utf-8") as job_file:
+            json.dump(job, job_file, default=str)
+        os.replace(temp_path, self._path(job["job_id"]))
+
+    def create(self, request: dict) -> dict:
+        """
+        Record a new queued job for a request payload.
+        """
+        now = time.time()
+        job = {"job_id": uuid.uuid4().hex, "status": JOB_QUEUED, "request": request, "created_at": now, "updated_at": now}
+        self._write(job)
+        return job
+
+    def get(self, job_id: str) -> dict:
+        """
+        Return a job, or None if it does not exist or has expired.
+        """
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as job_file:
+                job = json.load(job_file)
+        except (KeyError, FileNotFoundError):
+            return None
+        if time.time() - job["created_at"] > self.ttl_seconds:
+            return None
+        return job
+
+    def update(self, job_id: str, **fields) -> dict:
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        job.update(fields, updated_at=time.time())
+        self._write(job)
+        return job
+
+    def fail(self, job_id: str, error: str) -> dict:
+        """
+        Record a job as failed even when its record is missing, so pollers stop waiting.
+        """
+        now = time.time()
+        job = {"job_id": job_id, "status": JOB_FAILED, "error": error, "created_at": now, "updated_at": now, "finished_at": now}
+        self._write(job)
+        return job
+
+    def purge_expired(self) -> int:
+        """
+        Delete jobs older than the time-to-live. Returns the number removed.
+        """
+        removed = 0
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".json") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        return removed
+
+
+def process_job(store: JobStore, job_id: str, handler) -> dict:
+    """
+    Run a queued job through handler(request) and record its result or error.
+    """
+    job = store.get(job_id)
+    if job is None:
+        logging.warning("Job %s not found or expired, marking it failed", job_id)
+        try:
+            return store.fail(job_id, "Job record not found or expired")
+        except KeyError:
+            return None
+    if job["status"] in (JOB_SUCCEEDED, JOB_FAILED):
+        return job
+    store.update(job_id, status=JOB_RUNNING, started_at=time.time())
+    try:
+        result = handler(job["request"])
+    except Exception as e:
+        logging.error("Job %s failed: %s", job_id, e)
+        return store.update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+    return store.update(job_id, status=JOB_SUCCEEDED, result=result, finished_at=time.time())
+
+
+class LocalJobQueue:
+    """
+    In-process stand-in for the Functions queue trigger: a bounded pool of worker threads.
+    """
+
+    def __init__(self, store: JobStore, handler, workers: int = NL_KUSTO_JOB_WORKERS):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"nl-kusto-job-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            try:
+                process_job(self.store, job_id, self.handler)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, job_id: str) -> None:
+        self._start()
+        self._queue.put(job_id)
+
+    def join(self) -> None:
+        """
+        Block until every submitted job has been processed.
+        """
+        self._queue.join()
@@ -0,0 +1,407 @@
+import re
+from kql_parser import (
+    parse_expression,
+    parse_assignment,
+    split_by_clause,
+    split_top_level,
+    referenced_columns,
+    substitute_lets,
+)
+
+SUPPORTED_OPERATORS = {"where", "project", "extend", "summarize", "order", "take", "top", "distinct", "count"}
+
+SUPPORTED_AGGREGATES = {"count", "dcount", "sum", "min", "max"}
+
+
+class UnsupportedQueryError(Exception):
+    """Raised when a query uses KQL that the local evaluator cannot prove it handles correctly."""
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _to_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _has_term(text: str, term: str, case_sensitive: bool) -> bool:
+    if not term:
+        return True
+    flags = 0 if case_sensitive else re.IGNORECASE
+    return re.search(rf"(?<![A-Za-z0-9]){re.escape(term)}(?![A-Za-z0-9])", text, flags) is not None
+
+
+def _compare(operator: str, left, right) -> bool:
+    if left is None or right is None:
+        return False
+    if _is_number(left) != _is_number(right):
+        raise UnsupportedQueryError(f"Cannot compare {type(left).__name__} with {type(right).__name__}")
+    if operator == "<":
+        return left < right
+    if operator == ">":
+        return left > right
+    if operator == "<=":
+        return left <= right
+    return left >= right
+
+
+def _string_predicate(operator: str, left, right) -> bool:
+    negated = operator.startswith("!")
+    name = operator.lstrip("!")
+    text, pattern = _to_text(left), _to_text(right)
+    if name == "contains":
+        result = pattern.lower() in text.lower()
+    elif name == "contains_cs":
+        result = pattern in text
+    elif name == "has":
+        result = _has_term(text, pattern, case_sensitive=False)
+    elif name == "has_cs":
+        result = _has_term(text, pattern, case_sensitive=True)
+    elif name == "startswith":
+        result = text.lower().startswith(pattern.lower())
+    elif name == "endswith":
+        result = text.lower().endswith(pattern.lower())
+    else:
+        raise UnsupportedQueryError(f"String operator '{operator}' is not supported locally")
+    return not result if negated else result
+
+
+def _to_number(value, cast):
+    if value is None or value == "":
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+SCALAR_FUNCTIONS = {
+    "tolower": lambda value: None if value is None else _to_text(value).lower(),
+    "toupper": lambda value: None if value is None else _to_text(value).upper(),
+    "tostring": _to_text,
+    "strlen": lambda value: len(_to_text(value)),
+    "strcat": lambda *values: "".join(_to_text(v) for v in values),
+    "replace_string": lambda text, lookup, replacement: _to_text(text).replace(_to_text(lookup), _to_text(replacement)),
+    "toint": lambda value: _to_number(value, lambda v: int(float(v))),
+    "tolong": lambda value: _to_number(value, lambda v: int(float(v))),
+    "todouble": lambda value: _to_number(value, float),
+    "toreal": lambda value: _to_number(value, float),
+    "isempty": lambda value: value is None or value == "",
+    "isnotempty": lambda value: not (value is None or value == ""),
+    "isnull": lambda value: value is None,
+    "isnotnull": lambda value: value is not None,
+    "not": lambda value: not value,
+    "coalesce": lambda *values: next((v for v in values if v is not None and v != ""), None),
+    "iff": lambda condition, if_true, if_false: if_true if condition else if_false,
+    "iif": lambda condition, if_true, if_false: if_true if condition else if_false,
+    "round": lambda value, digits=0: None if value is None else round(value, int(digits)),
+}
+
+
+def evaluate_expression(node, row: dict):
+    """
+    Evaluate a scalar expression tree against a single row.
+
+    Args:
+        node (tuple): Expression tree from kql_parser.parse_expression
+        row (dict): Column name to value mapping
+
+    Returns:
+        The value of the expression for the row
+    """
+    kind = node[0]
+    if kind == "lit":
+        return node[1]
+    if kind == "col":
+        if node[1] not in row:
+            raise UnsupportedQueryError(f"Column '{node[1]}' is not available")
+        return row[node[1]]
+    if kind == "neg":
+        value = evaluate_expression(node[1], row)
+        if value is not None and not _is_number(value):
+            raise UnsupportedQueryError("Negation needs a numeric operand")
+        return None if value is None else -value
+    if kind == "call":
+        function = SCALAR_FUNCTIONS.get(node[1])
+        if function is None:
+            raise UnsupportedQueryError(f"Function '{node[1]}' is not supported locally")
+        arguments = [evaluate_expression(argument, row) for argument in node[2]]
+        try:
+            return function(*arguments)
+        except TypeError as e:
+            raise UnsupportedQueryError(f"Bad arguments for '{node[1]}': {e}")
+    if kind == "in":
+        operator = node[1]
+        value = evaluate_expression(node[2], row)
+        items = [evaluate_expression(item, row) for item in node[3]]
+        if operator.endswith("~"):
+            result = _to_text(value).lower() in [_to_text(item).lower() for item in items]
+        else:
+            result = value in items
+        return not result if operator.startswith("!") else result
+    if kind == "binop":
+        operator = node[1]
+        if operator == "and":
+            return bool(evaluate_expression(node[2], row)) and bool(evaluate_expression(node[3], row))
+        if operator == "or":
+            return bool(evaluate_expression(node[2], row)) or bool(evaluate_expression(node[3], row))
+        left = evaluate_expression(node[2], row)
+        right = evaluate_expression(node[3], row)
+        if operator == "==":
+            return left == right
+        if operator == "!=":
+            return left != right
+        if operator == "=~":
+            return _to_text(left).lower() == _to_text(right).lower()
+        if operator == "!~":
+            return _to_text(left).lower() != _to_text(right).lower()
+        if operator in ("<", ">", "<=", ">="):
+            return _compare(operator, left, right)
+        if operator in ("+", "-", "*", "/", "%"):
+            if left is None or right is None:
+                return None
+            if not (_is_number(left) and _is_number(right)):
+                raise UnsupportedQueryError(f"Arithmetic '{operator}' needs numeric operands")
+            if operator == "+":
+                return left + right
+            if operator == "-":
+                return left - right
+            if operator == "*":
+                return left * right
+            if right == 0:
+                return None
+            if operator == "%":
+                return left % right
+            if isinstance(left, int) and isinstance(right, int):
+                return int(left / right)
+            return left / right
+        return _string_predicate(operator, left, right)
+    raise UnsupportedQueryError(f"Expression '{kind}' is not supported locally")
+
+
+def _check_columns(node, columns: list) -> None:
+    missing = referenced_columns(node) - set(columns)
+    if missing:
+        raise UnsupportedQueryError(f"Columns {sorted(missing)} are not in the cached results")
+
+
+def _aggregate_name(node) -> str:
+    if node[1] == "count":
+        return "count_"
+    argument = node[2][0]
+    suffix = argument[1] if argument[0] == "col" else "Column"
+    return f"{node[1]}_{suffix}"
+
+
+def _initial_state(function: str):
+    # dcount is exact here; Kusto's estimate only diverges well above the cardinalities we cache
+    if function == "dcount":
+        return set()
+    return 0 if function in ("count", "sum") else None
+
+
+def _summarize(tokens: list, rows: list, columns: list) -> tuple:
+    aggregate_tokens, by_tokens = split_by_clause(tokens)
+    aggregates = []
+    for segment in split_top_level(aggregate_tokens, ","):
+        if not segment:
+            continue
+        name, node = parse_assignment(segment)
+        if node[0] != "call" or node[1] not in SUPPORTED_AGGREGATES:
+            raise UnsupportedQueryError("Only count(), dcount(), sum(), min() and max() aggregates are supported locally")
+        if node[1] == "count" and node[2]:
+            raise UnsupportedQueryError("count() does not take arguments")
+        if node[1] != "count" and len(node[2]) != 1:
+            raise UnsupportedQueryError(f"{node[1]}() takes exactly one argument locally")
+        _check_columns(node, columns)
+        aggregates.append((name or _aggregate_name(node), node))
+
+    keys = []
+    for segment in split_top_level(by_tokens or [], ","):
+        if not segment:
+            continue
+        name, node = parse_assignment(segment)
+        if name is None and node[0] != "col":
+            raise UnsupportedQueryError("Computed group-by keys need an explicit name")
+        _check_columns(node, columns)
+        keys.append((name or node[1], node))
+
+    groups = {}
+    for row in rows:
+        key = tuple(evaluate_expression(node, row) for _, node in keys)
+        state = groups.get(key)
+        if state is None:
+            state = groups[key] = [_initial_state(node[1]) for _, node in aggregates]
+        for index, (_, node) in enumerate(aggregates):
+            function = node[1]
+            if function == "count":
+                state[index] += 1
+                continue
+            value = evaluate_expression(node[2][0], row)
+            if value is None:
+                continue
+            if function == "dcount":
+                state[index].add(value)
+            elif function == "sum":
+                if not _is_number(value):
+                    raise UnsupportedQueryError("sum() needs numeric values")
+                state[index] += value
+            elif function == "min":
+                state[index] = value if state[index] is None else min(state[index], value)
+            else:
+                state[index] = value if state[index] is None else max(state[index], value)
+
+    if not keys and not groups:
+        groups[()] = [_initial_state(node[1]) for _, node in aggregates]
+
+    output_columns = [name for name, _ in keys] + [name for name, _ in aggregates]
+    output = []
+    for key, state in groups.items():
+        values = list(key) + [len(v) if isinstance(v, set) else v for v in state]
+        output.append(dict(zip(output_columns, values)))
+    return output, output_columns
+
+
+def _sort_key(value):
+    if _is_number(value):
+        return (0, value)
+    return (1, _to_text(value))
+
+
+def _order(by_tokens: list, rows: list, columns: list) -> list:
+    if not by_tokens:
+        raise UnsupportedQueryError("Sorting requires a 'by' clause")
+    rows = list(rows)
+    specs = []
+    for segment in split_top_level(by_tokens, ","):
+        modifiers = []
+        while len(segment) > 1 and segment[-1].kind == "ident" and segment[-1].value.lower() in ("asc", "desc", "nulls", "first", "last"):
+            modifiers.append(segment[-1].value.lower())
+            segment = segment[:-1]
+        direction = "asc" if "asc" in modifiers else "desc"
+        nulls = "first" if "first" in modifiers else "last" if "last" in modifiers else None
+        node = parse_expression(segment)
+        _check_columns(node, columns)
+        specs.append((node, direction, nulls or ("first" if direction == "asc" else "last")))
+
+    for node, direction, nulls in reversed(specs):
+        present = [r for r in rows if evaluate_expression(node, r) is not None]
+        missing = [r for r in rows if evaluate_expression(node, r) is None]
+        present.sort(key=lambda r: _sort_key(evaluate_expression(node, r)), reverse=direction == "desc")
+        rows = missing + present if nulls == "first" else present + missing
+    return rows
+
+
+def _literal_count(tokens: list) -> int:
+    if len(tokens) != 1 or tokens[0].kind != "number" or not isinstance(tokens[0].value, int):
+        raise UnsupportedQueryError("Row limits must be integer literals")
+    return tokens[0].value
+
+
+def apply_operator(operator, rows: list, columns: list) -> tuple:
+    """
+    Apply a single pipeline operator to a list of rows.
+
+    Args:
+        operator (Operator): Parsed operator from kql_parser.parse_query
+        rows (list): Input rows as dicts
+        columns (list): Input column names, in order
+
+    Returns:
+        tuple: (output rows, output column names)
+    """
+    name, tokens = operator.name, operator.tokens
+    if name not in SUPPORTED_OPERATORS:
+        raise UnsupportedQueryError(f"Operator '{name}' is not supported locally")
+
+    if name == "where":
+        node = parse_expression(tokens)
+        _check_columns(node, columns)
+        return [row for row in rows if evaluate_expression(node, row) is True], columns
+
+    if name in ("project", "extend"):
+        assignments = []
+        for segment in split_top_level(tokens, ","):
+            assigned, node = parse_assignment(segment)
+            if assigned is None and (name == "extend" or node[0] != "col"):
+                raise UnsupportedQueryError(f"Computed {name} columns need an explicit name")
+            _check_columns(node, columns)
+            assignments.append((assigned or node[1], node))
+        if name == "project":
+            output_columns = [column for column, _ in assignments]
+            output = [{column: evaluate_expression(node, row) for column, node in assignments} for row in rows]
+            return output, output_columns
+        output_columns = list(columns) + [column for column, _ in assignments if column not in columns]
+        output = []
+        for row in rows:
+            extended = dict(row)
+            for column, node in assignments:
+                extended[column] = evaluate_expression(node, row)
+            output.append(extended)
+        return output, output_columns
+
+    if name == "summarize":
+        return _summarize(tokens, rows, columns)
+
+    if name == "order":
+        return _order(split_by_clause(tokens)[1], rows, columns), columns
+
+    if name == "take":
+        return rows[:_literal_count(tokens)], columns
+
+    if name == "top":
+        count_tokens, by_tokens = split_by_clause(tokens)
+        return _order(by_tokens, rows, columns)[:_literal_count(count_tokens)], columns
+
+    if name == "distinct":
+        names = []
+        for segment in split_top_level(tokens, ","):
+            node = parse_expression(segment)
+            if node[0] != "col":
+                raise UnsupportedQueryError("distinct only supports plain columns locally")
+            _check_columns(node, columns)
+            names.append(node[1])
+        seen = {}
+        for row in rows:
+            key = tuple(row[column] for column in names)
+            if key not in seen:
+                seen[key] = {column: row[column] for column in names}
+        return list(seen.values()), names
+
+    if tokens:
+        raise UnsupportedQueryError("count operator takes no arguments")
+    return [{"Count": len(rows)}], ["Count"]
+
+
+def evaluate_operators(operators: list, rows: list, columns: list = None, scalars: dict = None) -> list:
+    """
+    Evaluate a sequence of pipeline operators against in-memory rows.
+
+    Args:
+        operators (list): Parsed Operator tuples
+        rows (list): Input rows as dicts
+        columns (list, optional): Input column names. Inferred from the first row if omitted
+        scalars (dict, optional): Scalar let bindings to inline, from kql_parser.scalar_lets
+
+    Returns:
+        list: Output rows as dicts
+
+    Raises:
+        UnsupportedQueryError: If any operator or expression is outside the supported subset
+    """
+    if columns is None:
+        columns = list(rows[0].keys()) if rows else []
+    for operator in operators:
+        if scalars:
+            operator = operator._replace(tokens=substitute_lets(operator.tokens, scalars))
+        try:
+            rows, columns = apply_operator(operator, rows, columns)
+        except (TypeError, ValueError) as e:
+            # Mixed-type values the cluster would coerce, e.g. min() over numbers and strings
+            raise UnsupportedQueryError(f"Cannot evaluate '{operator.name}' locally: {e}")
+    return rows
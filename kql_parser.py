@@ -0,0 +1,444 @@
+import re
+from collections import namedtuple
+
+# Operators whose names contain a hyphen; the tokenizer keeps them as a single identifier
+HYPHENATED_KEYWORDS = {
+    "mv-expand", "mv-apply", "project-away", "project-keep", "project-rename",
+    "project-reorder", "make-series", "top-nested", "top-hitters",
+}
+
+# Aliases accepted by KQL for the same tabular operator
+OPERATOR_ALIASES = {
+    "filter": "where",
+    "sort": "order",
+    "limit": "take",
+}
+
+STRING_OPERATORS = {
+    "contains", "!contains", "contains_cs", "!contains_cs",
+    "has", "!has", "has_cs", "!has_cs",
+    "startswith", "!startswith", "endswith", "!endswith",
+    "in", "!in", "in~", "!in~",
+}
+
+COMPARISON_OPERATORS = {"==", "!=", "=~", "!~", "<", ">", "<=", ">="}
+
+Token = namedtuple("Token", ["kind", "value", "start", "end"])
+Operator = namedtuple("Operator", ["name", "tokens", "text"])
+Query = namedtuple("Query", ["lets", "source", "operators", "text"])
+
+_NUMBER_PATTERN = re.compile(r"\d+(\.\d+)?([eE][+-]?\d+)?")
+_IDENT_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_SYMBOLS = ["==", "!=", "=~", "!~", "<=", ">=", "<", ">", "=", "+", "-", "*", "/", "%",
+            "|", "(", ")", "[", "]", "{", "}", ",", ";", ".", ":"]
+
+
+class KqlSyntaxError(ValueError):
+    """Raised when a query cannot be tokenized or parsed."""
+
+
+def tokenize(query: str) -> list:
+    """
+    Split a KQL query into tokens, dropping whitespace and comments.
+
+    Args:
+        query (str): KQL query text
+
+    Returns:
+        list: Token tuples of (kind, value, start, end). Kinds are 'string',
+        'number', 'timespan', 'ident' and 'symbol'. String values are unquoted.
+    """
+    tokens = []
+    i = 0
+    length = len(query)
+    while i < length:
+        char = query[i]
+        if char.isspace():
+            i += 1
+            continue
+        if query.startswith("//", i):
+            newline = query.find("\n", i)
+            i = length if newline == -1 else newline
+            continue
+        if char in "'\"" or (char == "@" and i + 1 < length and query[i + 1] in "'\""):
+            start = i
+            verbatim = char == "@"
+            if verbatim:
+                i += 1
+            quote = query[i]
+            i += 1
+            chars = []
+            while True:
+                if i >= length:
+                    raise KqlSyntaxError(f"Unterminated string literal at position {start}")
+                current = query[i]
+                if not verbatim and current == "\\" and i + 1 < length:
+                    chars.append({"n": "\n", "t": "\t", "r": "\r"}.get(query[i + 1], query[i + 1]))
+                    i += 2
+                    continue
+                if current == quote:
+                    i += 1
+                    break
+                chars.append(current)
+                i += 1
+            tokens.append(Token("string", "".join(chars), start, i))
+            continue
+        if char.isdigit():
+            match = _NUMBER_PATTERN.match(query, i)
+            end = match.end()
+            unit = _IDENT_PATTERN.match(query, end)
+            if unit:
+                tokens.append(Token("timespan", query[i:unit.end()], i, unit.end()))
+                i = unit.end()
+            else:
+                text = match.group(0)
+                value = float(text) if any(c in text for c in ".eE") else int(text)
+                tokens.append(Token("number", value, i, end))
+                i = end
+            continue
+        if char == "!" and i + 1 < length and query[i + 1].isalpha():
+            match = _IDENT_PATTERN.match(query, i + 1)
+            end = match.end()
+            if end < length and query[end] == "~":
+                end += 1
+            tokens.append(Token("ident", query[i:end], i, end))
+            i = end
+            continue
+        if char.isalpha() or char == "_":
+            match = _IDENT_PATTERN.match(query, i)
+            end = match.end()
+            value = match.group(0)
+            if end < length and query[end] == "-":
+                hyphenated = _IDENT_PATTERN.match(query, end + 1)
+                if hyphenated and f"{value}-{hyphenated.group(0)}".lower() in HYPHENATED_KEYWORDS:
+                    end = hyphenated.end()
+                    value = query[i:end]
+            if value == "in" and end < length and query[end] == "~":
+                end += 1
+                value = "in~"
+            tokens.append(Token("ident", value, i, end))
+            i = end
+            continue
+        for symbol in _SYMBOLS:
+            if query.startswith(symbol, i):
+                tokens.append(Token("symbol", symbol, i, i + len(symbol)))
+                i += len(symbol)
+                break
+        else:
+            raise KqlSyntaxError(f"Unexpected character {char!r} at position {i}")
+    return tokens
+
+
+def split_top_level(tokens: list, separator: str) -> list:
+    """
+    Split a token list on a separator symbol that is not nested in brackets.
+
+    Args:
+        tokens (list): Tokens to split
+        separator (str): Symbol to split on, e.g. '|' or ';'
+
+    Returns:
+        list: Token lists between separators (empty segments are kept)
+    """
+    segments = [[]]
+    depth = 0
+    for token in tokens:
+        if token.kind == "symbol":
+            if token.value in "([{":
+                depth += 1
+            elif token.value in ")]}":
+                depth -= 1
+                if depth < 0:
+                    raise KqlSyntaxError(f"Unbalanced '{token.value}' at position {token.start}")
+            elif token.value == separator and depth == 0:
+                segments.append([])
+                continue
+        segments[-1].append(token)
+    if depth != 0:
+        raise KqlSyntaxError("Unbalanced brackets in query")
+    return segments
+
+
+def parse_query(query: str) -> Query:
+    """
+    Parse a KQL query into let statements, a source expression and pipeline operators.
+
+    Args:
+        query (str): KQL query text
+
+    Returns:
+        Query: Named tuple with lets (list of (name, tokens)), source (tokens),
+        operators (list of Operator) and the original text
+    """
+    tokens = tokenize(query)
+    statements = [s for s in split_top_level(tokens, ";") if s]
+    if not statements:
+        raise KqlSyntaxError("Query is empty")
+
+    lets = []
+    for statement in statements[:-1]:
+        if statement[0].kind != "ident" or statement[0].value != "let":
+            raise KqlSyntaxError(f"Expected a let statement at position {statement[0].start}")
+        if len(statement) < 4 or statement[1].kind != "ident" or statement[2].value != "=":
+            raise KqlSyntaxError(f"Malformed let statement at position {statement[0].start}")
+        lets.append((statement[1].value, statement[3:]))
+
+    segments = split_top_level(statements[-1], "|")
+    source = segments[0]
+    if not source:
+        raise KqlSyntaxError("Query has no source table")
+
+    operators = []
+    for segment in segments[1:]:
+        if not segment or segment[0].kind != "ident":
+            raise KqlSyntaxError("Expected an operator name after '|'")
+        name = segment[0].value.lower()
+        name = OPERATOR_ALIASES.get(name, name)
+        text = query[segment[0].start:segment[-1].end]
+        operators.append(Operator(name, segment[1:], text))
+    return Query(lets, source, operators, query)
+
+
+def scalar_lets(query: Query) -> dict:
+    """
+    Collect let statements that bind a single literal value.
+
+    Args:
+        query (Query): Parsed query
+
+    Returns:
+        dict: Mapping of let name to its literal Token
+    """
+    return {
+        name: value[0]
+        for name, value in query.lets
+        if len(value) == 1 and value[0].kind in ("string", "number")
+    }
+
+
+def substitute_lets(tokens: list, scalars: dict) -> list:
+    """
+    Replace identifiers bound by scalar let statements with their literal tokens.
+
+    Args:
+        tokens (list): Tokens to rewrite
+        scalars (dict): Output of scalar_lets
+
+    Returns:
+        list: Tokens with let references inlined
+    """
+    return [
+        scalars[t.value]._replace(start=t.start, end=t.end) if t.kind == "ident" and t.value in scalars else t
+        for t in tokens
+    ]
+
+
+def token_signature(tokens: list) -> tuple:
+    """
+    Build a comparable signature of a token list that ignores whitespace and positions.
+
+    Keywords are compared case-insensitively; string literals keep their case.
+    """
+    return tuple(
+        (t.kind, t.value.lower() if t.kind == "ident" and t.value.lower() in _KEYWORDS else t.value)
+        for t in tokens
+    )
+
+
+_KEYWORDS = STRING_OPERATORS | {
+    "and", "or", "by", "asc", "desc", "nulls", "first", "last", "on", "kind", "with",
+    "where", "project", "extend", "summarize", "order", "sort", "take", "limit", "top",
+    "distinct", "count", "join", "union", "let", "between", "true", "false",
+}
+
+
+class _ExpressionParser:
+    """Recursive descent parser for scalar KQL expressions."""
+
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self, offset: int = 0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise KqlSyntaxError("Unexpected end of expression")
+        self.position += 1
+        return token
+
+    def accept(self, value: str) -> bool:
+        token = self.peek()
+        if token is not None and token.kind in ("symbol", "ident") and token.value.lower() == value:
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, value: str):
+        if not self.accept(value):
+            token = self.peek()
+            where = f"at position {token.start}" if token else "at end of expression"
+            raise KqlSyntaxError(f"Expected '{value}' {where}")
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise KqlSyntaxError(f"Unexpected token {self.peek().value!r} at position {self.peek().start}")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.accept("or"):
+            node = ("binop", "or", node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_comparison()
+        while self.accept("and"):
+            node = ("binop", "and", node, self.parse_comparison())
+        return node
+
+    def parse_comparison(self):
+        node = self.parse_additive()
+        token = self.peek()
+        if token is None:
+            return node
+        value = token.value.lower() if token.kind == "ident" else token.value
+        if token.kind == "symbol" and value in COMPARISON_OPERATORS:
+            self.next()
+            return ("binop", value, node, self.parse_additive())
+        if token.kind == "ident" and value in STRING_OPERATORS:
+            self.next()
+            if value in ("in", "!in", "in~", "!in~"):
+                self.expect("(")
+                items = self.parse_arguments()
+                return ("in", value, node, items)
+            return ("binop", value, node, self.parse_additive())
+        return node
+
+    def parse_additive(self):
+        node = self.parse_multiplicative()
+        while self.peek() is not None and self.peek().kind == "symbol" and self.peek().value in ("+", "-"):
+            operator = self.next().value
+            node = ("binop", operator, node, self.parse_multiplicative())
+        return node
+
+    def parse_multiplicative(self):
+        node = self.parse_unary()
+        while self.peek() is not None and self.peek().kind == "symbol" and self.peek().value in ("*", "/", "%"):
+            operator = self.next().value
+            node = ("binop", operator, node, self.parse_unary())
+        return node
+
+    def parse_unary(self):
+        if self.peek() is not None and self.peek().kind == "symbol" and self.peek().value == "-":
+            self.next()
+            return ("neg", self.parse_unary())
+        return self.parse_postfix()
+
+    def parse_postfix(self):
+        node = self.parse_primary()
+        while self.peek() is not None and self.peek().kind == "symbol":
+            if self.accept("."):
+                member = self.next()
+                if member.kind != "ident":
+                    raise KqlSyntaxError(f"Expected member name at position {member.start}")
+                node = ("member", node, member.value)
+            elif self.accept("["):
+                key = self.parse_or()
+                self.expect("]")
+                node = ("index", node, key)
+            else:
+                break
+        return node
+
+    def parse_primary(self):
+        token = self.next()
+        if token.kind in ("string", "number"):
+            return ("lit", token.value)
+        if token.kind == "timespan":
+            return ("timespan", token.value)
+        if token.kind == "symbol" and token.value == "(":
+            node = self.parse_or()
+            self.expect(")")
+            return node
+        if token.kind == "ident":
+            lowered = token.value.lower()
+            if lowered in ("true", "false"):
+                return ("lit", lowered == "true")
+            if self.accept("("):
+                return ("call", lowered, self.parse_arguments())
+            return ("col", token.value)
+        raise KqlSyntaxError(f"Unexpected token {token.value!r} at position {token.start}")
+
+    def parse_arguments(self) -> list:
+        arguments = []
+        if self.accept(")"):
+            return arguments
+        while True:
+            arguments.append(self.parse_or())
+            if self.accept(")"):
+                return arguments
+            self.expect(",")
+
+
+def parse_expression(tokens: list):
+    """
+    Parse a scalar expression into a tuple-based syntax tree.
+
+    Nodes are ('lit', value), ('col', name), ('call', name, args),
+    ('binop', op, left, right), ('in', op, expr, items), ('neg', expr),
+    ('member', expr, name), ('index', expr, key) and ('timespan', text).
+    """
+    if not tokens:
+        raise KqlSyntaxError("Expression is empty")
+    return _ExpressionParser(tokens).parse()
+
+
+def parse_assignment(tokens: list) -> tuple:
+    """
+    Parse an optionally named expression such as `Region = tolower(regions)`.
+
+    Returns:
+        tuple: (name or None, expression tree)
+    """
+    if len(tokens) > 2 and tokens[0].kind == "ident" and tokens[1].kind == "symbol" and tokens[1].value == "=":
+        return tokens[0].value, parse_expression(tokens[2:])
+    return None, parse_expression(tokens)
+
+
+def split_by_clause(tokens: list) -> tuple:
+    """
+    Split operator arguments on the first top-level `by` keyword.
+
+    Returns:
+        tuple: (tokens before `by`, tokens after `by` or None when absent)
+    """
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token.kind == "symbol" and token.value in "([{":
+            depth += 1
+        elif token.kind == "symbol" and token.value in ")]}":
+            depth -= 1
+        elif depth == 0 and token.kind == "ident" and token.value.lower() == "by":
+            return tokens[:index], tokens[index + 1:]
+    return tokens, None
+
+
+def referenced_columns(node) -> set:
+    """
+    Collect column names referenced by an expression tree.
+    """
+    if node[0] == "col":
+        return {node[1]}
+    columns = set()
+    for child in node[1:]:
+        if isinstance(child, tuple):
+            columns |= referenced_columns(child)
+        elif isinstance(child, list):
+            for item in child:
+                columns |= referenced_columns(item)
+    return columns
@@ -0,0 +1,507 @@
+import difflib
+import json
+import logging
+import os
+import re
+from collections import namedtuple
+from kql_parser import (
+    KqlSyntaxError, OPERATOR_ALIASES, tokenize, split_top_level, parse_query, parse_expression,
+    referenced_columns, scalar_lets, split_by_clause,
+)
+from kql_evaluator import UnsupportedQueryError, evaluate_expression, evaluate_operators
+from tenant_cube import CUBE_SOURCE
+from request_logging import log_detail, truncated
+
+KQL_REWRITER_ENABLED = os.environ.get("KQL_REWRITER_ENABLED", "true").lower() not in ("0", "false", "no", "off")
+
+# Functions whose output is small enough to cache with materialize() and to broadcast in a join
+SMALL_SOURCES = {"GetQuarantinedServicesList", "GetRegionalAppsVersion", "GetSDPRegions"}
+
+# Join kinds where a filter on left-side columns gives the same rows before or after the join.
+# The default kind (innerunique) deduplicates the left side first, so it is not included.
+PUSHDOWN_JOIN_KINDS = {"inner", "leftouter", "leftsemi", "leftanti"}
+
+# Substring operators and their term-indexed equivalents
+TERM_OPERATORS = {
+    "contains": "has",
+    "!contains": "!has",
+    "contains_cs": "has_cs",
+    "!contains_cs": "!has_cs",
+}
+
+# Operators that keep the columns of their input
+_COLUMN_PRESERVING = {"where", "order", "take", "top", "sample"}
+
+# Functions whose value depends on neighbouring rows, so filters using them cannot move
+_ROW_ORDER_FUNCTIONS = {"row_number", "prev", "next", "row_cumsum", "row_rank_dense", "row_rank_min"}
+
+# Largest vocabulary turned into a join key lookup table
+MAX_KEY_VALUES = 256
+
+_MATERIALIZED_PREFIX = "_materialized_"
+_SINGLE_TERM = re.compile(r"[A-Za-z0-9]{3,}")
+_RENAMED_DUPLICATE = re.compile(r"(.+?)\d+")
+
+# unchecked lists the applied rules whose equivalence check could not run locally
+RewriteResult = namedtuple("RewriteResult", ["query", "applied", "unchecked"])
+
+
+def _operator_name(segment: list) -> str:
+    name = segment[0].value.lower()
+    return OPERATOR_ALIASES.get(name, name)
+
+
+def _pipeline(query: str) -> tuple:
+    """
+    Split the final statement of a query into its pipeline segments.
+
+    Returns:
+        tuple: (text before the final statement, list of segment token lists)
+    """
+    tokens = tokenize(query)
+    statements = [statement for statement in split_top_level(tokens, ";") if statement]
+    if not statements:
+        raise KqlSyntaxError("Query is empty")
+    last = statements[-1]
+    return query[:last[0].start], split_top_level(last, "|")
+
+
+def _segment_text(query: str, segment: list) -> str:
+    return query[segment[0].start:segment[-1].end]
+
+
+def _source_name(segment: list) -> str:
+    return segment[0].value if segment and segment[0].kind == "ident" else None
+
+
+def _is_small_source(name: str) -> bool:
+    if name and name.startswith(_MATERIALIZED_PREFIX):
+        name = name[len(_MATERIALIZED_PREFIX):]
+    return name in SMALL_SOURCES
+
+
+def _apply_edits(query: str, edits: list) -> str:
+    # Edits are (start, end, replacement) on the original text; apply from the end so offsets stay valid
+    for start, end, replacement in sorted(edits, reverse=True):
+        query = query[:start] + replacement + query[end:]
+    return query
+
+
+def _output_columns(tokens: list) -> set:
+    """
+    Columns produced by a sub-pipeline, or None when they cannot be known without the schema.
+    """
+    segments = split_top_level(tokens, "|")
+    for segment in reversed(segments[1:]):
+        if not segment:
+            return None
+        name = _operator_name(segment)
+        if name in _COLUMN_PRESERVING:
+            continue
+        if name in ("project", "distinct"):
+            columns = set()
+            for part in split_top_level(segment[1:], ","):
+                if len(part) == 1 and part[0].kind == "ident":
+                    columns.add(part[0].value)
+                elif len(part) > 2 and part[0].kind == "ident" and part[1].value == "=":
+                    columns.add(part[0].value)
+                else:
+                    return None
+            return columns
+        if name == "summarize":
+            aggregate_tokens, by_tokens = split_by_clause(segment[1:])
+            columns = set()
+            for part in split_top_level(aggregate_tokens, ",") + split_top_level(by_tokens or [], ","):
+                if not part:
+                    continue
+                if len(part) == 1 and part[0].kind == "ident":
+                    columns.add(part[0].value)
+                elif len(part) > 2 and part[0].kind == "ident" and part[1].value == "=":
+                    columns.add(part[0].value)
+                elif [t.value for t in part] == ["count", "(", ")"]:
+                    columns.add("count_")
+                else:
+                    return None
+            return columns
+        return None
+    return None
+
+
+def _parse_join(segment: list) -> dict:
+    """
+    Read the kind, hints, right side and keys of a join segment.
+
+    Returns:
+        dict: kind, hinted, options_end (offset after kind/hints), right (tokens or None) and keys,
+            or None when the join has an unexpected form
+    """
+    tokens = segment[1:]
+    index = 0
+    kind, hinted, options_end = "innerunique", False, segment[0].end
+    while index < len(tokens) and tokens[index].kind == "ident":
+        word = tokens[index].value.lower()
+        if word == "kind" and index + 2 < len(tokens) and tokens[index + 1].value == "=":
+            kind = tokens[index + 2].value.lower()
+            options_end = tokens[index + 2].end
+            index += 3
+        elif word == "hint" and index + 4 < len(tokens) and tokens[index + 1].value == ".":
+            hinted = True
+            options_end = tokens[index + 4].end
+            index += 5
+        else:
+            break
+    if index >= len(tokens):
+        return None
+
+    right = None
+    if tokens[index].kind == "symbol" and tokens[index].value == "(":
+        depth = 0
+        for close in range(index, len(tokens)):
+            if tokens[close].kind == "symbol" and tokens[close].value in "([{":
+                depth += 1
+            elif tokens[close].kind == "symbol" and tokens[close].value in ")]}":
+                depth -= 1
+                if depth == 0:
+                    break
+        right = tokens[index + 1:close]
+        index = close + 1
+    else:
+        index += 1
+
+    keys = set()
+    on_tokens = tokens[index + 1:] if index < len(tokens) and tokens[index].value.lower() == "on" else []
+    if on_tokens and all(t.kind == "ident" or t.value == "," for t in on_tokens):
+        keys = {t.value for t in on_tokens if t.kind == "ident"}
+    return {"kind": kind, "hinted": hinted, "options_end": options_end, "right": right, "keys": keys}
+
+
+def _assigned_columns(segment: list) -> set:
+    """
+    Columns assigned by an extend segment, or None if any assignment is unnamed.
+    """
+    columns = set()
+    for part in split_top_level(segment[1:], ","):
+        if len(part) > 2 and part[0].kind == "ident" and part[1].value == "=":
+            columns.add(part[0].value)
+        else:
+            return None
+    return columns
+
+
+def _can_move_before(where: list, previous: list) -> bool:
+    if any(t.kind == "ident" and t.value.lower() in _ROW_ORDER_FUNCTIONS for t in where):
+        return False
+    try:
+        columns = referenced_columns(parse_expression(where[1:]))
+    except KqlSyntaxError:
+        return False
+
+    name = _operator_name(previous)
+    if name == "extend":
+        assigned = _assigned_columns(previous)
+        return assigned is not None and not columns & assigned
+    if name == "join":
+        join = _parse_join(previous)
+        if join is None or join["kind"] not in PUSHDOWN_JOIN_KINDS or join["right"] is None:
+            return False
+        right_columns = _output_columns(join["right"])
+        if right_columns is None:
+            return False
+        if columns & (right_columns - join["keys"]):
+            return False
+        # Right-side columns that clash with left-side names come back as name1, name2, ...
+        for column in columns:
+            match = _RENAMED_DUPLICATE.fullmatch(column)
+            if match and match.group(1) in right_columns:
+                return False
+        return True
+    return False
+
+
+def push_predicates_down(query: str, **_) -> str:
+    """
+    Move `where` filters ahead of extends and joins that cannot affect them, so fewer rows
+    are extended and joined.
+    """
+    prefix, segments = _pipeline(query)
+    # Keep comments that trail a segment by cutting at the next pipe rather than the last token
+    ends = [query.rfind("|", segment[-1].end, following[0].start) for segment, following in zip(segments, segments[1:])]
+    stages = [query[segment[0].start:end].rstrip() for segment, end in zip(segments, ends)]
+    stages.append(_segment_text(query, segments[-1]))
+    moved = False
+    for index in range(1, len(segments)):
+        if not segments[index] or _operator_name(segments[index]) != "where":
+            continue
+        position = index
+        while position > 1 and _can_move_before(segments[position], segments[position - 1]):
+            segments[position - 1], segments[position] = segments[position], segments[position - 1]
+            stages[position - 1], stages[position] = stages[position], stages[position - 1]
+            position -= 1
+            moved = True
+    return prefix + "\n| ".join(stages) if moved else None
+
+
+def materialize_repeated_sources(query: str, **_) -> str:
+    """
+    Evaluate small functions that are referenced more than once a single time with materialize().
+    """
+    tokens = tokenize(query)
+    occurrences, with_arguments = {}, set()
+    for index, token in enumerate(tokens):
+        if token.kind != "ident" or token.value not in SMALL_SOURCES:
+            continue
+        previous = tokens[index - 1].value if index > 0 else None
+        if previous == "." or (index > 1 and previous == "(" and tokens[index - 2].value == "materialize"):
+            return None
+        end = token.end
+        if index + 1 < len(tokens) and tokens[index + 1].value == "(":
+            if index + 2 >= len(tokens) or tokens[index + 2].value != ")":
+                # Calls with arguments may differ from each other and are left as written
+                with_arguments.add(token.value)
+                continue
+            end = tokens[index + 2].end
+        occurrences.setdefault(token.value, []).append((token.start, end))
+
+    lets, edits = [], []
+    for name, spans in sorted(occurrences.items()):
+        if len(spans) < 2 or name in with_arguments:
+            continue
+        alias = f"{_MATERIALIZED_PREFIX}{name}"
+        if any(t.kind == "ident" and t.value == alias for t in tokens):
+            continue
+        lets.append(f"let {alias} = materialize({name}());\n")
+        edits += [(start, end, alias) for start, end in spans]
+    if not edits:
+        return None
+    return "".join(lets) + _apply_edits(query, edits)
+
+
+def use_term_operators(query: str, vocabulary: dict = None, **_) -> str:
+    """
+    Replace contains with the term-indexed has when both give the same answer for every
+    known value of the column.
+
+    vocabulary maps a source function to {column: known values}; only filters that run
+    directly on that source, before any operator other than where/extend, are rewritten.
+    """
+    if not vocabulary:
+        return None
+    _, segments = _pipeline(query)
+    columns = vocabulary.get(_source_name(segments[0]))
+    if not columns:
+        return None
+
+    edits, assigned = [], set()
+    for segment in segments[1:]:
+        name = _operator_name(segment)
+        if name == "extend":
+            names = _assigned_columns(segment)
+            if names is None:
+                break
+            assigned |= names
+            continue
+        if name != "where":
+            break
+        for index in range(1, len(segment) - 1):
+            operator, column, literal = segment[index], segment[index - 1], segment[index + 1]
+            replacement = TERM_OPERATORS.get(operator.value.lower()) if operator.kind == "ident" else None
+            if replacement is None or literal.kind != "string" or not _SINGLE_TERM.fullmatch(literal.value):
+                continue
+            if column.kind != "ident" or column.value not in columns or column.value in assigned:
+                continue
+            if index > 1 and segment[index - 2].value == ".":
+                continue
+            original_node = ("binop", operator.value.lower(), ("col", column.value), ("lit", literal.value))
+            term_node = ("binop", replacement, ("col", column.value), ("lit", literal.value))
+            if all(
+                evaluate_expression(original_node, {column.value: value}) == evaluate_expression(term_node, {column.value: value})
+                for value in columns[column.value]
+            ):
+                edits.append((operator.start, operator.end, replacement))
+    return _apply_edits(query, edits) if edits else None
+
+
+def map_join_keys(query: str, vocabulary: dict = None, **_) -> str:
+    """
+    Replace a join key computed from one column on every row, e.g.
+    `extend Region = tolower(replace_string(regions, " ", ""))` before `join ... on Region`,
+    with a lookup of the key computed locally for every known value of the column.
+
+    Like use_term_operators, this relies on vocabulary holding every value of the column.
+    """
+    if not vocabulary:
+        return None
+    _, segments = _pipeline(query)
+    columns = vocabulary.get(_source_name(segments[0]))
+    if not columns:
+        return None
+
+    edits, assigned = [], set()
+    for segment, following in zip(segments[1:], segments[2:]):
+        name = _operator_name(segment)
+        if name == "where":
+            continue
+        if name != "extend":
+            break
+        names = _assigned_columns(segment)
+        if names is None:
+            break
+        parts = split_top_level(segment[1:], ",")
+        join = _parse_join(following) if following and _operator_name(following) == "join" else None
+        if len(parts) == 1 and join is not None and join["right"] is not None and join["keys"] == names:
+            key = parts[0][0].value
+            node = parse_expression(parts[0][2:])
+            referenced = referenced_columns(node)
+            column = next(iter(referenced)) if len(referenced) == 1 else None
+            values = columns.get(column) or []
+            if (
+                node[0] == "call" and column not in assigned and key not in columns
+                and 0 < len(values) <= MAX_KEY_VALUES and all(isinstance(value, str) for value in values)
+            ):
+                keys = [evaluate_expression(node, {column: value}) for value in values]
+                if all(isinstance(value, str) for value in keys):
+                    pairs = ", ".join(f"{json.dumps(value, ensure_ascii=False)}, {json.dumps(mapped, ensure_ascii=False)}" for value, mapped in zip(values, keys))
+                    lookup = f"lookup kind=leftouter (datatable({column}:string, {key}:string)[{pairs}]) on {column}"
+                    edits.append((segment[0].start, segment[-1].end, lookup))
+        assigned |= names
+    return _apply_edits(query, edits) if edits else None
+
+
+def add_join_hints(query: str, **_) -> str:
+    """
+    Ask for a broadcast join when a small function is joined to a larger table.
+    """
+    _, segments = _pipeline(query)
+    if not _is_small_source(_source_name(segments[0])):
+        return None
+    edits = []
+    for segment in segments[1:]:
+        if _operator_name(segment) != "join":
+            continue
+        join = _parse_join(segment)
+        if join is None or join["hinted"] or not join["right"]:
+            continue
+        if _is_small_source(_source_name(join["right"])):
+            continue
+        edits.append((join["options_end"], join["options_end"], " hint.strategy=broadcast"))
+    return _apply_edits(query, edits) if edits else None
+
+
+REWRITE_RULES = [
+    ("push_predicates_down", push_predicates_down),
+    ("use_term_operators", use_term_operators),
+    ("map_join_keys", map_join_keys),
+    ("materialize_repeated_sources", materialize_repeated_sources),
+    ("add_join_hints", add_join_hints),
+]
+
+
+def _row_multiset(rows: list) -> list:
+    return sorted(json.dumps(row, sort_keys=True, default=str) for row in rows)
+
+
+def check_equivalence(original: str, rewritten: str, sample_rows: dict = None) -> bool:
+    """
+    Check a rewrite locally.
+
+    The rewritten query must parse. When sample rows exist for its source and the local
+    evaluator supports every operator, both queries are run and must return the same rows.
+
+    Args:
+        original (str): Query before the rewrite
+        rewritten (str): Query after the rewrite
+        sample_rows (dict, optional): Mapping of source function to sample rows
+
+    Returns:
+        bool: False if the rewrite is proven wrong, True if proven equal, None if it could not be run
+    """
+    try:
+        before, after = parse_query(original), parse_query(rewritten)
+    except KqlSyntaxError:
+        return False
+    source = _source_name(before.source)
+    if not sample_rows or source not in sample_rows or len(before.source) > 3 or [t.value for t in before.source] != [t.value for t in after.source]:
+        return None
+    rows = sample_rows[source]
+    try:
+        expected = evaluate_operators(before.operators, rows, scalars=scalar_lets(before))
+        actual = evaluate_operators(after.operators, rows, scalars=scalar_lets(after))
+    except (KqlSyntaxError, UnsupportedQueryError):
+        return None
+    return _row_multiset(expected) == _row_multiset(actual)
+
+
+class _RewriteDiff:
+    """
+    Log argument for an applied rewrite; the unified diff is only built when the record is emitted.
+    """
+
+    __slots__ = ("before", "after", "name")
+
+    def __init__(self, before: str, after: str, name: str):
+        self.before = before
+        self.after = after
+        self.name = name
+
+    def __str__(self) -> str:
+        return "\n".join(difflib.unified_diff(self.before.splitlines(), self.after.splitlines(), "generated", self.name, lineterm=""))
+
+
+def rewrite_query(query: str, vocabulary: dict = None, sample_rows: dict = None) -> RewriteResult:
+    """
+    Apply semantics-preserving performance rewrites to a generated query.
+
+    Each rule is applied in turn; a rule's output is dropped if the equivalence check
+    proves it changes the results. Rewrites the check could not run on, e.g. because the
+    sample rows lack a column or the evaluator lacks an operator, are applied and reported
+    as unchecked. Applied rewrites are logged as a diff.
+
+    Args:
+        query (str): Generated KQL query
+        vocabulary (dict, optional): Mapping of source function to {column: known values}
+        sample_rows (dict, optional): Mapping of source function to sample rows for the equivalence check
+
+    Returns:
+        RewriteResult: (rewritten query, names of the applied rules, names of those applied unchecked)
+    """
+    try:
+        parse_query(query)
+    except KqlSyntaxError as e:
+        logging.debug("Query was not rewritten, it could not be parsed: %s", e)
+        return RewriteResult(query, [], [])
+
+    current, applied, unchecked = query, [], []
+    for name, rule in REWRITE_RULES:
+        try:
+            candidate = rule(current, vocabulary=vocabulary)
+        except (KqlSyntaxError, UnsupportedQueryError) as e:
+            logging.debug("Rewrite %s skipped: %s", name, e)
+            continue
+        if candidate is None or candidate == current:
+            continue
+        equivalent = check_equivalence(current, candidate, sample_rows)
+        if equivalent is False:
+            logging.warning("Rewrite %s failed the equivalence check and was discarded", name)
+            continue
+        if equivalent is None:
+            unchecked.append(name)
+        log_detail(logging.INFO, "Applied KQL rewrite %s (%s):\n%s", name, "checked" if equivalent else "unchecked", truncated(_RewriteDiff(current, candidate, name)))
+        current = candidate
+        applied.append(name)
+    return RewriteResult(current, applied, unchecked)
+
+
+def optimize_query(query: str, cube=None) -> RewriteResult:
+    """
+    Rewrite a query for the cluster, using the tenant cube (when fresh) as the known
+    vocabulary and sample data for GetTenantVersions.
+    """
+    if not KQL_REWRITER_ENABLED:
+        return RewriteResult(query, [], [])
+    vocabulary = cube.vocabulary() if cube is not None else None
+    sample_rows = cube.sample_rows() if vocabulary else None
+    return rewrite_query(
+        query,
+        vocabulary={CUBE_SOURCE: vocabulary} if vocabulary else None,
+        sample_rows={CUBE_SOURCE: sample_rows} if sample_rows else None,
+    )
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+LLM_CACHE_BACKEND = os.environ.get("LLM_CACHE_BACKEND", "sqlite")
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(tempfile.gettempdir(), "apim_nl_kusto_llm_cache.sqlite"))
+LLM_CACHE_URL = os.environ.get("LLM_CACHE_URL")
+LLM_CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", 24 * 60 * 60))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+_KEY_PREFIX = "apim-nl-kusto:llm:"
+
+
+def completion_cache_key(deployment: str, messages: list, temperature: float, max_tokens: int, stop: list = None) -> str:
+    """
+    Hash everything that determines a chat completion into an exact-match cache key.
+    """
+    request = {"deployment": deployment, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+    if stop:
+        request["stop"] = list(stop)
+    payload = json.dumps(
+        request,
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SqliteCacheBackend:
+    """
+    Completion cache in a local SQLite file, shared by every worker process on the machine.
+    The default path is in the temp directory, so each instance has its own cache and
+    loses it when the instance is recycled; use the redis backend to share one across instances.
+
+    Entries expire after ttl_seconds and the least recently used entries are evicted
+    once the stored values exceed max_bytes.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl_seconds: float = LLM_CACHE_TTL_SECONDS, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS completions_created_at ON completions (created_at)")
+        # Running total of stored value sizes, kept in the file so every process sharing it sees the same figure
+        self._connection.execute("CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+        self._connection.execute("INSERT OR IGNORE INTO cache_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM completions")
+
+    def get(self, key: str) -> str:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM completions WHERE key = ? AND created_at > ?", (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def _delete(self, where: str, parameters: tuple) -> int:
+        """
+        Delete matching entries and return the bytes they held.
+        """
+        freed = self._connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM completions WHERE {where}", parameters).fetchone()[0]
+        if freed:
+            self._connection.execute(f"DELETE FROM completions WHERE {where}", parameters)
+        return freed
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                delta = size - self._delete("key = ?", (key,))
+                self._connection.execute(
+                    "INSERT INTO completions (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now),
+                )
+                delta -= self._delete("created_at <= ?", (now - self.ttl_seconds,))
+                self._connection.execute("UPDATE cache_size SET total = total + ? WHERE id = 0", (delta,))
+                total = self._connection.execute("SELECT total FROM cache_size WHERE id = 0").fetchone()[0]
+                if total > self.max_bytes:
+                    evicted = 0
+                    while total > self.max_bytes:
+                        oldest = self._connection.execute(
+                            "SELECT key, size FROM completions ORDER BY accessed_at ASC LIMIT 64"
+                        ).fetchall()
+                        if not oldest:
+                            break
+                        for old_key, old_size in oldest:
+                            if total <= self.max_bytes:
+                                break
+                            self._connection.execute("DELETE FROM completions WHERE key = ?", (old_key,))
+                            total -= old_size
+                            evicted += 1
+                    self._connection.execute("UPDATE cache_size SET total = ? WHERE id = 0", (total,))
+                    logging.info("Evicted %d LLM cache entries to stay under %d bytes", evicted, self.max_bytes)
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+
+class RedisCacheBackend:
+    """
+    Completion cache in a network key-value store (Redis protocol, e.g. Azure Cache for Redis).
+
+    Entries expire after ttl_seconds; size is bounded by the server's maxmemory
+    setting, which should use an LRU eviction policy such as allkeys-lru.
+    """
+
+    def __init__(self, url: str = LLM_CACHE_URL, ttl_seconds: float = LLM_CACHE_TTL_SECONDS):
+        import redis
+        self.ttl_seconds = ttl_seconds
+        self._client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+
+    def get(self, key: str) -> str:
+        value = self._client.get(_KEY_PREFIX + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str) -> None:
+        self._client.set(_KEY_PREFIX + key, value.encode("utf-8"), ex=int(self.ttl_seconds))
+
+
+class CompletionCache:
+    """
+    Fault-tolerant front for a cache backend: cache errors are logged and treated as misses.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, key: str) -> str:
+        if self.backend is None:
+            return None
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            logging.warning("LLM cache read failed: %s", e)
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            logging.warning("LLM cache write failed: %s", e)
+
+
+def create_completion_cache(backend: str = LLM_CACHE_BACKEND) -> CompletionCache:
+    """
+    Build the completion cache selected by LLM_CACHE_BACKEND ('sqlite', 'redis' or 'none').
+    """
+    try:
+        if backend == "sqlite":
+            return CompletionCache(SqliteCacheBackend())
+        if backend == "redis":
+            return CompletionCache(RedisCacheBackend())
+    except Exception as e:
+        logging.warning("LLM cache backend '%s' is unavailable, caching disabled: %s", backend, e)
+    return CompletionCache(None)
+
+
+completion_cache = create_completion_cache()
@@ -0,0 +1,120 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from traffic_capture import PUBLIC_ROUTES, load_capture
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def send_request(base_url: str, record: dict, function_key: str = None, timeout: float = 120) -> tuple:
+    """
+    Send one captured request to the HTTP route it arrived on, with its captured options.
+
+    Returns:
+        tuple: (HTTP status or 0 on connection failure, latency in milliseconds, response bytes)
+    """
+    route = record.get("public_route") or PUBLIC_ROUTES.get(record.get("route"), record.get("route", "kusto_nl_query"))
+    url = f"{base_url.rstrip('/')}/{route}"
+    if function_key:
+        url += "?" + urllib.parse.urlencode({"code": function_key})
+    body = json.dumps({**record.get("request_options", {}), "prompt": record["prompt"]}).encode("utf-8")
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = response.read()
+            return response.status, (time.monotonic() - started) * 1000, len(payload)
+    except urllib.error.HTTPError as e:
+        return e.code, (time.monotonic() - started) * 1000, len(e.read())
+    except (urllib.error.URLError, TimeoutError, ConnectionError):
+        return 0, (time.monotonic() - started) * 1000, 0
+
+
+def replay(records: list, sender, rate: float, concurrency: int, total_requests: int, seed: int = 0) -> dict:
+    """
+    Replay captured requests open-loop at a fixed arrival rate with bounded concurrency.
+
+    Args:
+        records (list): Captured request records, sampled uniformly to keep the recorded mix
+        sender (callable): Function taking a record and returning (status, latency_ms, bytes)
+        rate (float): Requests started per second
+        concurrency (int): Maximum requests in flight
+        total_requests (int): Number of requests to send
+        seed (int, optional): Random seed for the request order
+
+    Returns:
+        dict: Throughput, error rate and latency percentiles
+    """
+    sampler = random.Random(seed)
+    results = []
+    lock = threading.Lock()
+
+    def run(record):
+        outcome = sender(record)
+        with lock:
+            results.append(outcome)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index in range(total_requests):
+            delay = started + index / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, sampler.choice(records))
+    elapsed = time.monotonic() - started
+
+    latencies = [latency for status, latency, _ in results if 200 <= status < 300]
+    errors = sum(1 for status, _, _ in results if not 200 <= status < 300)
+    return {
+        "requests": len(results),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(errors / len(results), 4) if results else 0.0,
+        "status_counts": {str(s): sum(1 for r in results if r[0] == s) for s in sorted({r[0] for r in results})},
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 1),
+            "p90": round(percentile(latencies, 0.90), 1),
+            "p95": round(percentile(latencies, 0.95), 1),
+            "p99": round(percentile(latencies, 0.99), 1),
+            "max": round(max(latencies), 1) if latencies else 0.0,
+        },
+        "mean_response_bytes": round(sum(r[2] for r in results) / len(results)) if results else 0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured traffic against the Function app's HTTP routes.")
+    parser.add_argument("capture", nargs="+", help="capture files written with TRAFFIC_CAPTURE_PATH")
+    parser.add_argument("--url", default="http://localhost:7071", help="Function app base URL")
+    parser.add_argument("--code", default=None, help="function key, if the host requires one")
+    parser.add_argument("--rate", type=float, default=2.0, help="requests started per second")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum requests in flight")
+    parser.add_argument("--requests", type=int, default=100, help="number of requests to send")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the request order")
+    args = parser.parse_args()
+
+    captured = [r for r in load_capture(args.capture) if r.get("prompt")]
+    report = replay(
+        captured,
+        lambda record: send_request(args.url, record, args.code),
+        rate=args.rate,
+        concurrency=args.concurrency,
+        total_requests=args.requests,
+        seed=args.seed,
+    )
+    print(json.dumps(report, indent=2))
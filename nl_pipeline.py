@@ -0,0 +1,112 @@
+import logging
+from helper_functions import generate_kusto_query_from_nl, execute_kusto_query, summarize_kusto_results
+from query_planner import execute_query_plan
+from session_state import conversation_sessions, is_follow_up
+from tenant_cube import TenantCube
+from traffic_capture import capture_request
+from audit_sink import audit_request
+from response_shaping import shape_results
+from kql_rewriter import optimize_query
+from query_decomposer import plan_sub_questions, run_sub_questions, combine_results, combined_query_text
+from incremental_refresh import incremental_snapshots
+from request_logging import log_detail, truncated, row_summary
+from request_metrics import DeadlineExceededError, current_metrics
+
+# Every instance rebuilds its cube in the background when the timer's file is missing or stale
+tenant_cube = TenantCube(kusto_executor=execute_kusto_query)
+
+
+def run_nl_query(prompt: str, metrics, conversation_id: str = None, shaping_options: dict = None, summary_mode: str = "llm", incremental: bool = False, request_options: dict = None) -> dict:
+    """
+    Run the natural language to KQL pipeline: generate, execute, summarize and shape.
+
+    Shared by the synchronous HTTP route and the asynchronous job worker.
+
+    Args:
+        prompt (str): Natural language question
+        metrics (RequestMetrics): Metrics of the current request, used for stage timings
+        conversation_id (str, optional): Conversation used to answer follow-ups from cached results
+        shaping_options (dict, optional): Keyword arguments for response_shaping.shape_results
+        summary_mode (str, optional): "fast" to summarize recognized result shapes locally, "llm" to always use the LLM
+        incremental (bool, optional): Refresh GetTenantVersions answers from a per-tenant snapshot and report what changed
+        request_options (dict, optional): Parameters the caller sent, recorded by traffic capture for replay
+
+    Returns:
+        dict: Response body for the caller
+    """
+    kusto_query = results = nl_summarized_results = incremental_answer = None
+    try:
+        logging.info("Processing natural language prompt: %s", truncated(prompt))
+
+        session = conversation_sessions.get(conversation_id)
+
+        def execute_rewritten_query(query):
+            # Sessions and the cube match on the generated text; only the cluster sees the rewritten query
+            rewrite = optimize_query(query, cube=tenant_cube)
+            if rewrite.applied:
+                # Sub-questions record into their own metrics, merged after they finish
+                attributes = current_metrics().attributes
+                attributes.setdefault("rewrites", []).extend(rewrite.applied)
+                if rewrite.unchecked:
+                    attributes.setdefault("unchecked_rewrites", []).extend(rewrite.unchecked)
+            return execute_kusto_query(rewrite.query, generated_query=query)
+
+        # Follow-ups refine the previous query; new questions are decomposed even mid-conversation
+        sub_questions = [] if session and is_follow_up(prompt) else plan_sub_questions(prompt)
+        if sub_questions:
+            metrics.attributes["sub_questions"] = len(sub_questions)
+            with metrics.stage("decompose"):
+                sub_results = run_sub_questions(
+                    sub_questions,
+                    generate_kusto_query_from_nl,
+                    lambda query: execute_query_plan(query, execute_rewritten_query, cube=tenant_cube)
+                )
+            kusto_query = combined_query_text(sub_results)
+            results = combine_results(sub_results)
+            query_source = "+".join(sorted({sub_result.source for sub_result in sub_results}))
+        else:
+            with metrics.stage("generate"):
+                kusto_query = generate_kusto_query_from_nl(prompt, previous_query=session["query"] if session else None)
+
+            with metrics.stage("query"):
+                if incremental and not session:
+                    incremental_answer = incremental_snapshots.answer(kusto_query, execute_rewritten_query)
+                if incremental_answer is not None:
+                    results, query_source = incremental_answer.rows, "incremental"
+                else:
+                    results, query_source = execute_query_plan(kusto_query, execute_rewritten_query, session=session, cube=tenant_cube)
+        # Combined sub-question results become the session too, so follow-ups can refine them
+        conversation_sessions.put(conversation_id, kusto_query, results)
+        metrics.attributes["query_source"] = query_source
+
+        with metrics.stage("summarize"):
+            nl_summarized_results = summarize_kusto_results(kusto_query, results, mode=summary_mode)
+
+        # Results are logged as counts; queries and summaries only for sampled requests
+        log_detail(logging.INFO, "Generated Kusto query: %s", truncated(kusto_query))
+        logging.info("Query results: %s", row_summary(results))
+        log_detail(logging.INFO, "Summarized results: %s", truncated(nl_summarized_results))
+
+        shaped_results, shape_info = shape_results(results, **(shaping_options or {}))
+    except Exception as e:
+        metrics.attributes["error"] = str(e)
+        # Same status the route returns to the caller
+        status = 504 if isinstance(e, DeadlineExceededError) else 500
+        capture_request(metrics, prompt, kusto_query, results, nl_summarized_results, status=status, request_options=request_options)
+        audit_request(metrics, prompt, kusto_query, results, status=status)
+        raise
+
+    capture_request(metrics, prompt, kusto_query, results, nl_summarized_results, request_options=request_options)
+    audit_request(metrics, prompt, kusto_query, results)
+    response = {
+        "prompt": prompt,
+        "generated_query": kusto_query,
+        "results": shaped_results,
+        "summarized_results": nl_summarized_results,
+        "query_source": query_source,
+        **shape_info,
+        "status": "success"
+    }
+    if incremental_answer is not None:
+        response["changes_since_last_check"] = incremental_answer.delta
+    return response
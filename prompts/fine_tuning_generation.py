@@ -1,34 +1,240 @@
+import argparse
 import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import system_prompts
 import prompts_dict
 
-def generate_jsonl(data, output_file):
-    """
-    Generates a JSONL file from a list of dictionaries.
+# The KQL parser lives at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kql_parser import KqlSyntaxError, parse_query, token_signature, tokenize
 
-    Args:
-        data (list): List of dictionaries to write to the JSONL file.
-        output_file (str): Path to the output JSONL file.
-    """
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for item in data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+# Slot values used to vary the seed examples
+REGIONS = [
+    "West Europe", "North Europe", "East US", "East US 2", "West US 2", "Central US",
+    "UK South", "Southeast Asia", "Australia East", "Japan East", "Brazil South", "Canada Central",
+]
+SDP_STAGES = ["1", "2", "3", "4", "5"]
+RELEASE_CHANNELS = ["Preview", "Default", "Stable"]
+SKUS = ["Developer", "Basic", "Standard", "Premium", "Consumption", "BasicV2", "StandardV2"]
+MINOR_VERSIONS = ["0.47", "0.48", "0.49", "0.50"]
 
-def create_message(user_content, assistant_content):
+KQL_BLOCK_PATTERN = re.compile(r"```kql\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+FULL_VERSION_PATTERN = re.compile(r"\b0\.\d{2}\.\d{5}\.0\b")
+MINOR_VERSION_PATTERN = re.compile(r"\b0\.\d{2}\b(?!\.\d)")
+# "stage 2", "SDP stage 2" or "sdpStage 2" in a question
+SDP_STAGE_QUESTION_PATTERN = re.compile(r"\b(?:sdp\s*)?stage\s*(\d)\b", re.IGNORECASE)
+NEAR_DUPLICATE_THRESHOLD = 0.85
+
+def create_message(user_content, assistant_content, system_prompt=system_prompts.DEFAULT_KUSTO_SYSTEM_PROMPT):
     return {
         "messages": [
-            {"role": "system", "content": system_prompts.DEFAULT_KUSTO_SYSTEM_PROMPT},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_content},
             {"role": "assistant", "content": assistant_content}
         ]
     }
 
-# List to hold all data entries
-data = []
+def extract_query(assistant_content):
+    """
+    Returns the KQL inside the first ```kql block, or the stripped content when there is none.
+    """
+    match = KQL_BLOCK_PATTERN.search(assistant_content)
+    return match.group(1).strip() if match else assistant_content.strip()
+
+def _region_forms(region):
+    return [region, region.lower(), region.replace(" ", ""), region.lower().replace(" ", "")]
+
+def _replace_forms(text, old_forms, new_forms):
+    # Longest forms first so "East US 2" is not rewritten as "East US"
+    for old, new in sorted(zip(old_forms, new_forms), key=lambda pair: -len(pair[0])):
+        text = re.sub(rf"(?<![A-Za-z0-9]){re.escape(old)}(?![A-Za-z0-9])", new, text)
+    return text
+
+def _same_case(original, replacement):
+    """
+    Returns replacement in the case the question used for the original value.
+    """
+    if original.islower():
+        return replacement.lower()
+    if original.isupper():
+        return replacement.upper()
+    return replacement
+
+def gold_full_versions(seeds):
+    """
+    Returns the full build versions (e.g. 0.48.23550.0) that appear in the seed examples.
+    """
+    return sorted({version for question, content in seeds for version in FULL_VERSION_PATTERN.findall(f"{question}\n{content}")})
+
+def _slot_variants(question, query, full_versions):
+    """
+    Yields (question, query) pairs with a single slot value swapped for another.
+    Full versions are only swapped for other versions from full_versions, so no build number is made up.
+    """
+    lowered = question.lower()
+
+    for region in sorted(REGIONS, key=len, reverse=True):
+        if any(re.search(rf"(?<![a-z0-9]){re.escape(form.lower())}(?![a-z0-9])", lowered) for form in _region_forms(region)):
+            for replacement in REGIONS:
+                if replacement != region and replacement not in region and region not in replacement:
+                    old_forms, new_forms = _region_forms(region), _region_forms(replacement)
+                    yield _replace_forms(question, old_forms, new_forms), _replace_forms(query, old_forms, new_forms)
+            break
+
+    stage = SDP_STAGE_QUESTION_PATTERN.search(question)
+    if stage and stage.group(1) in SDP_STAGES:
+        for replacement in SDP_STAGES:
+            if replacement != stage.group(1):
+                old, new = stage.group(1), replacement
+                new_question = question[:stage.start(1)] + new + question[stage.end(1):]
+                new_query = re.sub(rf"Stage_{old}\b", f"Stage_{new}", query)
+                # Only literals compared with or assigned to an SDP stage column or let
+                new_query = re.sub(rf"(\bsdp_?stage\w*\s*(?:==|!=|=)\s*)(['\"]){old}\2", rf"\g<1>\g<2>{new}\g<2>", new_query, flags=re.IGNORECASE)
+                if new_query != query:
+                    yield new_question, new_query
+
+    for channel in RELEASE_CHANNELS:
+        if re.search(rf"\b{channel}\b", question, re.IGNORECASE) and re.search(rf"(['\"]){channel}\1", query):
+            for replacement in RELEASE_CHANNELS:
+                if replacement != channel:
+                    new_question = re.sub(rf"\b{channel}\b", lambda match: _same_case(match.group(0), replacement), question, flags=re.IGNORECASE)
+                    yield new_question, re.sub(rf"(['\"]){channel}\1", rf"\g<1>{replacement}\g<1>", query)
+
+    for sku in SKUS:
+        if re.search(rf"\b{sku}\b", question, re.IGNORECASE) and re.search(rf"(['\"]){sku}\1", query):
+            for replacement in SKUS:
+                if replacement != sku:
+                    new_question = re.sub(rf"\b{sku}\b", lambda match: _same_case(match.group(0), replacement), question, flags=re.IGNORECASE)
+                    yield new_question, re.sub(rf"(['\"]){sku}\1", rf"\g<1>{replacement}\g<1>", query)
+
+    full_version = FULL_VERSION_PATTERN.search(question)
+    if full_version and full_version.group(0) in query:
+        old = full_version.group(0)
+        for new in full_versions:
+            if new != old:
+                yield question.replace(old, new), query.replace(old, new)
+    else:
+        minor_version = MINOR_VERSION_PATTERN.search(question)
+        if minor_version and minor_version.group(0) in query:
+            old = minor_version.group(0)
+            for new in MINOR_VERSIONS:
+                if new != old:
+                    yield question.replace(old, new), query.replace(old, new)
+
+def augment_example(example, full_versions=None):
+    """
+    Expands one seed example into itself plus its slot-value variants.
+
+    Args:
+        example (tuple): (question, assistant content) from prompts_dict
+        full_versions (list, optional): Full versions to swap in. Defaults to those in prompts_dict
+
+    Returns:
+        list: (question, KQL query) pairs, seed first
+    """
+    question, assistant_content = example
+    query = extract_query(assistant_content)
+    if full_versions is None:
+        full_versions = gold_full_versions(prompts_dict.prompts_dict.items())
+    return [(question, query)] + list(_slot_variants(question, query, full_versions))
+
+def _question_words(question):
+    return frozenset(re.findall(r"[a-z0-9.]+", question.lower()))
+
+class NearDuplicateFilter:
+    """
+    Drops examples whose KQL is identical (ignoring whitespace and comments) to an
+    earlier example and whose question shares most of its words with it.
+    """
+
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self._seen = {}
+
+    def is_duplicate(self, question, query):
+        try:
+            key = token_signature(tokenize(query))
+        except KqlSyntaxError:
+            key = " ".join(query.split())
+        words = _question_words(question)
+        previous = self._seen.setdefault(key, [])
+        for seen_words in previous:
+            union = words | seen_words
+            if not union or len(words & seen_words) / len(union) >= self.threshold:
+                return True
+        previous.append(words)
+        return False
+
+def is_valid_kql(query):
+    """
+    Checks that a query tokenizes and splits into a let/pipeline structure locally.
+    """
+    try:
+        parse_query(query)
+        return True
+    except KqlSyntaxError:
+        return False
+
+def build_dataset(output_file, short_output_file=None, workers=1, validate=False, seeds=None):
+    """
+    Streams an augmented fine-tuning dataset to JSONL.
+
+    Seeds are expanded across a process pool, near-duplicates are dropped and each
+    record is written as soon as it is produced. When short_output_file is given the
+    same examples are also written with SHORT_KUSTO_SYSTEM_PROMPT.
+
+    Args:
+        output_file (str): Path for records using DEFAULT_KUSTO_SYSTEM_PROMPT
+        short_output_file (str, optional): Path for records using SHORT_KUSTO_SYSTEM_PROMPT
+        workers (int, optional): Number of augmentation processes. Default 1 (in-process)
+        validate (bool, optional): Drop examples whose KQL does not parse locally
+        seeds (dict, optional): Question to assistant content mapping. Defaults to prompts_dict
+
+    Returns:
+        dict: Counts of written, duplicate and invalid examples
+    """
+    seeds = list((seeds if seeds is not None else prompts_dict.prompts_dict).items())
+    augment = partial(augment_example, full_versions=gold_full_versions(seeds))
+    duplicates = NearDuplicateFilter()
+    stats = {"written": 0, "duplicates": 0, "invalid": 0}
 
-# Add entries from prompts_dict by calling create_message for each key-value pair
-for user_content, assistant_content in prompts_dict.prompts_dict.items():
-    data.append(create_message(user_content, assistant_content))
+    short_file = open(short_output_file, 'w', encoding='utf-8') if short_output_file else None
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with open(output_file, 'w', encoding='utf-8') as full_file:
+            expanded = pool.map(augment, seeds, chunksize=4) if pool else map(augment, seeds)
+            for examples in expanded:
+                for question, query in examples:
+                    if validate and not is_valid_kql(query):
+                        stats["invalid"] += 1
+                        continue
+                    if duplicates.is_duplicate(question, query):
+                        stats["duplicates"] += 1
+                        continue
+                    assistant_content = f"```kql\n{query}\n```"
+                    full_file.write(json.dumps(create_message(question, assistant_content), ensure_ascii=False) + '\n')
+                    if short_file:
+                        record = create_message(question, assistant_content, system_prompts.SHORT_KUSTO_SYSTEM_PROMPT)
+                        short_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    stats["written"] += 1
+    finally:
+        if pool:
+            pool.shutdown()
+        if short_file:
+            short_file.close()
+    return stats
 
-generate_jsonl(data, "output.jsonl")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the KQL fine-tuning dataset from prompts_dict.")
+    parser.add_argument("--output", default="output.jsonl", help="records with the full system prompt")
+    parser.add_argument("--short-output", default="output_short.jsonl", help="records with the short system prompt")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="augmentation processes")
+    parser.add_argument("--validate", action="store_true", help="drop examples whose KQL does not parse locally")
+    args = parser.parse_args()
 
+    stats = build_dataset(args.output, args.short_output, workers=args.workers, validate=args.validate)
+    print(f"Wrote {stats['written']} examples ({stats['duplicates']} near-duplicates, {stats['invalid']} invalid skipped)")
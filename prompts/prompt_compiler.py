@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from prompts.system_prompts import DEFAULT_KUSTO_SYSTEM_PROMPT, CATALOG_KUSTO_SYSTEM_PROMPT, SHORT_KUSTO_SYSTEM_PROMPT, KUSTO_RESULTS_SUMMARY_SYSTEM_PROMPT
+from prompts.prompts_dict import prompts_dict
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except ImportError:
+    _ENCODING = None
+
+GENERATION_PROMPT = "kusto_generation"
+CATALOG_GENERATION_PROMPT = "kusto_generation_catalog"
+SHORT_GENERATION_PROMPT = "kusto_generation_short"
+SUMMARY_PROMPT = "kusto_summary"
+
+# Static instructions that used to follow the query and results in the summary user message
+SUMMARY_REQUEST_INSTRUCTIONS = """
+
+Each request contains a KQL query followed by its results as JSON rows. Analyze them and provide a clear summary of the key findings."""
+
+CompiledPrompt = namedtuple("CompiledPrompt", ["name", "text", "sha256", "version", "token_count", "approximate_tokens"])
+
+
+def count_tokens(text: str) -> tuple:
+    """
+    Count tokens with tiktoken when it is installed, otherwise estimate at four characters per token.
+
+    Returns:
+        tuple: (token count, True if the count is an estimate)
+    """
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text)), False
+    return (len(text) + 3) // 4, True
+
+
+def compile_prompt(name: str, *parts: str) -> CompiledPrompt:
+    """
+    Join static prompt parts into a single immutable system prompt and fingerprint it.
+
+    Args:
+        name (str): Prompt name
+        *parts (str): Static content, in the order it is sent
+
+    Returns:
+        CompiledPrompt: Prompt text with its SHA-256, short version id and token count
+    """
+    text = "".join(parts)
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    tokens, approximate = count_tokens(text)
+    return CompiledPrompt(name, text, digest, digest[:12], tokens, approximate)
+
+
+def format_generation_examples(examples: list) -> str:
+    """
+    Format (question, assistant content) pairs the way they follow the generation system prompt.
+    """
+    return "".join(f"\nQuestion {i}: {k}\nKqlQuery: {v}" for i, (k, v) in enumerate(examples))
+
+
+def _generation_examples() -> str:
+    return format_generation_examples(prompts_dict.items())
+
+
+class PromptRegistry:
+    """
+    System prompts compiled once at startup.
+
+    Compiled prompts are immutable strings, so lookups return them as is; the
+    fingerprint taken at compile time is exposed through report() for comparing deployments.
+    """
+
+    def __init__(self):
+        self._prompts = {}
+        self._lock = threading.Lock()
+
+    def register(self, prompt: CompiledPrompt) -> CompiledPrompt:
+        with self._lock:
+            self._prompts[prompt.name] = prompt
+        logging.info(
+            "Compiled prompt '%s' version %s: %s%d tokens",
+            prompt.name, prompt.version, "~" if prompt.approximate_tokens else "", prompt.token_count
+        )
+        return prompt
+
+    def get(self, name: str) -> CompiledPrompt:
+        """
+        Return a compiled prompt.
+        """
+        return self._prompts[name]
+
+    def report(self) -> list:
+        """
+        Return name, version, content hash and token count for every compiled prompt.
+        """
+        return [
+            {
+                "name": p.name,
+                "version": p.version,
+                "sha256": p.sha256,
+                "token_count": p.token_count,
+                "approximate_tokens": p.approximate_tokens,
+                "characters": len(p.text),
+            }
+            for p in self._prompts.values()
+        ]
+
+
+compiled_prompts = PromptRegistry()
+compiled_prompts.register(compile_prompt(GENERATION_PROMPT, DEFAULT_KUSTO_SYSTEM_PROMPT, _generation_examples()))
+compiled_prompts.register(compile_prompt(CATALOG_GENERATION_PROMPT, CATALOG_KUSTO_SYSTEM_PROMPT, _generation_examples()))
+compiled_prompts.register(compile_prompt(SHORT_GENERATION_PROMPT, SHORT_KUSTO_SYSTEM_PROMPT))
+compiled_prompts.register(compile_prompt(SUMMARY_PROMPT, KUSTO_RESULTS_SUMMARY_SYSTEM_PROMPT, SUMMARY_REQUEST_INSTRUCTIONS))
@@ -0,0 +1,132 @@
+import contextvars
+import logging
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from request_metrics import current_metrics, use_metrics
+
+QUERY_DECOMPOSITION_ENABLED = os.environ.get("QUERY_DECOMPOSITION_ENABLED", "true").lower() not in ("0", "false", "no", "off")
+MAX_SUB_QUESTIONS = int(os.environ.get("QUERY_DECOMPOSITION_MAX_SUB_QUESTIONS", 6))
+
+SubQuestion = namedtuple("SubQuestion", ["text", "labels"])
+SubResult = namedtuple("SubResult", ["sub_question", "query", "rows", "source"])
+
+_SEPARATOR = r"\s*(?:,\s*(?:and\s+|or\s+)?|\band\b|\bor\b|&|\bvs\.?|\bversus\b)\s*"
+_CHANNEL = r"\b(?:preview|default|stable)\b"
+_CHANNEL_LIST = re.compile(rf"{_CHANNEL}(?:{_SEPARATOR}{_CHANNEL})+", re.IGNORECASE)
+# After a separator, a bare number only counts as a stage when it is a single digit: "stage 2 and 30 days" is one stage
+_STAGE_LIST = re.compile(rf"\b(?:sdp\s*)?stages?\s+\d+(?:{_SEPARATOR}(?:(?:sdp\s*)?stage\s+\d+|\d)\b)+", re.IGNORECASE)
+_LEADING_VERB = re.compile(r"^\s*(?:compare|contrast)\s+(?:the\s+)?", re.IGNORECASE)
+
+
+def _unique(values: list) -> list:
+    return list(dict.fromkeys(values))
+
+
+def plan_sub_questions(question: str) -> list:
+    """
+    Split a question that enumerates several release channels or SDP stages into one
+    sub-question per combination, e.g. "Preview and Default ... in stage 2 and 3" into four.
+
+    Args:
+        question (str): Natural language question
+
+    Returns:
+        list: SubQuestion tuples of (text, labels), or an empty list when the question
+            should be answered by a single query
+    """
+    if not QUERY_DECOMPOSITION_ENABLED:
+        return []
+    slots = []
+    channel_match = _CHANNEL_LIST.search(question)
+    if channel_match:
+        channels = _unique(value.capitalize() for value in re.findall(_CHANNEL, channel_match.group(0), re.IGNORECASE))
+        if len(channels) > 1:
+            slots.append(("releaseChannel", channel_match, [(channel, channel) for channel in channels]))
+    stage_match = _STAGE_LIST.search(question)
+    if stage_match:
+        stages = _unique(re.findall(r"\d+", stage_match.group(0)))
+        if len(stages) > 1:
+            # Labels use the source rows' type: sdpStage values are strings such as "2"
+            slots.append(("sdpStage", stage_match, [(stage, f"stage {stage}") for stage in stages]))
+    if not slots:
+        return []
+
+    combinations = [({}, [])]
+    for column, match, values in slots:
+        combinations = [
+            ({**labels, column: value}, edits + [(match.start(), match.end(), text)])
+            for labels, edits in combinations
+            for value, text in values
+        ]
+    if len(combinations) > MAX_SUB_QUESTIONS:
+        logging.info("Question has %d combinations, answering it with a single query", len(combinations))
+        return []
+
+    sub_questions = []
+    for labels, edits in combinations:
+        text = question
+        for start, end, replacement in sorted(edits, reverse=True):
+            text = text[:start] + replacement + text[end:]
+        text = _LEADING_VERB.sub("Show the ", text)
+        sub_questions.append(SubQuestion(text, labels))
+    return sub_questions
+
+
+def run_sub_questions(sub_questions: list, generate, execute, max_workers: int = MAX_SUB_QUESTIONS) -> list:
+    """
+    Generate and execute the query of every sub-question in parallel.
+
+    Each task runs in a copy of the caller's context with its own child metrics, which are
+    merged into the calling request's metrics once every task has finished.
+
+    Args:
+        sub_questions (list): SubQuestion tuples from plan_sub_questions
+        generate (callable): Function taking a question and returning its KQL query
+        execute (callable): Function taking a KQL query and returning (rows, source)
+        max_workers (int, optional): Maximum sub-questions in flight
+
+    Returns:
+        list: SubResult tuples in the order of sub_questions
+    """
+    def run(sub_question, metrics):
+        if metrics is None:
+            query = generate(sub_question.text)
+            rows, source = execute(query)
+            return SubResult(sub_question, query, rows, source)
+        with use_metrics(metrics):
+            return run(sub_question, None)
+
+    parent = current_metrics()
+    children = [parent.child() if parent is not None else None for _ in sub_questions]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sub_questions)))) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, run, sub_question, metrics) for sub_question, metrics in zip(sub_questions, children)]
+            return [future.result() for future in futures]
+    finally:
+        # The pool has shut down, so no task still writes to its metrics
+        for metrics in children:
+            if metrics is not None:
+                parent.merge(metrics)
+
+
+def combine_results(sub_results: list) -> list:
+    """
+    Union the rows of all sub-questions, labelling each row with the channel and stage
+    it was asked for. Columns the query already returned are kept as they are.
+    """
+    rows = []
+    for sub_result in sub_results:
+        for row in sub_result.rows or []:
+            labelled = dict(sub_result.sub_question.labels)
+            labelled.update(row)
+            rows.append(labelled)
+    return rows
+
+
+def combined_query_text(sub_results: list) -> str:
+    """
+    Join the sub-queries into one readable script, each preceded by its sub-question.
+    """
+    return "\n\n".join(f"// {sub_result.sub_question.text}\n{sub_result.query}" for sub_result in sub_results)
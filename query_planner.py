@@ -0,0 +1,28 @@
+import logging
+from session_state import answer_from_session
+
+
+def execute_query_plan(query: str, kusto_executor, session: dict = None, cube=None) -> tuple:
+    """
+    Resolve a generated KQL query from the cheapest source that can answer it exactly.
+
+    Args:
+        query (str): Generated KQL query
+        kusto_executor (callable): Function that runs a query on the cluster and returns rows
+        session (dict, optional): Conversation session holding the previous result set
+        cube (TenantCube, optional): Pre-aggregated GetTenantVersions cube
+
+    Returns:
+        tuple: (result rows, name of the source that produced them)
+    """
+    rows = answer_from_session(session, query)
+    if rows is not None:
+        return rows, "session"
+
+    if cube is not None:
+        rows = cube.answer(query)
+        if rows is not None:
+            return rows, "cube"
+
+    logging.info("Executing query on the Kusto cluster.")
+    return kusto_executor(query), "kusto"
@@ -0,0 +1,136 @@
+import contextvars
+import json
+import logging
+import os
+import random
+from collections import namedtuple
+from contextlib import contextmanager
+
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", 500))
+LOG_DEBUG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_DEBUG_PAYLOAD_MAX_CHARS", 20000))
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 1.0))
+# Per-route overrides of LOG_SAMPLE_RATE, e.g. "kusto_nl_query=0.05,kusto_nl_job=0.01"
+LOG_SAMPLE_RATES = {
+    route.strip(): float(rate)
+    for route, _, rate in (item.partition("=") for item in os.environ.get("LOG_SAMPLE_RATES", "").split(","))
+    if route.strip() and rate.strip()
+}
+LOG_DEBUG_HEADER = "x-debug-log"
+
+LogPolicy = namedtuple("LogPolicy", ["route", "sampled", "debug"])
+
+_DEFAULT_POLICY = LogPolicy(None, True, False)
+_current_policy = contextvars.ContextVar("request_log_policy", default=_DEFAULT_POLICY)
+
+
+def _policy() -> LogPolicy:
+    return _current_policy.get()
+
+
+@contextmanager
+def request_logging(route: str, debug: bool = False):
+    """
+    Decide once per request whether its detail logs are kept.
+
+    Args:
+        route (str): Route name, looked up in LOG_SAMPLE_RATES
+        debug (bool, optional): Keep every detail log of this request, with larger payloads and row contents
+    """
+    rate = LOG_SAMPLE_RATES.get(route, LOG_SAMPLE_RATE)
+    token = _current_policy.set(LogPolicy(route, debug or random.random() < rate, debug))
+    try:
+        yield
+    finally:
+        _current_policy.reset(token)
+
+
+def debug_requested(headers) -> bool:
+    """
+    True when the caller asked for full logging of this request with the x-debug-log header.
+    """
+    return str(headers.get(LOG_DEBUG_HEADER) or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def log_detail(level: int, message: str, *args) -> None:
+    """
+    Log a payload-heavy message only when the current request is sampled.
+
+    Arguments are %-formatted by logging, so nothing is built for dropped records.
+    Requests with the debug override log at INFO or above so the record is not filtered.
+    """
+    policy = _policy()
+    if policy.debug:
+        level = max(level, logging.INFO)
+    elif not policy.sampled:
+        return
+    logging.log(level, message, *args)
+
+
+class _Truncated:
+    """
+    Log argument rendered only when the record is emitted, and cut at a character limit.
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        value = self.value
+        if isinstance(value, (list, tuple)):
+            # Serialize item by item so a large result is never rendered in full
+            parts, length = [], 0
+            for index, item in enumerate(value):
+                part = json.dumps(item, default=str, ensure_ascii=False)
+                if length + len(part) > self.limit:
+                    more = f"... {len(value) - index} more"
+                    return "[" + ", ".join(parts + [more]) + "]"
+                parts.append(part)
+                length += len(part) + 2
+            return "[" + ", ".join(parts) + "]"
+        text = value if isinstance(value, str) else str(value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... ({len(text) - self.limit} more characters)"
+
+
+class _RowSummary:
+    """
+    Log argument describing a result set by its size, plus its rows under the debug override.
+    """
+
+    __slots__ = ("rows", "debug", "limit")
+
+    def __init__(self, rows, debug: bool, limit: int):
+        self.rows = rows
+        self.debug = debug
+        self.limit = limit
+
+    def __str__(self) -> str:
+        if self.rows is None:
+            return "no rows"
+        summary = f"{len(self.rows)} rows"
+        if self.rows and isinstance(self.rows[0], dict):
+            summary += f" x {len(self.rows[0])} columns ({', '.join(map(str, self.rows[0]))})"
+        if self.debug:
+            summary += f": {_Truncated(self.rows, self.limit)}"
+        return summary
+
+
+def truncated(value, limit: int = None) -> _Truncated:
+    """
+    Wrap a payload for a log call. It is cut at LOG_PAYLOAD_MAX_CHARS, or LOG_DEBUG_PAYLOAD_MAX_CHARS under the debug override.
+    """
+    if limit is None:
+        limit = LOG_DEBUG_PAYLOAD_MAX_CHARS if _policy().debug else LOG_PAYLOAD_MAX_CHARS
+    return _Truncated(value, limit)
+
+
+def row_summary(rows: list) -> _RowSummary:
+    """
+    Wrap a result set for a log call: row and column counts only, unless the request is debugged.
+    """
+    debug = _policy().debug
+    return _RowSummary(rows, debug, LOG_DEBUG_PAYLOAD_MAX_CHARS)
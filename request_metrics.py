@@ -0,0 +1,124 @@
+import time
+import contextvars
+from contextlib import contextmanager
+
+_current_metrics = contextvars.ContextVar("request_metrics", default=None)
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    Raised when a pipeline stage would start after the request's deadline.
+    """
+
+
+class RequestMetrics:
+    """
+    Per-request timings and counters collected as the NL query pipeline runs.
+    """
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.monotonic()
+        self.stages = {}
+        self.token_usage = {}
+        self.attributes = {}
+        self.active_stage = None
+        self.deadline = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a pipeline stage in milliseconds. Repeated stages accumulate.
+
+        Raises:
+            DeadlineExceededError: If the request's deadline (a time.monotonic value) has passed
+        """
+        started = time.monotonic()
+        if self.deadline is not None and started > self.deadline:
+            raise DeadlineExceededError(f"Request deadline passed before the {name} stage")
+        outer_stage, self.active_stage = self.active_stage, name
+        try:
+            yield
+        finally:
+            self.active_stage = outer_stage
+            self.stages[name] = self.stages.get(name, 0.0) + (time.monotonic() - started) * 1000
+
+    def add_token_usage(self, usage, name: str = None) -> None:
+        """
+        Accumulate prompt/completion/cached token counts from an OpenAI usage object,
+        under the given name or the stage that is currently running.
+        """
+        if usage is None:
+            return
+        name = name or self.active_stage or "llm"
+        totals = self.token_usage.setdefault(name, {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0})
+        totals["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        totals["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        totals["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+        if getattr(usage, "estimated", False):
+            totals["estimated"] = True
+
+    def child(self) -> "RequestMetrics":
+        """
+        Separate metrics for work running in parallel within this request, with the same
+        route, deadline and active stage. Fold them back in with merge().
+        """
+        metrics = RequestMetrics(self.route)
+        metrics.deadline = self.deadline
+        metrics.active_stage = self.active_stage
+        return metrics
+
+    def merge(self, other: "RequestMetrics") -> None:
+        """
+        Add the stages and token usage of child metrics. List attributes are concatenated
+        and dict attributes updated; other attributes are kept if already set.
+        """
+        for name, ms in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + ms
+        for name, usage in other.token_usage.items():
+            totals = self.token_usage.setdefault(name, {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0})
+            for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                totals[key] += usage.get(key, 0)
+            if usage.get("estimated"):
+                totals["estimated"] = True
+        for key, value in other.attributes.items():
+            current = self.attributes.get(key)
+            if isinstance(current, list) and isinstance(value, list):
+                current.extend(value)
+            elif isinstance(current, dict) and isinstance(value, dict):
+                current.update(value)
+            else:
+                self.attributes.setdefault(key, value)
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.started) * 1000
+
+
+@contextmanager
+def track_request(route: str):
+    """
+    Make a RequestMetrics the current one for the duration of a request.
+    """
+    with use_metrics(RequestMetrics(route)) as metrics:
+        yield metrics
+
+
+@contextmanager
+def use_metrics(metrics: RequestMetrics):
+    """
+    Make existing metrics the current ones, e.g. the child metrics of a parallel task.
+    """
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+def current_metrics() -> RequestMetrics:
+    """
+    Return the metrics of the request being processed, or None outside a request.
+    """
+    return _current_metrics.get()
+
@@ -0,0 +1,105 @@
+OTHERS_LABEL = "others"
+
+_TRUE_VALUES = {"1", "true", "yes", "on"}
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in _TRUE_VALUES
+
+
+def _as_columns(value) -> list:
+    if isinstance(value, list):
+        return [str(column) for column in value]
+    return [column.strip() for column in str(value).split(",") if column.strip()]
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def parse_shaping_options(params: dict) -> dict:
+    """
+    Validate response shaping options taken from the query string or JSON body.
+
+    Args:
+        params (dict): Raw values of max_rows, columns, top_n_by and others_bucket (missing ones as None)
+
+    Returns:
+        dict: Keyword arguments for shape_results
+
+    Raises:
+        ValueError: If max_rows is not a positive integer
+    """
+    options = {}
+    if params.get("max_rows") not in (None, ""):
+        try:
+            options["max_rows"] = int(params["max_rows"])
+        except (TypeError, ValueError):
+            raise ValueError(f"max_rows must be an integer, got {params['max_rows']!r}")
+        if options["max_rows"] < 1:
+            raise ValueError("max_rows must be at least 1")
+    if params.get("columns"):
+        options["columns"] = _as_columns(params["columns"])
+    if params.get("top_n_by"):
+        options["top_n_by"] = str(params["top_n_by"])
+    if params.get("others_bucket") is not None:
+        options["others_bucket"] = _as_bool(params["others_bucket"])
+    return options
+
+
+def _is_additive(column: str, top_n_by: str) -> bool:
+    # dcount and min/max columns cannot be summed into an others row
+    return column == top_n_by or column == "count_" or column.startswith("sum_")
+
+
+def shape_results(results: list, max_rows: int = None, columns: list = None, top_n_by: str = None, others_bucket: bool = False) -> tuple:
+    """
+    Trim a result set for chat clients without losing totals.
+
+    Args:
+        results (list): Query result rows
+        max_rows (int, optional): Maximum rows to return, including the others row
+        columns (list, optional): Columns to keep, in order. Unknown names are ignored
+        top_n_by (str, optional): Numeric column to rank rows by (descending) before truncating
+        others_bucket (bool, optional): Fold truncated rows into a single "others" row that sums
+            top_n_by, count_ and sum_* columns
+
+    Returns:
+        tuple: (shaped rows, dict with total_row_count, returned_row_count, others_row_count and truncated)
+    """
+    rows = results or []
+    total = len(rows)
+
+    if top_n_by and rows and top_n_by in rows[0]:
+        rows = sorted(rows, key=lambda row: row.get(top_n_by) if _is_number(row.get(top_n_by)) else float("-inf"), reverse=True)
+
+    folded = []
+    if max_rows is not None and len(rows) > max_rows:
+        keep = max_rows - 1 if others_bucket else max_rows
+        rows, folded = rows[:keep], rows[keep:]
+
+    output_columns = list(results[0].keys()) if results else []
+    if columns:
+        output_columns = [column for column in columns if column in output_columns] or output_columns
+        rows = [{column: row.get(column) for column in output_columns} for row in rows]
+
+    if folded and others_bucket:
+        others = {}
+        for column in output_columns:
+            values = [row.get(column) for row in folded]
+            if _is_additive(column, top_n_by) and all(_is_number(v) or v is None for v in values):
+                others[column] = sum(v or 0 for v in values)
+            elif isinstance(results[0].get(column), str):
+                others[column] = OTHERS_LABEL
+            else:
+                others[column] = None
+        rows = rows + [others]
+
+    return rows, {
+        "total_row_count": total,
+        "returned_row_count": len(rows),
+        "others_row_count": len(folded) if others_bucket else 0,
+        "truncated": len(folded) > 0,
+    }
@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+SCHEMA_CATALOG_ENABLED = os.environ.get("SCHEMA_CATALOG_ENABLED", "true").lower() not in ("0", "false", "no", "off")
+SCHEMA_CATALOG_PATH = os.environ.get("SCHEMA_CATALOG_PATH", os.path.join(tempfile.gettempdir(), "apim_nl_kusto_schema_catalog.json"))
+SCHEMA_CATALOG_REFRESH_SECONDS = float(os.environ.get("SCHEMA_CATALOG_REFRESH_SECONDS", 6 * 60 * 60))
+SCHEMA_CATALOG_RETRY_SECONDS = 60
+
+# Functions and tables the generation prompt may use, as they are referenced in KQL
+CATALOG_SOURCES = (
+    "GetTenantVersions",
+    "GetQuarantinedServicesList",
+    "GetRegionalAppsVersion",
+    "GetSDPRegions",
+    "All('Orchestration')",
+)
+
+# Words in a question that point at a source even when no column is named
+SOURCE_KEYWORDS = {
+    "GetTenantVersions": {"tenant", "version", "sku", "release", "channel", "stage", "region", "window", "vpn"},
+    "GetQuarantinedServicesList": {"quarantine", "quarantined"},
+    "GetRegionalAppsVersion": {"resourceprovider", "provider", "runtime", "cluster", "component", "regional"},
+    "GetSDPRegions": {"sdpregion"},
+    "All('Orchestration')": {"orchestration", "instance", "event"},
+}
+
+# Columns always sent for a source, because nearly every question about it needs them
+CORE_COLUMNS = {
+    "GetTenantVersions": ("version", "sku", "sdpStage", "releaseChannel", "regions"),
+}
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_COLUMN_WORD_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def _stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+def _question_words(question: str) -> set:
+    return {_stem(word) for word in _WORD_PATTERN.findall(question.lower())}
+
+
+def _column_words(column: str) -> set:
+    words = {_stem(word.lower()) for word in _COLUMN_WORD_PATTERN.findall(column)}
+    words.add(_stem(column.lower()))
+    return {word for word in words if len(word) >= 3}
+
+
+def kusto_schema_fetcher(kusto_executor):
+    """
+    Build a fetcher that reads the output schema of a function or table with getschema.
+
+    Args:
+        kusto_executor (callable): Function taking a KQL query and returning rows as dicts
+
+    Returns:
+        callable: Function taking a source and returning a list of [column name, column type]
+    """
+    def fetch(source: str) -> list:
+        return [[row["ColumnName"], row["ColumnType"]] for row in kusto_executor(f"{source}\n| getschema")]
+    return fetch
+
+
+class SchemaCatalog:
+    """
+    Column schemas of the functions and tables the generator may use.
+
+    Schemas are fetched from the database, kept in memory and in a JSON file so restarts
+    and other workers start warm, and re-fetched after refresh_seconds. Requests never
+    wait on a fetch: a missing or stale catalog is served as is while one background
+    refresh runs. When a refresh fails the last known schemas are used.
+    """
+
+    def __init__(self, fetch_columns, path: str = SCHEMA_CATALOG_PATH, refresh_seconds: float = SCHEMA_CATALOG_REFRESH_SECONDS, sources: tuple = CATALOG_SOURCES):
+        self.fetch_columns = fetch_columns
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.sources = sources
+        self._catalog = None
+        self._last_failure = 0.0
+        self._refresh_thread = None
+        self._lock = threading.Lock()
+        # Held for the whole fetch so concurrent callers never refresh at the same time
+        self._refresh_lock = threading.Lock()
+
+    def _is_fresh(self, catalog: dict) -> bool:
+        return catalog is not None and time.time() - catalog["fetched_at"] < self.refresh_seconds
+
+    def _read_file(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as catalog_file:
+                return json.load(catalog_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_file(self, catalog: dict) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w", encoding="utf-8") as catalog_file:
+            json.dump(catalog, catalog_file)
+        os.replace(temp_path, self.path)
+
+    def _fetch(self) -> dict:
+        previous = self._catalog or self._read_file() or {"sources": {}}
+        sources = {}
+        for source in self.sources:
+            try:
+                sources[source] = self.fetch_columns(source)
+            except Exception as e:
+                logging.warning("Could not fetch the schema of %s: %s", source, e)
+                if source in previous["sources"]:
+                    sources[source] = previous["sources"][source]
+        if not sources:
+            raise RuntimeError("No schemas could be fetched")
+        catalog = {"fetched_at": time.time(), "sources": sources}
+        with self._lock:
+            self._catalog = catalog
+        try:
+            self._write_file(catalog)
+        except OSError as e:
+            logging.warning("Could not store the schema catalog in %s: %s", self.path, e)
+        logging.info("Schema catalog refreshed with %d sources", len(sources))
+        return catalog
+
+    def refresh(self) -> dict:
+        """
+        Fetch every source's schema from the database and store the catalog.
+
+        Sources that fail to fetch keep their last known schema. A catalog that could not
+        be written to the file is still used from memory.
+
+        Raises:
+            RuntimeError: If no source could be fetched and nothing was known before
+        """
+        with self._refresh_lock:
+            return self._fetch()
+
+    def refresh_if_stale(self) -> dict:
+        """
+        Refresh when the catalog is older than refresh_seconds, unless a refresh is already
+        running. Used by the timer and the background refresh, off the request path.
+
+        Returns:
+            dict: The current catalog, or None if unavailable
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return self._catalog
+        try:
+            catalog = self._current()
+            if self._is_fresh(catalog):
+                return catalog
+            return self._fetch()
+        except Exception as e:
+            self._last_failure = time.time()
+            logging.warning("Schema catalog refresh failed: %s", e)
+            return self._catalog
+        finally:
+            self._refresh_lock.release()
+
+    def _current(self) -> dict:
+        """
+        The newest known catalog, from memory or from the file another worker wrote, fresh or not.
+        """
+        catalog = self._catalog
+        if self._is_fresh(catalog):
+            return catalog
+        stored = self._read_file()
+        if stored is not None and (catalog is None or stored["fetched_at"] > catalog["fetched_at"]):
+            with self._lock:
+                self._catalog = catalog = stored
+        return catalog
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self.refresh_if_stale, name="schema-catalog-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def load(self) -> dict:
+        """
+        Return the catalog without waiting on the database. When it is missing or older
+        than refresh_seconds, a single background refresh is started.
+
+        Returns:
+            dict: {"fetched_at": timestamp, "sources": {source: [[column, type], ...]}}, or None if unavailable
+        """
+        catalog = self._current()
+        if not self._is_fresh(catalog) and time.time() - self._last_failure >= SCHEMA_CATALOG_RETRY_SECONDS:
+            self._refresh_in_background()
+        return catalog
+
+    def schema_prompt(self, question: str, user_prompt: str = None) -> str:
+        """
+        User message for query generation with the relevant schema block in front.
+
+        Args:
+            question (str): Natural language question the schema is selected for
+            user_prompt (str, optional): Message to send after the schema; the question by default
+
+        Returns:
+            str: User message, or None when no catalog is available
+        """
+        schema = self.relevant_schema(question)
+        return f"{schema}\n\n{user_prompt or question}" if schema else None
+
+    def relevant_schema(self, question: str, max_sources: int = 2, max_columns: int = 15) -> str:
+        """
+        Describe only the sources and columns that matter for a question.
+
+        Sources are ranked by keywords and by column names mentioned in the question;
+        GetTenantVersions is used when nothing matches.
+
+        Args:
+            question (str): Natural language question
+            max_sources (int, optional): Maximum number of sources to describe
+            max_columns (int, optional): Maximum number of columns per source
+
+        Returns:
+            str: Schema block for the user message, or None when no catalog is available
+        """
+        if not SCHEMA_CATALOG_ENABLED:
+            return None
+        catalog = self.load()
+        if not catalog or not catalog["sources"]:
+            return None
+
+        words = _question_words(question)
+        scored = []
+        for source, columns in catalog["sources"].items():
+            matched = [column for column, _ in columns if _column_words(column) & words]
+            keywords = len(SOURCE_KEYWORDS.get(source, set()) & words)
+            if keywords or matched:
+                scored.append((2 * keywords + len(matched), keywords, source, matched))
+        scored.sort(key=lambda item: -item[0])
+        # Beyond the best match, a source is only described when the question names it
+        scored = scored[:1] + [item for item in scored[1:] if item[1]]
+        if not scored:
+            default = "GetTenantVersions" if "GetTenantVersions" in catalog["sources"] else next(iter(catalog["sources"]))
+            scored = [(0, 0, default, [])]
+
+        lines = ["Schema of the functions and tables relevant to this question (column: type):"]
+        for _, _, source, matched in scored[:max_sources]:
+            types = dict(catalog["sources"][source])
+            core = [column for column in CORE_COLUMNS.get(source, ()) if column in types]
+            if core:
+                selected = core + [column for column in matched if column not in core]
+            else:
+                selected = matched + [column for column in types if column not in matched]
+            lines.append(f"{source}: " + ", ".join(f"{column}: {types[column]}" for column in selected[:max_columns]))
+        return "\n".join(lines)
@@ -0,0 +1,121 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from kql_parser import KqlSyntaxError, parse_query, scalar_lets, substitute_lets, token_signature
+from kql_evaluator import UnsupportedQueryError, evaluate_operators
+
+SESSION_TTL_SECONDS = 30 * 60
+MAX_SESSIONS = 1000
+# Result sets larger than this are not kept; refinements of them go back to the cluster
+MAX_CACHED_ROWS = 50000
+
+
+class SessionStore:
+    """
+    In-process store of the last query and result set for each conversation.
+
+    Entries expire after a fixed time-to-live and the least recently used
+    conversation is evicted once the store is full.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl_seconds: float = SESSION_TTL_SECONDS, max_rows: int = MAX_CACHED_ROWS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: str) -> dict:
+        """
+        Return the session for a conversation, or None if missing or expired.
+        """
+        if not conversation_id:
+            return None
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                return None
+            if time.monotonic() - session["updated_at"] > self.ttl_seconds:
+                del self._sessions[conversation_id]
+                return None
+            self._sessions.move_to_end(conversation_id)
+            return session
+
+    def put(self, conversation_id: str, query: str, rows: list) -> None:
+        """
+        Remember the last query and its results for a conversation.
+        """
+        if not conversation_id:
+            return
+        with self._lock:
+            if rows is None or len(rows) > self.max_rows:
+                self._sessions.pop(conversation_id, None)
+                return
+            self._sessions[conversation_id] = {
+                "query": query,
+                "rows": rows,
+                "columns": list(rows[0].keys()) if rows else [],
+                "updated_at": time.monotonic(),
+            }
+            self._sessions.move_to_end(conversation_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+
+conversation_sessions = SessionStore()
+
+# Openings and back-references that make a question about the previous answer rather than a new one
+_FOLLOW_UP_LEAD = re.compile(r"^\s*(?:and|but|also|now|then|only|just|same|instead|what about|how about|break (?:it|that|this|them) down|filter|narrow|exclude|sort|order|show only)\b", re.IGNORECASE)
+_FOLLOW_UP_REFERENCE = re.compile(r"\b(?:those|these|them|the same|previous|above|instead|that result|these results|those results)\b", re.IGNORECASE)
+
+
+def is_follow_up(question: str) -> bool:
+    """
+    True when a question reads as a refinement of the previous answer, e.g. "only those in stage 2"
+    or "what about Premium?", rather than a new self-contained question.
+    """
+    return bool(_FOLLOW_UP_LEAD.search(question) or _FOLLOW_UP_REFERENCE.search(question))
+
+
+def _normalized_pipeline(query: str) -> tuple:
+    parsed = parse_query(query)
+    scalars = scalar_lets(parsed)
+    if len(scalars) != len(parsed.lets):
+        raise UnsupportedQueryError("Only literal let statements can be compared")
+    stages = [token_signature(substitute_lets(parsed.source, scalars))]
+    for operator in parsed.operators:
+        stages.append((operator.name,) + token_signature(substitute_lets(operator.tokens, scalars)))
+    return parsed, scalars, stages
+
+
+def answer_from_session(session: dict, query: str) -> list:
+    """
+    Answer a follow-up query from the previous result set when that is provably correct.
+
+    The follow-up must be the previous query with extra pipeline operators appended
+    (after inlining literal let statements), and every extra operator must be
+    supported by the local evaluator.
+
+    Args:
+        session (dict): Session from SessionStore.get
+        query (str): Follow-up KQL query
+
+    Returns:
+        list: Result rows, or None when the query has to run on the cluster
+    """
+    if not session:
+        return None
+    try:
+        _, _, previous_stages = _normalized_pipeline(session["query"])
+        parsed, scalars, stages = _normalized_pipeline(query)
+        if len(stages) <= len(previous_stages) or stages[:len(previous_stages)] != previous_stages:
+            return None
+        refinement = parsed.operators[len(previous_stages) - 1:]
+        rows = evaluate_operators(refinement, session["rows"], session["columns"], scalars)
+    except (KqlSyntaxError, UnsupportedQueryError) as e:
+        logging.info("Follow-up cannot be answered from cached results: %s", e)
+        return None
+    logging.info("Answered follow-up from cached results with %d local operator(s)", len(refinement))
+    return rows
@@ -2,6 +2,9 @@ import { Selector } from "@microsoft/teams-ai";
 import { Activity, TurnContext } from "botbuilder";
 import { ApplicationTurnState } from "./internal/interface";
 
+// Rows rendered in the results table; the Function folds the rest into an "others" row
+const MAX_TABLE_ROWS = 25;
+
 /**
  * The `QueryKustoCommandHandler` registers patterns and responds
  * with appropriate messages if the user types general command inputs, such as "hi", "hello", and "help".
@@ -27,6 +30,10 @@ export class QueryKustoCommandHandler {
       for (const row of result.results) {
         tableBlock += `| ${columns.map(col => row[col]).join(" | ")} |\n`;
       }
+      if (result.truncated) {
+        const shownRows = result.returned_row_count - (result.others_row_count > 0 ? 1 : 0);
+        tableBlock += `\n_Showing ${shownRows} of ${result.total_row_count} rows._\n`;
+      }
     }
 
     const summaryBlock = result.summarized_results ? `\n**Summary:**\n\n${result.summarized_results}\n` : "";
@@ -60,11 +67,14 @@ export class QueryKustoCommandHandler {
         try {
           const baseFunctionUrl = `${process.env.AZURE_FUNCTION_URL}/kusto_nl_query?code=${process.env.AZURE_FUNCTION_CODE}==`;
           const promptParam = encodeURIComponent(context.activity.text);
-          const functionUrl = `${baseFunctionUrl}&prompt=${promptParam}`;
+          const conversationParam = encodeURIComponent(context.activity.conversation?.id ?? "");
+          const functionUrl = `${baseFunctionUrl}&prompt=${promptParam}&conversation_id=${conversationParam}&max_rows=${MAX_TABLE_ROWS}&others_bucket=true&summary=fast`;
+          // Identifies the Teams user, so admission control limits each user rather than the whole bot
+          const callerId = context.activity.from?.aadObjectId ?? context.activity.from?.id ?? "";
           const fetch = (await import("node-fetch")).default;
           const azureResponse = await fetch(functionUrl, {
             method: "POST",
-            headers: { "Content-Type": "application/json" }
+            headers: { "Content-Type": "application/json", "x-caller-id": callerId }
           });
           if (azureResponse.ok) {
             const result = await azureResponse.json();
@@ -0,0 +1,331 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from kql_parser import KqlSyntaxError, parse_query, scalar_lets, substitute_lets, parse_expression, parse_assignment, split_by_clause, split_top_level, referenced_columns
+from kql_evaluator import UnsupportedQueryError, evaluate_expression, evaluate_operators
+
+CUBE_SOURCE = "GetTenantVersions"
+CUBE_DIMENSIONS = ("sdpStage", "releaseChannel", "regions", "sku", "version")
+CUBE_BUILD_QUERY = f"{CUBE_SOURCE}\n| summarize count() by {', '.join(CUBE_DIMENSIONS)}"
+
+TENANT_CUBE_PATH = os.environ.get("TENANT_CUBE_PATH", os.path.join(tempfile.gettempdir(), "apim_nl_kusto_tenant_cube.bin"))
+TENANT_CUBE_MAX_AGE_SECONDS = float(os.environ.get("TENANT_CUBE_MAX_AGE_SECONDS", 15 * 60))
+TENANT_CUBE_RETRY_SECONDS = 60
+
+_MAGIC = b"TCUBE001"
+_HEADER_PREFIX = struct.Struct("<8sI")
+
+
+def _split_conjuncts(node) -> list:
+    if node[0] == "binop" and node[1] == "and":
+        return _split_conjuncts(node[2]) + _split_conjuncts(node[3])
+    return [node]
+
+
+def write_tenant_cube(rows: list, path: str = TENANT_CUBE_PATH) -> int:
+    """
+    Encode aggregated GetTenantVersions rows into a memory-mappable cube file.
+
+    Dimension values are dictionary-encoded; the file holds one code array per
+    dimension followed by the count array. The file is replaced atomically so
+    readers in other workers never see a partial cube.
+
+    Args:
+        rows (list): Rows of CUBE_BUILD_QUERY, one per dimension combination
+        path (str, optional): Destination file
+
+    Returns:
+        int: Number of cells written
+    """
+    dictionaries = {dimension: {} for dimension in CUBE_DIMENSIONS}
+    columns = {dimension: [] for dimension in CUBE_DIMENSIONS}
+    counts = array("I")
+    for row in rows:
+        for dimension in CUBE_DIMENSIONS:
+            codes = dictionaries[dimension]
+            value = row.get(dimension)
+            if value not in codes:
+                codes[value] = len(codes)
+            columns[dimension].append(codes[value])
+        counts.append(int(row.get("count_", 0)))
+
+    code_type = "H" if all(len(codes) <= 0xFFFF for codes in dictionaries.values()) else "I"
+    header = json.dumps({
+        "dimensions": list(CUBE_DIMENSIONS),
+        "dictionaries": {dimension: list(codes) for dimension, codes in dictionaries.items()},
+        "cells": len(counts),
+        "code_type": code_type,
+        "byteorder": sys.byteorder,
+        "built_at": time.time(),
+    }, default=str).encode("utf-8")
+    header += b" " * (-(_HEADER_PREFIX.size + len(header)) % 4)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as cube_file:
+            cube_file.write(_HEADER_PREFIX.pack(_MAGIC, len(header)))
+            cube_file.write(header)
+            for dimension in CUBE_DIMENSIONS:
+                array(code_type, columns[dimension]).tofile(cube_file)
+            counts.tofile(cube_file)
+        os.replace(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+    return len(counts)
+
+
+def refresh_tenant_cube(kusto_executor, path: str = TENANT_CUBE_PATH) -> int:
+    """
+    Rebuild the cube from a single aggregation scan on the cluster.
+
+    Args:
+        kusto_executor (callable): Function that runs a query on the cluster and returns rows
+        path (str, optional): Destination file
+
+    Returns:
+        int: Number of cells written
+    """
+    started = time.monotonic()
+    cells = write_tenant_cube(kusto_executor(CUBE_BUILD_QUERY), path)
+    logging.info("Tenant cube refreshed with %d cells in %.2fs", cells, time.monotonic() - started)
+    return cells
+
+
+class TenantCube:
+    """
+    Read-only view of a cube file, shared between workers through mmap.
+
+    The file is re-mapped when a newer version is written, and answers are
+    refused once the cube is older than max_age_seconds. With a kusto_executor, a
+    missing or stale cube is rebuilt by a single background thread, so instances
+    that do not run the timer, or do not share its path, still get a cube.
+    """
+
+    def __init__(self, path: str = TENANT_CUBE_PATH, max_age_seconds: float = TENANT_CUBE_MAX_AGE_SECONDS, kusto_executor=None):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.kusto_executor = kusto_executor
+        self._lock = threading.Lock()
+        self._identity = None
+        self._state = None
+        self._refresh_thread = None
+        self._last_failure = 0.0
+
+    def _load(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if identity == self._identity:
+                return self._state
+            with open(self.path, "rb") as cube_file:
+                mapped = mmap.mmap(cube_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, header_length = _HEADER_PREFIX.unpack_from(mapped, 0)
+            if magic != _MAGIC:
+                raise ValueError(f"'{self.path}' is not a tenant cube file")
+            header = json.loads(bytes(mapped[_HEADER_PREFIX.size:_HEADER_PREFIX.size + header_length]))
+            if header["byteorder"] != sys.byteorder:
+                raise ValueError("Tenant cube was written with a different byte order")
+            view = memoryview(mapped)
+            offset = _HEADER_PREFIX.size + header_length
+            cells = header["cells"]
+            width = array(header["code_type"]).itemsize
+            codes = {}
+            for dimension in header["dimensions"]:
+                codes[dimension] = view[offset:offset + cells * width].cast(header["code_type"])
+                offset += cells * width
+            counts = view[offset:offset + cells * 4].cast("I")
+            self._state = {
+                "dictionaries": header["dictionaries"],
+                "codes": codes,
+                "counts": counts,
+                "built_at": header["built_at"],
+                "mapped": mapped,
+                # Decoded views, built on first use for this cube file
+                "vocabulary": None,
+                "sample_rows": {},
+            }
+            self._identity = identity
+            return self._state
+
+    def _refresh(self) -> None:
+        try:
+            refresh_tenant_cube(self.kusto_executor, self.path)
+        except Exception as e:
+            self._last_failure = time.time()
+            logging.warning("Tenant cube build failed: %s", e)
+
+    def _refresh_in_background(self) -> None:
+        if self.kusto_executor is None or time.time() - self._last_failure < TENANT_CUBE_RETRY_SECONDS:
+            return
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self._refresh, name="tenant-cube-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def _fresh_state(self):
+        state = self._load()
+        if state is None or time.time() - state["built_at"] > self.max_age_seconds:
+            self._refresh_in_background()
+            return None
+        return state
+
+    def vocabulary(self) -> dict:
+        """
+        Distinct values of each dimension, or None when the cube is missing or stale.
+        """
+        state = self._fresh_state()
+        if state is None:
+            return None
+        if state["vocabulary"] is None:
+            state["vocabulary"] = {dimension: list(values) for dimension, values in state["dictionaries"].items()}
+        return state["vocabulary"]
+
+    def sample_rows(self, limit: int = 5000) -> list:
+        """
+        Up to limit distinct dimension combinations as rows, or None when the cube is missing or stale.
+
+        Rows are decoded once per cube file and shared between callers, so they must not be modified.
+        """
+        state = self._fresh_state()
+        if state is None:
+            return None
+        rows = state["sample_rows"].get(limit)
+        if rows is None:
+            dictionaries, codes = state["dictionaries"], state["codes"]
+            rows = state["sample_rows"][limit] = [
+                {dimension: dictionaries[dimension][codes[dimension][cell]] for dimension in dictionaries}
+                for cell in range(min(limit, len(state["counts"])))
+            ]
+        return rows
+
+    def _plan(self, query: str) -> tuple:
+        parsed = parse_query(query)
+        scalars = scalar_lets(parsed)
+        if len(scalars) != len(parsed.lets):
+            raise UnsupportedQueryError("Only literal let statements are supported by the cube")
+        source = [t.value for t in parsed.source]
+        if source not in ([CUBE_SOURCE], [CUBE_SOURCE, "(", ")"]):
+            raise UnsupportedQueryError(f"Cube only covers {CUBE_SOURCE}")
+        operators = [o._replace(tokens=substitute_lets(o.tokens, scalars)) for o in parsed.operators]
+
+        summarize_index = next((i for i, o in enumerate(operators) if o.name == "summarize"), None)
+        if summarize_index is None:
+            raise UnsupportedQueryError("Cube only answers summarize queries")
+
+        filters = []
+        for index, operator in enumerate(operators[:summarize_index]):
+            if operator.name == "where":
+                for conjunct in _split_conjuncts(parse_expression(operator.tokens)):
+                    columns = referenced_columns(conjunct)
+                    if len(columns) != 1 or not columns <= set(CUBE_DIMENSIONS):
+                        raise UnsupportedQueryError("Cube filters must reference exactly one dimension")
+                    filters.append((columns.pop(), conjunct))
+            elif operator.name == "extend":
+                # An extend whose columns are never used later cannot change the aggregate. One that
+                # replaces a dimension would change every later filter and key on it
+                later_tokens = [t for o in operators[index + 1:] for t in o.tokens]
+                for segment in split_top_level(operator.tokens, ","):
+                    name, _ = parse_assignment(segment)
+                    if name is None or name in CUBE_DIMENSIONS or any(t.kind == "ident" and t.value == name for t in later_tokens):
+                        raise UnsupportedQueryError("Cube cannot evaluate extended columns")
+            else:
+                raise UnsupportedQueryError(f"Operator '{operator.name}' before summarize is not supported by the cube")
+
+        aggregate_tokens, by_tokens = split_by_clause(operators[summarize_index].tokens)
+        aggregates = []
+        for segment in split_top_level(aggregate_tokens, ","):
+            name, node = parse_assignment(segment)
+            if node[0] != "call":
+                raise UnsupportedQueryError("Cube only supports count() and dcount(dimension)")
+            if node[1] == "count" and not node[2]:
+                aggregates.append((name or "count_", None))
+            elif node[1] == "dcount" and len(node[2]) == 1 and node[2][0][0] == "col" and node[2][0][1] in CUBE_DIMENSIONS:
+                aggregates.append((name or f"dcount_{node[2][0][1]}", node[2][0][1]))
+            else:
+                raise UnsupportedQueryError("Cube only supports count() and dcount(dimension)")
+
+        keys = []
+        for segment in split_top_level(by_tokens or [], ","):
+            if not segment:
+                continue
+            name, node = parse_assignment(segment)
+            if node[0] != "col" or node[1] not in CUBE_DIMENSIONS:
+                raise UnsupportedQueryError("Cube can only group by its dimensions")
+            keys.append((name or node[1], node[1]))
+        return filters, keys, aggregates, operators[summarize_index + 1:]
+
+    def answer(self, query: str) -> list:
+        """
+        Answer a roll-up or slice of GetTenantVersions from the cube.
+
+        Supported shape: GetTenantVersions, then `where` filters that each touch a
+        single dimension, then `summarize count()`/`dcount(dimension)` by dimensions,
+        then any operators the local evaluator supports.
+
+        Args:
+            query (str): Generated KQL query
+
+        Returns:
+            list: Result rows, or None when the cube is missing, stale or cannot answer exactly
+        """
+        try:
+            filters, keys, aggregates, remaining = self._plan(query)
+        except (KqlSyntaxError, UnsupportedQueryError) as e:
+            logging.debug("Query is not answerable from the tenant cube: %s", e)
+            return None
+        state = self._fresh_state()
+        if state is None:
+            return None
+
+        dictionaries, codes, counts = state["dictionaries"], state["codes"], state["counts"]
+        try:
+            allowed = {}
+            for dimension, node in filters:
+                mask = allowed.get(dimension) or [True] * len(dictionaries[dimension])
+                allowed[dimension] = [
+                    keep and evaluate_expression(node, {dimension: value}) is True
+                    for keep, value in zip(mask, dictionaries[dimension])
+                ]
+
+            groups = {}
+            filter_columns = [(codes[d], mask) for d, mask in allowed.items()]
+            key_columns = [codes[dimension] for _, dimension in keys]
+            for cell in range(len(counts)):
+                if not all(mask[column[cell]] for column, mask in filter_columns):
+                    continue
+                key = tuple(column[cell] for column in key_columns)
+                state_row = groups.get(key)
+                if state_row is None:
+                    state_row = groups[key] = [0 if dimension is None else set() for _, dimension in aggregates]
+                for index, (_, dimension) in enumerate(aggregates):
+                    if dimension is None:
+                        state_row[index] += counts[cell]
+                    else:
+                        state_row[index].add(codes[dimension][cell])
+            if not keys and not groups:
+                groups[()] = [0 if dimension is None else set() for _, dimension in aggregates]
+
+            output_columns = [name for name, _ in keys] + [name for name, _ in aggregates]
+            rows = []
+            for key, state_row in groups.items():
+                values = [dictionaries[dimension][code] for (_, dimension), code in zip(keys, key)]
+                values += [len(v) if isinstance(v, set) else v for v in state_row]
+                rows.append(dict(zip(output_columns, values)))
+            return evaluate_operators(remaining, rows, output_columns)
+        except UnsupportedQueryError as e:
+            logging.debug("Query is not answerable from the tenant cube: %s", e)
+            return None
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import time
+from logging.handlers import RotatingFileHandler
+
+TRAFFIC_CAPTURE_PATH = os.environ.get("TRAFFIC_CAPTURE_PATH")
+TRAFFIC_CAPTURE_MAX_BYTES = int(os.environ.get("TRAFFIC_CAPTURE_MAX_BYTES", 10 * 1024 * 1024))
+TRAFFIC_CAPTURE_BACKUPS = int(os.environ.get("TRAFFIC_CAPTURE_BACKUPS", 5))
+TRAFFIC_REPLAY_STANDINS = os.environ.get("TRAFFIC_REPLAY_STANDINS")
+
+# Request parameters, besides the prompt, that change how a request is served and are replayed with it
+CAPTURED_OPTIONS = ("conversation_id", "max_rows", "columns", "top_n_by", "others_bucket", "summary", "incremental", "priority", "async")
+# Internal routes and the HTTP route their requests arrived on
+PUBLIC_ROUTES = {"kusto_nl_job": "kusto_nl_query"}
+
+_capture_logger = None
+
+
+def _get_capture_logger():
+    global _capture_logger
+    if _capture_logger is None and TRAFFIC_CAPTURE_PATH:
+        logger = logging.getLogger("apim_nl_kusto.traffic_capture")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = RotatingFileHandler(TRAFFIC_CAPTURE_PATH, maxBytes=TRAFFIC_CAPTURE_MAX_BYTES, backupCount=TRAFFIC_CAPTURE_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        _capture_logger = logger
+    return _capture_logger
+
+
+def result_shape(results: list) -> dict:
+    """
+    Describe a result set by row count, columns and serialized size, without its values.
+    """
+    results = results or []
+    return {
+        "row_count": len(results),
+        "columns": list(results[0].keys()) if results else [],
+        "bytes": len(json.dumps(results, default=str)),
+    }
+
+
+def capture_request(metrics, prompt: str, generated_query: str = None, results: list = None, summary: str = None, status: int = 200, request_options: dict = None) -> None:
+    """
+    Append one request to the rotating capture log when TRAFFIC_CAPTURE_PATH is set.
+
+    Args:
+        metrics (RequestMetrics): Timings collected for the request
+        prompt (str): Natural language prompt
+        generated_query (str, optional): Generated KQL query
+        results (list, optional): Query results; only their shape is recorded
+        summary (str, optional): Summary text; only its length is recorded
+        status (int, optional): HTTP status returned to the caller
+        request_options (dict, optional): CAPTURED_OPTIONS the caller sent, replayed by load_replay
+    """
+    logger = _get_capture_logger()
+    if logger is None:
+        return
+    record = {
+        "timestamp": time.time(),
+        "route": metrics.route,
+        "public_route": PUBLIC_ROUTES.get(metrics.route, metrics.route),
+        "status": status,
+        "prompt": prompt,
+        "request_options": request_options or {},
+        "generated_query": generated_query,
+        "result_shape": result_shape(results),
+        "summary_chars": len(summary or ""),
+        "stages_ms": {name: round(ms, 2) for name, ms in metrics.stages.items()},
+        "total_ms": round(metrics.elapsed_ms(), 2),
+        "token_usage": metrics.token_usage,
+        "attributes": metrics.attributes,
+    }
+    try:
+        logger.info(json.dumps(record, default=str, ensure_ascii=False))
+    except Exception as e:
+        logging.warning("Failed to capture request: %s", e)
+
+
+def load_capture(paths: list) -> list:
+    """
+    Read captured request records from one or more capture files.
+    """
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as capture_file:
+            records.extend(json.loads(line) for line in capture_file if line.strip())
+    return records
+
+
+class ReplayStandIns:
+    """
+    Local replacements for the LLM and Kusto that replay recorded latencies and payload sizes.
+
+    Enabled in the Function app by pointing TRAFFIC_REPLAY_STANDINS at a capture file.
+    """
+
+    def __init__(self, records: list):
+        self.by_prompt = {}
+        self.by_query = {}
+        for record in records:
+            if record.get("status", 200) != 200:
+                continue
+            self.by_prompt.setdefault(record["prompt"], record)
+            if record.get("generated_query"):
+                self.by_query.setdefault(record["generated_query"], record)
+        self.default = next(iter(self.by_prompt.values()), None)
+        if self.default is None:
+            raise ValueError("Capture has no successful requests to replay")
+
+    def _sleep(self, record: dict, stage: str) -> None:
+        time.sleep(record.get("stages_ms", {}).get(stage, 0) / 1000)
+
+    def generate_query(self, prompt: str) -> str:
+        record = self.by_prompt.get(prompt, self.default)
+        self._sleep(record, "generate")
+        return record.get("generated_query") or "GetTenantVersions | take 0"
+
+    def execute_query(self, query: str) -> list:
+        record = self.by_query.get(query, self.default)
+        self._sleep(record, "query")
+        shape = record["result_shape"]
+        columns = shape["columns"] or ["value"]
+        row_count = shape["row_count"]
+        if row_count == 0:
+            return []
+        # Pad string cells so the serialized payload is close to the recorded size
+        overhead = len(json.dumps([{column: "" for column in columns}])) * row_count
+        cell_length = max(0, (shape["bytes"] - overhead) // (row_count * len(columns)))
+        return [{column: "x" * cell_length for column in columns} for _ in range(row_count)]
+
+    def summarize(self, query: str) -> str:
+        record = self.by_query.get(query, self.default)
+        self._sleep(record, "summarize")
+        return "s" * record.get("summary_chars", 0)
+
+
+replay_standins = ReplayStandIns(load_capture([TRAFFIC_REPLAY_STANDINS])) if TRAFFIC_REPLAY_STANDINS else None
@@ -1,4 +1,5 @@
 import enum
+import io
 import os
 import uuid
 import json
@@ -6,7 +7,7 @@ from azure.identity import DefaultAzureCredential
 from time import sleep
 from azure.kusto.data import KustoConnectionStringBuilder, ClientRequestProperties, KustoClient, DataFormat
 from azure.kusto.data.exceptions import KustoClientError, KustoServiceError
-from azure.kusto.ingest import IngestionProperties, BaseIngestClient, QueuedIngestClient, FileDescriptor, BlobDescriptor
+from azure.kusto.ingest import IngestionProperties, BaseIngestClient, QueuedIngestClient, FileDescriptor, BlobDescriptor, StreamDescriptor
 
 class AuthenticationModeOptions(enum.Enum):
     """
@@ -72,6 +73,20 @@ class Utils:
             kcsb = KustoConnectionStringBuilder.with_aad_managed_service_identity_authentication(cluster_url)
             return kcsb.with_aad_application_token_authentication(cluster_url, token.token)
 
+        @classmethod
+        def create_refreshing_managed_identity_connection_string(cls, cluster_url: str) -> KustoConnectionStringBuilder:
+            """
+            Generates a 'ManagedIdentity' Kusto Connection String for long-lived clients.
+            The token is requested through a callback on every use, so it is renewed before it expires instead of being fixed at creation time.
+            :param cluster_url: Url of cluster to connect to
+            :return: ManagedIdentity Kusto Connection String with a token provider
+            """
+
+            credential = DefaultAzureCredential()
+            return KustoConnectionStringBuilder.with_token_provider(
+                cluster_url, lambda: credential.get_token("https://kusto.kusto.windows.net/.default").token
+            )
+
         @classmethod
         def create_application_certificate_connection_string(cls, cluster_url: str) -> KustoConnectionStringBuilder:
             """
@@ -110,6 +125,43 @@ class Utils:
                     cluster_url, app_id, pem_certificate, cert_thumbprint, app_tenant
                 )
 
+    class Ingestion:
+        """
+        Ingestion module of Utils - in charge of queuing data for ingestion into the system
+        """
+
+        @staticmethod
+        def create_queued_ingest_client(ingest_url: str, authentication_mode: AuthenticationModeOptions) -> QueuedIngestClient:
+            """
+            Creates a queued ingestion client for the cluster's ingestion endpoint.
+            :param ingest_url: Ingestion endpoint of the cluster (https://ingest-<cluster>...)
+            :param authentication_mode: User Authentication Mode, Options: (UserPrompt|ManagedIdentity|AppKey|AppCertificate)
+            :return: A QueuedIngestClient
+            """
+            if authentication_mode == AuthenticationModeOptions.ManagedIdentity.name:
+                # The client lives for the whole process, so it must not keep a one-time token
+                return QueuedIngestClient(Utils.Authentication.create_refreshing_managed_identity_connection_string(ingest_url))
+            return QueuedIngestClient(Utils.Authentication.generate_connection_string(ingest_url, authentication_mode))
+
+        @staticmethod
+        def ingest_json_records(client: BaseIngestClient, database_name: str, table_name: str, records: list, mapping_name: str = None) -> None:
+            """
+            Queues a batch of JSON records for ingestion as a single multi-JSON stream.
+            :param client: Ingestion client
+            :param database_name: Target database
+            :param table_name: Target table
+            :param records: JSON-serializable records, one per row
+            :param mapping_name: Optional name of a JSON ingestion mapping on the table
+            """
+            payload = "\n".join(json.dumps(record, default=str, ensure_ascii=False) for record in records).encode("utf-8")
+            ingestion_properties = IngestionProperties(
+                database=database_name,
+                table=table_name,
+                data_format=DataFormat.MULTIJSON,
+                ingestion_mapping_reference=mapping_name,
+            )
+            client.ingest_from_stream(StreamDescriptor(io.BytesIO(payload)), ingestion_properties=ingestion_properties)
+
     @classmethod
     def load_configs(cls, config_file_name: str) -> dict :
         """